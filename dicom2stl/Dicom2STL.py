@@ -20,7 +20,6 @@ import gc
 import math
 import os
 import sys
-import tempfile
 import time
 import zipfile
 import re
@@ -28,12 +27,23 @@ from glob import glob
 import vtk
 import SimpleITK as sitk
 
-from SimpleITK.utilities.vtk import sitk2vtk
+from dicom2stl.utils.sitk2vtk import sitk2vtk
 
 
 from dicom2stl.utils import dicomutils
+from dicom2stl.utils import lazyvolume
 from dicom2stl.utils import vtkutils
 from dicom2stl.utils import parseargs
+from dicom2stl.utils import memorybudget
+from dicom2stl.utils import slabpipeline
+from dicom2stl.utils import slabextract
+from dicom2stl.utils import profiler
+from dicom2stl.utils import threads
+from dicom2stl.utils import tissueclassify
+from dicom2stl.utils import volumefilters
+from dicom2stl.utils import volumestats
+from dicom2stl.utils.seriesindex import defaultCacheDir
+from dicom2stl.utils.threads import threadCount
 
 
 def roundThousand(x):
@@ -48,10 +58,28 @@ def elapsedTime(start_time):
     print(f"    {dt:4.3f} seconds")
 
 
-def loadVolume(fname, tempDir=None, verbose=0):
-    """Load the volume image from a zip file, a directory of Dicom files,
-    or a single volume image.  Return the SimpleITK image and the modality."""
-    modality = None
+def openVolume(
+    fname,
+    tempDir=None,
+    verbose=0,
+    cacheDir=None,
+    workers=None,
+    volumeCacheDir=None,
+    search=None,
+    decoder=None,
+):
+    """Open the volume image from a zip file, a directory of Dicom files,
+    or a single volume image, reading only the headers.  Return a lazy
+    volume that knows the modality and geometry and decodes the pixels when
+    its GetImage method is called.
+    If cacheDir is given, Dicom directories are scanned using the series
+    index cache in that directory.  If workers is given, Dicom slices are
+    decoded by that many processes in parallel (0 for one per CPU).  If
+    volumeCacheDir is given, decoded volumes are saved there and memory
+    mapped by later runs on the same, unchanged input.  If search is given,
+    the largest Dicom series whose headers match it is chosen (see
+    dicomutils.parseSearch).  decoder chooses the Dicom slice decoder
+    backend, one of seriesreader.DECODERS."""
     zipFlag = False
     dirFlag = False
 
@@ -67,32 +95,56 @@ def loadVolume(fname, tempDir=None, verbose=0):
 
     dirFlag = os.path.isdir(fname[0])
 
-    img = sitk.Image(100, 100, 100, sitk.sitkUInt8)
-
-    #  Load our Dicom data
+    #  Find our Dicom data
     #
-    if zipFlag:
-        # Case for a zip file of images
-        if not tempDir:
-            with tempfile.TemporaryDirectory() as defaultTempDir:
-                img, modality = dicomutils.loadZipDicom(fname[0], defaultTempDir)
+    if zipFlag or dirFlag:
+        if zipFlag:
+            # Case for a zip file of images.  The zip is read in place,
+            # tempDir is only used to spool very large members.
+            found = dicomutils.findLargestZipSeries(fname[0], search)
+            if tempDir is not None:
+                os.makedirs(tempDir, exist_ok=True)
+            if workers is None:
+                workers = 1
         else:
-            img, modality = dicomutils.loadZipDicom(fname[0], tempDir)
+            found = dicomutils.findLargestSeries(fname[0], cacheDir, search)
+        if found is None:
+            print("Error: no Dicom series found in", fname[0])
+            sys.exit(4)
+        seriesUID, sources, headers = found
+        vol = lazyvolume.DicomSeriesVolume(
+            sources,
+            headers,
+            seriesUID,
+            workers,
+            tempDir,
+            [fname[0]] if zipFlag else None,
+            decoder,
+        )
 
     else:
-        if dirFlag:
-            img, modality = dicomutils.loadLargestSeries(fname[0])
+        if search:
+            print("Warning: the series search only applies to zip files and")
+            print("directories of Dicom files")
 
-        else:
-            # Case for a single volume image
-            if len(fname) == 1:
-                if verbose:
-                    print("Reading volume: ", fname[0])
-                img = sitk.ReadImage(fname[0])
-                modality = dicomutils.getModality(img)
+        # Case for a single volume image
+        if len(fname) == 1:
+            if verbose:
+                print("Reading volume: ", fname[0])
+            vol = lazyvolume.ImageFileVolume(fname[0])
 
+        else:
+            # Case for a series of image files.  Dicom slices are ordered
+            # by their position along the slice normal, from the headers.
+            headers = dicomutils.readDicomHeaders(fname)
+            isDicom = all(headers[f] is not None for f in fname)
+
+            if isDicom:
+                fname, report = dicomutils.sortSlices(
+                    fname, [headers[f] for f in fname]
+                )
+                printSliceReport(report)
             else:
-                # Case for a series of image files
                 # For files named like IM1, IM2, .. IM10
                 # They would be ordered by default as IM1, IM10, IM2, ...
                 # sort the fname list in correct serial number order
@@ -104,24 +156,96 @@ def loadVolume(fname, tempDir=None, verbose=0):
 
                 fname = sorted(fname, key=extract_int)
 
-                if verbose:
-                    if verbose > 1:
-                        print("Reading images: ", fname)
-                    else:
-                        print(
-                            "Reading images: ",
-                            fname[0],
-                            fname[1],
-                            "...",
-                            fname[len(fname) - 1],
-                        )
-                isr = sitk.ImageSeriesReader()
-                isr.SetFileNames(fname)
-                img = isr.Execute()
-                firstslice = sitk.ReadImage(fname[0])
-                modality = dicomutils.getModality(firstslice)
-
-    return img, modality
+            if verbose:
+                if verbose > 1:
+                    print("Reading images: ", fname)
+                else:
+                    print(
+                        "Reading images: ",
+                        fname[0],
+                        fname[1],
+                        "...",
+                        fname[len(fname) - 1],
+                    )
+            if isDicom:
+                vol = lazyvolume.DicomSeriesVolume(
+                    fname,
+                    [headers[f] for f in fname],
+                    "",
+                    workers,
+                    decoder=decoder,
+                )
+            else:
+                vol = lazyvolume.ImageSeriesVolume(fname)
+
+    vol.SetVolumeCache(volumeCacheDir)
+    return vol
+
+
+def applyRegion(vol, slices=None, roi=None, roiMM=None):
+    """Restrict a lazy volume to the region of interest given by the
+    --slices ("START:STOP"), --roi ("X0,Y0,X1,Y1") and --roi-mm
+    ("X0,Y0,Z0,X1,Y1,Z1") option strings.  Raise ValueError if a string
+    is malformed."""
+    if roiMM:
+        if slices or roi:
+            raise ValueError("--roi-mm cannot be combined with --slices or --roi")
+        values = [float(x) for x in roiMM.split(",")]
+        if len(values) != 6:
+            raise ValueError("--roi-mm needs 6 values: " + roiMM)
+        vol.SetPhysicalRegion(values[:3], values[3:])
+        return
+
+    if not (slices or roi):
+        return
+    size = list(vol.GetSize())
+    index = [0] * len(size)
+    if roi:
+        values = [int(x) for x in roi.split(",")]
+        if len(values) != 4:
+            raise ValueError("--roi needs 4 values: " + roi)
+        index[0], index[1] = values[0], values[1]
+        size[0], size[1] = values[2] - values[0], values[3] - values[1]
+    if slices:
+        words = slices.split(":")
+        if len(words) != 2 or len(size) < 3:
+            raise ValueError("Bad slice range: " + slices)
+        z0 = int(words[0]) if words[0] else 0
+        z1 = int(words[1]) if words[1] else size[2]
+        index[2], size[2] = z0, z1 - z0
+    vol.SetRegion(index, size)
+
+
+def printSliceReport(report):
+    """Print warnings about the slice spacing found by dicomutils.sortSlices"""
+    for a, b in report["duplicates"]:
+        print("Warning: duplicate slice position:", a, b)
+    for a, b in report["gaps"]:
+        print("Warning: missing slices between", a, "and", b)
+    if not report["uniform"]:
+        print(
+            "Warning: non-uniform slice spacing, median spacing",
+            report["spacing"],
+        )
+
+
+def loadVolume(
+    fname,
+    tempDir=None,
+    verbose=0,
+    cacheDir=None,
+    workers=None,
+    volumeCacheDir=None,
+    search=None,
+    decoder=None,
+):
+    """Load the volume image from a zip file, a directory of Dicom files,
+    or a single volume image.  Return the SimpleITK image and the modality.
+    The arguments are the same as for openVolume."""
+    vol = openVolume(
+        fname, tempDir, verbose, cacheDir, workers, volumeCacheDir, search, decoder
+    )
+    return vol.GetImage(), vol.GetModality()
 
 
 def writeMetadataFile(img, metaName):
@@ -137,21 +261,25 @@ def writeMetadataFile(img, metaName):
         fp.write(b"zspacing " + roundThousand(spacing[2]).encode() + b"\n")
 
 
+def shrinkFactors(size, newsize):
+    """Compute the integer shrink factors that reduce each dimension of
+    a volume to newsize or less"""
+    return [int(math.ceil(s / float(newsize))) for s in size]
+
+
 def shrinkVolume(input_image, newsize):
     """Shrink the volume to a new size"""
     size = input_image.GetSize()
-    total = 0
-    sfactor = []
-    for s in size:
-        x = int(math.ceil(s / float(newsize)))
-        sfactor.append(x)
-        total = total + x
+    sfactor = shrinkFactors(size, newsize)
+    total = sum(sfactor)
 
     if total > 3:
         # if total==3, no shrink happens
         t = time.perf_counter()
         print("Shrink factors: ", sfactor)
-        img = sitk.Shrink(input_image, sfactor)
+        with profiler.stage("shrink", input=profiler.voxels(input_image)) as rec:
+            img = sitk.Shrink(input_image, sfactor)
+            rec["output"] = profiler.voxels(img)
         newsize = img.GetSize()
         print(size, "->", newsize)
         elapsedTime(t)
@@ -160,64 +288,127 @@ def shrinkVolume(input_image, newsize):
     return input_image
 
 def volumeProcessingPipeline(
-    img, shrinkFlag=True, anisotropicSmoothing=False, thresholds=None, medianFilter=False
+    img,
+    shrinkFlag=True,
+    anisotropicSmoothing=False,
+    thresholds=None,
+    medianFilter=False,
+    smoothingEngine="curvature",
+    medianEngine="auto",
+    medianRadius=[3, 3, 1],
+    stats=None,
+    tissueThresholds=None,
+    tissueMedians=None,
+    numThreads=None,
 ):
-    """Apply a series of filters to the volume image"""
-    #
-    # shrink the volume to 256 cubed
-    if shrinkFlag:
-        shrinkVolume(img, 256)
-
-    gc.collect()
+    """Apply a series of filters to the volume image
+
+    stats are the intensity statistics of img from volumestats, used for
+    the pad value instead of another pass over the volume.
+
+    numThreads is the number of threads the filters use (0 for one per CPU),
+    or None to keep the current setting.  The previous setting is restored
+    afterwards.
+
+    If tissueThresholds, a list of double thresholds, is given, the volume
+    is classified into all the tissues at once instead of being double
+    thresholded, and the result has bit i set inside tissue i.
+    tissueMedians says which tissues get the median filter.
+    """
+    with threadCount(numThreads):
+        #
+        # shrink the volume to 256 cubed
+        if shrinkFlag:
+            img = shrinkVolume(img, 256)
 
-    # Apply anisotropic smoothing to the volume image.  That's a smoothing
-    # filter that preserves edges.
-    #
-    if anisotropicSmoothing:
-        print("Anisotropic Smoothing")
-        t = time.perf_counter()
-        pixelType = img.GetPixelID()
-        img = sitk.Cast(img, sitk.sitkFloat32)
-        img = sitk.CurvatureAnisotropicDiffusion(img, 0.03)
-        img = sitk.Cast(img, pixelType)
-        elapsedTime(t)
         gc.collect()
 
-    # Apply the double threshold filter to the volume
-    #
-    if isinstance(thresholds, list) and len(thresholds)==4:
-        print("Double Threshold: ", thresholds)
-        t = time.perf_counter()
-        img = sitk.DoubleThreshold(
-            img, thresholds[0], thresholds[1], thresholds[2], thresholds[3], 255, 0
-        )
-        elapsedTime(t)
-        gc.collect()
+        # Apply anisotropic smoothing to the volume image.  That's a smoothing
+        # filter that preserves edges.
+        #
+        if anisotropicSmoothing:
+            print("Anisotropic Smoothing:", smoothingEngine)
+            t = time.perf_counter()
+            with profiler.stage(
+                "anisotropic", input=profiler.voxels(img), engine=smoothingEngine
+            ) as rec:
+                img = volumefilters.smoothVolume(img, smoothingEngine)
+                rec["output"] = profiler.voxels(img)
+            elapsedTime(t)
+            gc.collect()
+
+        # Classify the volume into several tissues
+        #
+        if tissueThresholds:
+            print("Tissue classification: ", tissueThresholds)
+            t = time.perf_counter()
+            with profiler.stage("classify", input=profiler.voxels(img)) as rec:
+                img = tissueclassify.tissueLabels(
+                    img, tissueThresholds, tissueMedians, medianEngine, medianRadius
+                )
+                rec["output"] = profiler.voxels(img)
+            elapsedTime(t)
+            gc.collect()
+
+        # Apply the double threshold filter to the volume
+        #
+        if isinstance(thresholds, list) and len(thresholds)==4:
+            print("Double Threshold: ", thresholds)
+            t = time.perf_counter()
+            with profiler.stage("threshold", input=profiler.voxels(img)) as rec:
+                img = sitk.DoubleThreshold(
+                    img,
+                    thresholds[0],
+                    thresholds[1],
+                    thresholds[2],
+                    thresholds[3],
+                    255,
+                    0,
+                )
+                rec["output"] = profiler.voxels(img)
+            elapsedTime(t)
+            gc.collect()
+
+        # Apply a 3x3x1 median filter.  I only use 1 in the Z direction so it's
+        # not so slow.  After the double threshold the volume is a label volume,
+        # which the binary median engines filter much faster.
+        #
+        if medianFilter:
+            binary = isinstance(thresholds, list) and len(thresholds) == 4
+            if medianEngine == "auto":
+                medianEngine = volumefilters.chooseMedianEngine(img, binary)
+            print("Median filter:", medianEngine, medianRadius)
+            t = time.perf_counter()
+            with profiler.stage(
+                "median", input=profiler.voxels(img), engine=medianEngine
+            ) as rec:
+                img = volumefilters.medianVolume(
+                    img, medianRadius, medianEngine, binary
+                )
+                rec["output"] = profiler.voxels(img)
+            elapsedTime(t)
+            gc.collect()
+
+        #
+        # Get the minimum image intensity for padding the image.  After the
+        # double threshold it is the label background.
+        #
+        with profiler.stage("pad", input=profiler.voxels(img)) as rec:
+            if tissueThresholds or (
+                isinstance(thresholds, list) and len(thresholds) == 4
+            ):
+                minVal = 0
+            else:
+                minVal = volumestats.padValue(stats, img)
 
-    # Apply a 3x3x1 median filter.  I only use 1 in the Z direction so it's
-    # not so slow.
-    #
-    if medianFilter:
-        print("Median filter")
-        t = time.perf_counter()
-        img = sitk.Median(img, [3, 3, 1])
-        elapsedTime(t)
+            # Pad black to the boundaries of the image
+            #
+            pad = [5, 5, 5]
+            img = sitk.ConstantPad(img, pad, pad, minVal)
+            rec["output"] = profiler.voxels(img)
         gc.collect()
 
-    #
-    # Get the minimum image intensity for padding the image
-    #
-    stats = sitk.StatisticsImageFilter()
-    stats.Execute(img)
-    minVal = stats.GetMinimum()
-
-    # Pad black to the boundaries of the image
-    #
-    pad = [5, 5, 5]
-    img = sitk.ConstantPad(img, pad, pad, minVal)
-    gc.collect()
-
-    return img
+        return img
 
 
 def meshProcessingPipeline(
@@ -228,46 +419,67 @@ def meshProcessingPipeline(
     reduceFactor=0.9,
     rotation=["X", 0.0],
     debug=False,
+    numThreads=None,
 ):
-    """Apply a series of filters to the mesh"""
-    if debug:
-        print("Cleaning mesh")
-    mesh2 = vtkutils.cleanMesh(mesh, connectivityFilter)
-    mesh = None
-    gc.collect()
+    """Apply a series of filters to the mesh
+
+    numThreads is the number of threads the filters use, as for
+    volumeProcessingPipeline.
+    """
+    with threadCount(numThreads):
+        if debug:
+            print("Cleaning mesh")
+        with profiler.stage("clean", input=profiler.triangles(mesh)) as rec:
+            mesh2 = vtkutils.cleanMesh(mesh, connectivityFilter)
+            rec["output"] = profiler.triangles(mesh2)
+        mesh = None
+        gc.collect()
 
-    if debug:
-        print(f"Cleaning small parts ratio{smallFactor}")
-    mesh_cleaned_parts = vtkutils.removeSmallObjects(mesh2, smallFactor)
-    mesh2 = None
-    gc.collect()
+        if debug:
+            print(f"Cleaning small parts ratio{smallFactor}")
+        with profiler.stage("smallParts", input=profiler.triangles(mesh2)) as rec:
+            mesh_cleaned_parts = vtkutils.removeSmallObjects(mesh2, smallFactor)
+            rec["output"] = profiler.triangles(mesh_cleaned_parts)
+        mesh2 = None
+        gc.collect()
 
-    if debug:
-        print("Smoothing mesh", smoothN, "iterations")
-    mesh3 = vtkutils.smoothMesh(mesh_cleaned_parts, smoothN)
-    mesh_cleaned_parts = None
-    gc.collect()
+        if smoothN > 0:
+            if debug:
+                print("Smoothing mesh", smoothN, "iterations")
+            with profiler.stage(
+                "smooth", input=profiler.triangles(mesh_cleaned_parts)
+            ) as rec:
+                mesh3 = vtkutils.smoothMesh(mesh_cleaned_parts, smoothN)
+                rec["output"] = profiler.triangles(mesh3)
+        else:
+            mesh3 = mesh_cleaned_parts
+        mesh_cleaned_parts = None
+        gc.collect()
 
-    if debug:
-        print("Simplifying mesh")
-    mesh4 = vtkutils.reduceMesh(mesh3, reduceFactor)
-    mesh3 = None
-    gc.collect()
+        if debug:
+            print("Simplifying mesh")
+        with profiler.stage("reduce", input=profiler.triangles(mesh3)) as rec:
+            mesh4 = vtkutils.reduceMesh(mesh3, reduceFactor)
+            rec["output"] = profiler.triangles(mesh4)
+        mesh3 = None
+        gc.collect()
 
-    print(rotation)
-    axis_map = {"X": 0, "Y": 1, "Z": 2}
-    try:
-        rotAxis = axis_map[rotation[0]]
-        if rotation[1] != 0.0:
-            mesh5 = vtkutils.rotateMesh(mesh4, rotAxis, rotation[1])
-        else:
+        print(rotation)
+        axis_map = {"X": 0, "Y": 1, "Z": 2}
+        try:
+            rotAxis = axis_map[rotation[0]]
+            if rotation[1] != 0.0:
+                with profiler.stage("rotate", input=profiler.triangles(mesh4)) as rec:
+                    mesh5 = vtkutils.rotateMesh(mesh4, rotAxis, rotation[1])
+                    rec["output"] = profiler.triangles(mesh5)
+            else:
+                mesh5 = mesh4
+        except RuntimeError:
             mesh5 = mesh4
-    except RuntimeError:
-        mesh5 = mesh4
-    mesh4 = None
-    gc.collect()
+        mesh4 = None
+        gc.collect()
 
-    return mesh5
+        return mesh5
 
 
 def getTissueThresholds(tissueType):
@@ -293,6 +505,12 @@ def getTissueThresholds(tissueType):
     return thresholds, medianFilter
 
 
+def tissueOutputName(output, tissueType):
+    """Get the output file name of one tissue, e.g. result_bone.stl"""
+    root, ext = os.path.splitext(output)
+    return f"{root}_{tissueType}{ext}"
+
+
 def Dicom2STL(args):
     """The primary dicom2stl function"""
     # Global variables
@@ -302,6 +520,12 @@ def Dicom2STL(args):
     connectivityFilter = False
     anisotropicSmoothing = False
     medianFilter = False
+    smoothingEngine = args.smoothing_engine or "curvature"
+    medianEngine = args.median_engine or "auto"
+    medianRadius = [3, 3, 1]
+
+    if args.profile:
+        profiler.start()
 
     # Handle enable/disable filters
 
@@ -321,15 +545,49 @@ def Dicom2STL(args):
             if y.startswith("large"):
                 connectivityFilter = val
 
+    # Choosing a smoothing engine turns the smoothing on
+    if args.smoothing_engine:
+        anisotropicSmoothing = True
+
     print("")
-    if args.temp is None:
-        args.temp = tempfile.mkdtemp()
-    print("Temp dir: ", args.temp)
+    if args.temp is not None:
+        print("Temp dir: ", args.temp)
 
     if args.tissue:
         thresholds, medianFilter = getTissueThresholds(args.tissue)
 
-    if args.double_threshold:
+    # Several tissues, each meshed from the same classified volume
+    tissueTypes = []
+    tissueThresholds = []
+    tissueMedians = []
+    if args.tissues:
+        if args.tissue or args.double_threshold:
+            print("Error: --tissues can not be used with --type or --double")
+            sys.exit(3)
+        tissueTypes = [x.strip() for x in args.tissues.split(",") if x.strip()]
+        for x in tissueTypes:
+            t, m = getTissueThresholds(x)
+            if t is None or tissueTypes.count(x) > 1:
+                print("Error: bad tissue type", x)
+                sys.exit(3)
+            tissueThresholds.append(t)
+            tissueMedians.append(m)
+        if len(tissueTypes) > tissueclassify.MAX_TISSUES:
+            print("Error: at most", tissueclassify.MAX_TISSUES, "tissue types")
+            sys.exit(3)
+
+    if args.median_radius:
+        try:
+            medianRadius = [int(x) for x in args.median_radius.split(",")]
+            if len(medianRadius) != 3 or min(medianRadius) < 0:
+                raise ValueError
+        except ValueError:
+            print("Error: bad median radius", args.median_radius)
+            sys.exit(3)
+
+    if tissueTypes:
+        print("Tissue types: ", tissueTypes)
+    elif args.double_threshold:
         words = args.double_threshold.split(";")
         thresholds = []
         for x in words:
@@ -339,34 +597,210 @@ def Dicom2STL(args):
         if len(thresholds) != 4:
             print("Error: Thresholds is not of len 4.", thresholds)
             sys.exit(3)
+        if not isinstance(args.isovalue, float):
+            print("Warning: the isovalue is ignored with double thresholds")
     else:
         print("Isovalue = ", args.isovalue)
 
+    if medianEngine in volumefilters.BINARY_MEDIAN_ENGINES and not (
+        (isinstance(thresholds, list) and len(thresholds) == 4) or tissueTypes
+    ):
+        print(f"Error: the {medianEngine} median engine needs --type or --double")
+        sys.exit(3)
+
+    # The label extractors mesh the label volume of the double threshold
+    labelExtractor = args.extractor in vtkutils.LABEL_EXTRACTORS
+    if labelExtractor and not (
+        (isinstance(thresholds, list) and len(thresholds) == 4) or tissueTypes
+    ):
+        print(
+            f"Error: the {args.extractor} extractor needs"
+            " --type, --double or --tissues"
+        )
+        sys.exit(3)
+
+    # Surface nets smooths the surface itself
+    smoothN = args.smooth
+    if smoothN is None:
+        smoothN = 0 if args.extractor in vtkutils.SMOOTH_EXTRACTORS else 25
+
+    if args.search:
+        try:
+            dicomutils.parseSearch(args.search)
+        except ValueError as e:
+            print("Error:", e)
+            sys.exit(3)
+
+    budget = None
+    if args.memory_budget:
+        try:
+            budget = memorybudget.parseMemorySize(args.memory_budget)
+        except ValueError as e:
+            print("Error:", e)
+            sys.exit(3)
+
+    if args.extract_workers is not None and args.extract_workers < 0:
+        print("Error: bad number of extraction workers", args.extract_workers)
+        sys.exit(3)
+
+    try:
+        threads.setNumberOfThreads(args.threads)
+    except ValueError as e:
+        print("Error:", e)
+        sys.exit(3)
+
     if args.debug:
         print("SimpleITK version: ", sitk.Version.VersionString())
         print("SimpleITK: ", sitk, "\n")
 
+    volumeCacheDir = None
+    if args.cache_volume:
+        volumeCacheDir = os.path.join(args.cache_dir or defaultCacheDir(), "volumes")
+
     #
-    # Load the volume image
-    img, modality = loadVolume(args.filenames, args.temp, args.verbose)
+    # Open the volume image, reading only its headers
+    with profiler.stage("open") as rec:
+        vol = openVolume(
+            args.filenames,
+            args.temp,
+            args.verbose,
+            args.cache_dir,
+            args.workers,
+            volumeCacheDir,
+            args.search,
+            args.decoder,
+        )
+        rec["output"] = profiler.voxels(vol)
 
     if args.ctonly:
-        if modality.find("CT") == -1:
+        if vol.GetModality().find("CT") == -1:
             print("Imaging modality is not CT.  Exiting.")
             sys.exit(1)
 
+    # Restrict the volume to the region of interest before decoding it
+    try:
+        applyRegion(vol, args.slices, args.roi, args.roi_mm)
+    except ValueError as e:
+        print("Error:", e)
+        sys.exit(3)
+
     # Write out the metadata text file
     if args.meta:
-        writeMetadataFile(img, args.meta)
-
-    #
-    # Filter the volume image
-    img = volumeProcessingPipeline(
-        img, shrinkFlag, anisotropicSmoothing, thresholds, medianFilter
-    )
+        writeMetadataFile(vol, args.meta)
+
+    # Shrink the volume while decoding it, instead of shrinking the
+    # full resolution volume after it is loaded
+    slabDepth = args.slab_depth
+    if budget is not None:
+        # Choose the resolution from the memory budget instead of 256 cubed
+        stages = []
+        if anisotropicSmoothing:
+            stages.append("anisotropic")
+        if (isinstance(thresholds, list) and len(thresholds) == 4) or tissueTypes:
+            stages.append("threshold")
+        if medianFilter or any(tissueMedians):
+            stages.append("median")
+        pixelBytes = (
+            vol.GetSizeOfPixelComponent() * vol.GetNumberOfComponentsPerPixel()
+        )
+        # the tissue classification needs the whole volume
+        plan = memorybudget.planMemory(
+            vol.GetSize(),
+            pixelBytes,
+            budget,
+            stages,
+            allowSlabs=not tissueTypes,
+            loadCopies=vol.GetLoadCopies(),
+            smoothingEngine=smoothingEngine,
+            medianEngine=medianEngine,
+            medianRadius=medianRadius,
+        )
+        if plan is None:
+            print("Error: the volume does not fit in", args.memory_budget)
+            sys.exit(3)
+        memorybudget.printPlan(plan, budget)
+        vol.SetShrink(plan["shrink"])
+        shrinkFlag = False
+        if plan["slabDepth"] is not None:
+            slabDepth = plan["slabDepth"]
+    elif shrinkFlag and (args.shrink_on_load or slabDepth):
+        vol.SetShrink(shrinkFactors(vol.GetSize(), 256))
+        shrinkFlag = False
+
+    if slabDepth and tissueTypes:
+        print("Warning: --tissues loads the whole volume, ignoring --slab-depth")
+        slabDepth = None
+
+    if slabDepth:
+        #
+        # Stream the volume through the filters in slabs, so the whole
+        # volume is never loaded
+        with profiler.stage(
+            "slabs", input=profiler.voxels(vol), slabDepth=slabDepth
+        ) as rec:
+            out, geometry = slabpipeline.runSlabPipeline(
+                slabpipeline.volumeSlabReader(vol),
+                slabDepth,
+                slabpipeline.pipelineStages(
+                    anisotropicSmoothing,
+                    thresholds,
+                    medianFilter,
+                    smoothingEngine,
+                    medianEngine,
+                    medianRadius,
+                ),
+                vol.GetSize()[2],
+            )
+            img = slabpipeline.slabsToImage(out, geometry)
+            rec["output"] = profiler.voxels(img)
+        out = None
+        vol = None
+        stats = None
+    else:
+        #
+        # Load the volume image, with its intensity statistics
+        with profiler.stage("load") as rec:
+            img = vol.GetImage()
+            rec["output"] = profiler.voxels(img)
+        stats = vol.GetStatistics()
+        vol = None
+
+        volumestats.printStats(stats)
+        if isinstance(thresholds, list) and len(thresholds) == 4:
+            for warning in volumestats.checkThresholds(stats, thresholds):
+                print("Warning:", warning)
+        for name, t in zip(tissueTypes, tissueThresholds):
+            for warning in volumestats.checkThresholds(stats, t):
+                print(f"Warning: {name}:", warning)
+
+        #
+        # Filter the volume image
+        img = volumeProcessingPipeline(
+            img,
+            shrinkFlag,
+            anisotropicSmoothing,
+            thresholds,
+            medianFilter,
+            smoothingEngine,
+            medianEngine,
+            medianRadius,
+            stats,
+            tissueThresholds,
+            tissueMedians,
+        )
 
     if isinstance(thresholds, list) and len(thresholds) == 4:
-        args.isovalue = 64.0
+        # the label value, or a quarter of the way up from the background
+        args.isovalue = 255.0 if labelExtractor else 64.0
+    elif tissueTypes:
+        pass
+    elif not isinstance(args.isovalue, float):
+        # The slab pipeline never holds the whole input volume, so its
+        # output gets the statistics pass instead
+        if stats is None:
+            stats = volumestats.computeStats(img)
+        args.isovalue = volumestats.suggestIsovalue(stats, args.isovalue)
+        print("Isovalue = ", args.isovalue)
 
     if args.verbose:
         print("\nImage for isocontouring")
@@ -379,9 +813,12 @@ def Dicom2STL(args):
         print("")
 
     # Convert the SimpleITK image to a VTK image
-    vtkimg = sitk2vtk(img)
+    with profiler.stage("sitk2vtk", input=profiler.voxels(img)) as rec:
+        vtkimg = sitk2vtk(img)
+        rec["output"] = profiler.voxels(vtkimg)
 
-    # Delete the SimpleITK image, free its memory
+    # Drop the SimpleITK image.  The VTK image shares its pixel buffer and
+    # keeps it alive, so there is only ever one copy of the volume.
     img = None
     gc.collect()
 
@@ -389,34 +826,68 @@ def Dicom2STL(args):
         print("\nVTK version: ", vtk.vtkVersion.GetVTKVersion())
         print("VTK: ", vtk, "\n")
 
-    # Extract the iso-surface
-    if args.debug:
-        print("Extracting surface")
-    mesh = vtkutils.extractSurface(vtkimg, args.isovalue)
-
-    # Delete the VTK image, free its memory
-    vtkimg = None
-    gc.collect()
+    # One surface, or one per tissue, each from its bit of the label volume
+    if tissueTypes:
+        surfaces = [
+            (
+                x,
+                float(1 << i) if labelExtractor else tissueclassify.tissueIsovalue(i),
+                tissueOutputName(args.output, x),
+            )
+            for i, x in enumerate(tissueTypes)
+        ]
+    else:
+        surfaces = [(None, args.isovalue, args.output)]
+
+    for i, (tissueType, isovalue, output) in enumerate(surfaces):
+        surfaceImg = vtkimg
+        if tissueType is not None:
+            print("\nTissue:", tissueType, "->", output)
+            surfaceImg = tissueclassify.extractTissue(vtkimg, i)
+
+        # Extract the iso-surface
+        if args.debug:
+            print("Extracting surface")
+        with profiler.stage(
+            "contour",
+            input=profiler.voxels(surfaceImg),
+            tissue=tissueType,
+            extractor=args.extractor,
+            workers=args.extract_workers,
+        ) as rec:
+            if args.extract_workers is None:
+                mesh = vtkutils.extractSurface(surfaceImg, isovalue, args.extractor)
+            else:
+                mesh = slabextract.extractSurfaceSlabs(
+                    surfaceImg, isovalue, args.extractor, args.extract_workers
+                )
+            rec["output"] = profiler.triangles(mesh)
+        surfaceImg = None
+
+        # Delete the VTK image after the last surface, free its memory
+        if i == len(surfaces) - 1:
+            vtkimg = None
+        gc.collect()
 
-    # Filter the output mesh
-    mesh = meshProcessingPipeline(
-        mesh,
-        connectivityFilter,
-        args.small,
-        args.smooth,
-        args.reduce,
-        [args.rotaxis, args.rotangle],
-        args.debug,
-    )
+        # Filter the output mesh
+        mesh = meshProcessingPipeline(
+            mesh,
+            connectivityFilter,
+            args.small,
+            smoothN,
+            args.reduce,
+            [args.rotaxis, args.rotangle],
+            args.debug,
+        )
 
-    # We done!  Write out the results
-    vtkutils.writeMesh(mesh, args.output)
+        # We done!  Write out the results
+        with profiler.stage("write", input=profiler.triangles(mesh)):
+            vtkutils.writeMesh(mesh, output)
+        mesh = None
 
-    # remove the temp directory
-    if args.clean:
-        # shutil.rmtree(args.temp)
-        # with context manager the temp dir would be deleted any way
-        pass
+    if args.profile:
+        profiler.write(args.profile, {"options": vars(args)})
+        profiler.stop()
 
     print("")
 
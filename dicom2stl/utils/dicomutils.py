@@ -3,9 +3,10 @@
 """
 Function to load the largest Dicom series in a directory.
 
-It scans the directory recursively search for files with the ".dcm"
-suffix. Note that DICOM files don't always have that suffix. In
-that case this function will fail.
+It scans the directory recursively for DICOM files.  Files are recognized
+by their content (the "DICM" magic bytes after the 128 byte preamble, or a
+plausible implicit VR first element), not by their suffix, so PACS exports
+with bare UID file names are found as well.
 
 Written by David T. Chen from the National Institute of Allergy
 and Infectious Diseases, dchen@mail.nih.gov.
@@ -17,21 +18,70 @@ http://www.apache.org/licenses/LICENSE-2.0
 from __future__ import print_function
 import sys
 import os
-import fnmatch
+import re
+import struct
 import zipfile
-from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
 import SimpleITK as sitk
 
+import pydicom
 from pydicom.filereader import read_file_meta_info
 from pydicom.errors import InvalidDicomError
 
+from dicom2stl.utils import seriesreader
+from dicom2stl.utils.seriesindex import SeriesIndex
+
+
+# The DICOM header fields needed to group files into series and to order
+# the slices of a series.  Everything else in the header is skipped.
+HEADER_TAGS = [
+    "SeriesInstanceUID",
+    "Modality",
+    "InstanceNumber",
+    "ImagePositionPatient",
+    "ImageOrientationPatient",
+    "Rows",
+    "Columns",
+    "PixelSpacing",
+    "SliceThickness",
+    "SamplesPerPixel",
+    "BitsAllocated",
+    "BitsStored",
+    "PixelRepresentation",
+    "RescaleSlope",
+    "RescaleIntercept",
+    "SeriesNumber",
+    "SeriesDescription",
+    "ImageType",
+    "ConvolutionKernel",
+]
+
+# Short names that can be used for header fields in series search strings
+SEARCH_ALIASES = {
+    "description": "SeriesDescription",
+    "desc": "SeriesDescription",
+    "type": "ImageType",
+    "kernel": "ConvolutionKernel",
+    "thickness": "SliceThickness",
+    "modality": "Modality",
+    "number": "SeriesNumber",
+}
+
+# Search operators, longest first so that "<=" is found before "<"
+SEARCH_OPERATORS = ["!=", "<=", ">=", "=", "~", "<", ">"]
+
+# The first operator in a search term, longest first at the same position
+_SEARCH_OPERATOR_RE = re.compile("|".join(re.escape(op) for op in SEARCH_OPERATORS))
+
 
 def testDicomFile(file_path: str) -> bool:
     """Test if given file is in DICOM format.
-    
+
     Args:
         file_path: Path to file to test
-        
+
     Returns:
         True if file is valid DICOM, False otherwise
     """
@@ -42,38 +92,385 @@ def testDicomFile(file_path: str) -> bool:
         return False
 
 
-def scanDirForDicom(dicomdir: str) -> Tuple[List[str], List[str]]:
-    """Scan directory recursively for DICOM files.
-    
+def isDicomFile(file_path: str) -> bool:
+    """Quickly test if a file looks like DICOM from its first bytes.
+
+    Only the 128 byte preamble and the 4 byte magic number are read.  Files
+    without a preamble are accepted if they start with a plausible group
+    0002 or 0008 data element, which is how old implicit VR files begin.
+    This is much cheaper than testDicomFile, which parses the meta
+    information.
+
     Args:
-        dicomdir: Directory path to scan for .dcm files
-        
+        file_path: Path to file to test
+
     Returns:
-        Tuple of (list of DICOM file paths, list of directories containing DICOM files)
+        True if file looks like DICOM, False otherwise
     """
-    matches = []
-    found_dirs = []
+    try:
+        with open(file_path, "rb") as fp:
+            data = fp.read(132)
+    except OSError:
+        return False
+
+    if len(data) == 132 and data[128:132] == b"DICM":
+        return True
+
+    # No preamble: check for a little endian group 0002/0008 element
+    if len(data) < 8:
+        return False
+    group, element = struct.unpack("<HH", data[:4])
+    if group not in (0x0002, 0x0008) or element > 0x1000:
+        return False
+    vr = data[4:6]
+    if vr.isalpha() and vr.isupper():
+        # explicit VR
+        return True
+    # implicit VR: a 32 bit value length that isn't absurd
+    length = struct.unpack("<I", data[4:8])[0]
+    return length < 0x10000 or length == 0xFFFFFFFF
+
+
+def _walkDir(dicomdir: str) -> List[str]:
+    """List the paths of all the files under a directory, recursively."""
+    paths = []
     try:
         for root, _, filenames in os.walk(dicomdir):
-            for filename in fnmatch.filter(filenames, "*.dcm"):
-                matches.append(os.path.join(root, filename))
-                if root not in found_dirs:
-                    found_dirs.append(root)
+            for filename in filenames:
+                paths.append(os.path.join(root, filename))
     except OSError as e:
-        print("Error in scanDirForDicom:", e)
+        print("Error scanning directory:", e)
         print("dicomdir =", dicomdir)
+    return paths
+
+
+def scanDirForDicom(
+    dicomdir: str, workers: Optional[int] = None
+) -> Tuple[List[str], List[str]]:
+    """Scan directory recursively for DICOM files.
+
+    Every file is classified with isDicomFile, whatever its suffix, by a
+    pool of threads.  Each thread only has one file open at a time, so the
+    number of open file handles is bounded by the number of workers.
+
+    Args:
+        dicomdir: Directory path to scan for DICOM files
+        workers: Number of classifier threads (default: ThreadPoolExecutor's default)
+
+    Returns:
+        Tuple of (list of DICOM file paths, list of directories containing DICOM files)
+    """
+    candidates = _walkDir(dicomdir)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        flags = list(pool.map(isDicomFile, candidates))
+
+    matches = []
+    found_dirs = []
+    seen_dirs = set()
+    for path, flag in zip(candidates, flags):
+        if flag:
+            matches.append(path)
+            root = os.path.dirname(path)
+            if root not in seen_dirs:
+                seen_dirs.add(root)
+                found_dirs.append(root)
 
     return (matches, found_dirs)
 
 
-def getAllSeries(target_dirs: List[str]) -> List[List]:
+def _headerValue(value):
+    """Convert a pydicom element value to a plain Python value."""
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    try:
+        return [_headerValue(v) for v in value]
+    except TypeError:
+        return str(value)
+
+
+def readDicomHeader(file_path: Union[str, BinaryIO]) -> Optional[Dict]:
+    """Read the header fields of a DICOM file, skipping the pixel data.
+
+    Args:
+        file_path: Path or file object of the file to read
+
+    Returns:
+        Dictionary of the HEADER_TAGS fields present in the file and the
+        TransferSyntaxUID of its file meta information, or None if the file
+        is not a DICOM image
+    """
+    try:
+        # force, to read files without a preamble, which isDicomFile accepts
+        ds = pydicom.dcmread(
+            file_path, stop_before_pixels=True, specific_tags=HEADER_TAGS, force=True
+        )
+    except (InvalidDicomError, OSError, ValueError, EOFError, struct.error):
+        return None
+
+    if "SeriesInstanceUID" not in ds or "Rows" not in ds:
+        # Not an image, e.g. a DICOMDIR or a structured report
+        return None
+
+    header = {}
+    for tag in HEADER_TAGS:
+        value = ds.get(tag, None)
+        if value is None or value == "":
+            header[tag] = None
+        else:
+            header[tag] = _headerValue(value)
+
+    # Used to choose the pixel decoder backend
+    header["TransferSyntaxUID"] = seriesreader.datasetTransferSyntax(ds)
+    return header
+
+
+def readDicomHeaders(
+    file_paths: List[str],
+    workers: Optional[int] = None,
+    opener: Optional[Callable[[str], BinaryIO]] = None,
+) -> Dict[str, Optional[Dict]]:
+    """Read the headers of many DICOM files with a pool of threads.
+
+    Args:
+        file_paths: Paths of the files to read
+        workers: Number of reader threads (default: ThreadPoolExecutor's default)
+        opener: Function that opens a path as a binary file object, e.g.
+            ZipFile.open to read archive members.  None reads the files
+            from disk.
+
+    Returns:
+        Dictionary mapping each file path to its header, or to None if the
+        file is not a DICOM image
+    """
+
+    def read(path):
+        if opener is None:
+            return readDicomHeader(path)
+        with opener(path) as fp:
+            return readDicomHeader(fp)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        headers = list(pool.map(read, file_paths))
+    return dict(zip(file_paths, headers))
+
+
+def sortSlices(
+    file_paths: List[str], headers: List[Dict]
+) -> Tuple[List[str], Dict]:
+    """Sort DICOM slices by their position along the slice normal.
+
+    The ImagePositionPatient of every slice is projected onto the normal of
+    the first slice's ImageOrientationPatient in one vectorised step.  Ties
+    are broken by InstanceNumber, then by file name.  The sorted positions
+    are checked in the same pass for duplicate slices, gaps and non-uniform
+    spacing.
+
+    Args:
+        file_paths: Paths of the slice files
+        headers: Slice headers, in the same order as file_paths
+
+    Returns:
+        Tuple of (sorted file paths, report).  The report is a dictionary
+        with the median slice "spacing" (None if the slices have no
+        positions), the "duplicates" and "gaps" as lists of pairs of
+        neighbouring sorted file paths, and whether the spacing is
+        "uniform".
+    """
+    report = {"spacing": None, "duplicates": [], "gaps": [], "uniform": True}
+    if len(file_paths) == 0:
+        return [], report
+
+    instances = np.array(
+        [h.get("InstanceNumber") or 0 for h in headers], dtype=np.float64
+    )
+    positions = [h.get("ImagePositionPatient") for h in headers]
+    orientation = headers[0].get("ImageOrientationPatient")
+    has_positions = all(p and len(p) == 3 for p in positions)
+    if has_positions and orientation and len(orientation) == 6:
+        normal = np.array(seriesreader.sliceNormal(orientation))
+        distances = np.array(positions, dtype=np.float64) @ normal
+    else:
+        has_positions = False
+        distances = np.zeros(len(file_paths))
+
+    order = np.lexsort((np.array(file_paths), instances, distances))
+    sorted_paths = [file_paths[i] for i in order]
+    if not has_positions or len(file_paths) < 2:
+        return sorted_paths, report
+
+    steps = np.diff(distances[order])
+    nonzero = steps[steps > 1e-6]
+    if len(nonzero) == 0:
+        spacing = 0.0
+    else:
+        spacing = float(np.median(nonzero))
+    tolerance = max(0.01 * spacing, 1e-6)
+
+    report["spacing"] = spacing
+    for i in np.nonzero(steps <= tolerance)[0]:
+        report["duplicates"].append((sorted_paths[i], sorted_paths[i + 1]))
+    for i in np.nonzero(steps > 1.5 * spacing + tolerance)[0]:
+        report["gaps"].append((sorted_paths[i], sorted_paths[i + 1]))
+    report["uniform"] = bool(np.all(np.abs(steps - spacing) <= tolerance))
+    return sorted_paths, report
+
+
+def groupSeries(headers: Dict[str, Optional[Dict]]) -> List[List]:
+    """Group DICOM files into series by SeriesInstanceUID and directory.
+
+    Within a series the files are ordered by their position along the slice
+    normal, the same ordering the GDCM series reader uses.
+
+    Args:
+        headers: Dictionary mapping file paths to headers, as returned by
+            readDicomHeaders
+
+    Returns:
+        List of series information, where each element is
+        [series_id, directory, file_list]
+    """
+    groups: Dict[Tuple[str, str], List[Tuple[str, Dict]]] = {}
+    for path, header in headers.items():
+        if header is None:
+            continue
+        key = (header["SeriesInstanceUID"], os.path.dirname(path))
+        groups.setdefault(key, []).append((path, header))
+
+    found_series = []
+    for (s, d), items in groups.items():
+        found_files, _ = sortSlices(
+            [path for path, _ in items], [header for _, header in items]
+        )
+        print(s, d, len(found_files))
+        found_series.append([s, d, found_files])
+    return found_series
+
+
+def getDirectoryHeaders(
+    target_dirs: List[str],
+    workers: Optional[int] = None,
+    cacheDir: Optional[str] = None,
+) -> Dict[str, Optional[Dict]]:
+    """Read the headers of all the files in a set of directories.
+
+    If a cache directory is given, the headers come from a persistent
+    SeriesIndex and only new or changed files are read.
+
+    Args:
+        target_dirs: List of directory paths (not scanned recursively)
+        workers: Number of header reader threads
+        cacheDir: Directory of the series index cache, or None for no cache
+
+    Returns:
+        Dictionary mapping each file path to its header, or to None if the
+        file is not a DICOM image
+    """
+    file_paths = []
+    for d in target_dirs:
+        try:
+            with os.scandir(d) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        file_paths.append(entry.path)
+        except OSError as e:
+            print("Error in getDirectoryHeaders:", e)
+
+    file_paths.sort()
+
+    def reader(paths):
+        return readDicomHeaders(paths, workers)
+
+    if cacheDir is None:
+        return reader(file_paths)
+
+    with SeriesIndex(cacheDir) as index:
+        return index.headers(file_paths, reader)
+
+
+def getTreeHeaders(
+    dicomdir: str,
+    workers: Optional[int] = None,
+    cacheDir: Optional[str] = None,
+) -> Dict[str, Optional[Dict]]:
+    """Read the headers of all the files under a directory, recursively.
+
+    Each file is classified with isDicomFile and only the DICOM files'
+    headers are read.  If a cache directory is given, the classification
+    and the headers come from a persistent SeriesIndex, keyed by each
+    file's path, size and modification time, so only new or changed files
+    are opened, and the files deleted from the directory are dropped from
+    the index.
+
+    Args:
+        dicomdir: Directory path to scan recursively
+        workers: Number of classifier and header reader threads
+        cacheDir: Directory of the series index cache, or None for no cache
+
+    Returns:
+        Dictionary mapping each file path to its header, or to None if the
+        file is not a DICOM image
+    """
+    file_paths = sorted(_walkDir(dicomdir))
+
+    def reader(paths):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            flags = list(pool.map(isDicomFile, paths))
+        dicom = [p for p, flag in zip(paths, flags) if flag]
+        headers = dict.fromkeys(paths)
+        headers.update(readDicomHeaders(dicom, workers))
+        return headers
+
+    if cacheDir is None:
+        return reader(file_paths)
+
+    with SeriesIndex(cacheDir) as index:
+        headers = index.headers(file_paths, reader)
+        index.prune(dicomdir, file_paths)
+        return headers
+
+
+def getAllSeries(
+    target_dirs: List[str],
+    workers: Optional[int] = None,
+    cacheDir: Optional[str] = None,
+) -> List[List]:
     """Get all the DICOM series in a set of directories.
-    
+
+    Only the file headers are read, in parallel, and all the series are
+    found in one pass over the files.  If a cache directory is given, the
+    headers come from a persistent SeriesIndex and only new or changed
+    files are read.
+
     Args:
         target_dirs: List of directory paths to scan for DICOM series
-        
+        workers: Number of header reader threads
+        cacheDir: Directory of the series index cache, or None for no cache
+
     Returns:
-        List of series information, where each element is [series_id, directory, file_list]
+        List of series information, where each element is
+        [series_id, directory, file_list]
+    """
+    return groupSeries(getDirectoryHeaders(target_dirs, workers, cacheDir))
+
+
+def getAllSeriesGDCM(target_dirs: List[str]) -> List[List]:
+    """Get all the DICOM series in a set of directories using GDCM.
+
+    This is the original, serial implementation of getAllSeries.  GDCM
+    parses every file header once to find the series IDs, then again for
+    each series to get its file names.
+
+    Args:
+        target_dirs: List of directory paths to scan for DICOM series
+
+    Returns:
+        List of series information, where each element is
+        [series_id, directory, file_list]
     """
     isr = sitk.ImageSeriesReader()
     found_series = []
@@ -88,10 +485,10 @@ def getAllSeries(target_dirs: List[str]) -> List[List]:
 
 def getModality(img: sitk.Image) -> str:
     """Get an image's modality from DICOM metadata.
-    
+
     Args:
         img: SimpleITK image with DICOM metadata
-        
+
     Returns:
         Modality string (e.g., 'CT', 'MR'), or empty string if not found
     """
@@ -104,73 +501,322 @@ def getModality(img: sitk.Image) -> str:
     return modality
 
 
-def loadLargestSeries(dicomdir: str) -> Optional[Tuple[sitk.Image, str]]:
-    """Load the largest DICOM series found in a directory.
-    
-    Scans the directory recursively for DICOM files and loads the series
-    with the most slices.
-    
+def parseSearch(search: str) -> List[Tuple[str, str, str]]:
+    """Parse a series search string into a list of header predicates.
+
+    The search string is a semicolon separated list of predicates of the
+    form "field op value".  field is a header keyword from HEADER_TAGS or
+    one of the SEARCH_ALIASES (description, type, kernel, thickness,
+    modality, number).  op is one of:
+
+        =   equal (case insensitive; for multi-valued fields such as
+            ImageType, any value is equal)
+        !=  not equal
+        ~   contains (case insensitive)
+        <, <=, >, >=  numeric comparison
+
+    A predicate without an operator matches series whose description
+    contains it, e.g. "bone; thickness<=1.0; type=AXIAL".  A term is split
+    at its first operator, so the value may contain operator characters,
+    e.g. "description=a<b".
+
     Args:
-        dicomdir: Directory path to scan
-        
+        search: The search string
+
     Returns:
-        Tuple of (SimpleITK image, modality string), or None if no series found
+        List of (field, op, value) tuples
+
+    Raises:
+        ValueError: if a field is unknown
     """
+    predicates = []
+    for term in search.split(";"):
+        term = term.strip()
+        if not term:
+            continue
+        match = _SEARCH_OPERATOR_RE.search(term)
+        if match is None:
+            predicates.append(("SeriesDescription", "~", term))
+            continue
+        field = term[: match.start()].strip()
+        field = SEARCH_ALIASES.get(field.lower(), field)
+        if field not in HEADER_TAGS:
+            raise ValueError(f"Unknown search field: {field}")
+        predicates.append((field, match.group(), term[match.end() :].strip()))
+    return predicates
+
+
+def _matchPredicate(header: Dict, predicate: Tuple[str, str, str]) -> bool:
+    """Test a header against one search predicate."""
+    field, op, value = predicate
+    hvalue = header.get(field)
+    if hvalue is None:
+        return op == "!="
+
+    if op in ("<", "<=", ">", ">="):
+        try:
+            x = float(hvalue[0] if isinstance(hvalue, list) else hvalue)
+            y = float(value)
+        except (TypeError, ValueError):
+            return False
+        return {"<": x < y, "<=": x <= y, ">": x > y, ">=": x >= y}[op]
+
+    values = hvalue if isinstance(hvalue, list) else [hvalue]
+    values = [str(v).strip().lower() for v in values]
+    value = value.lower()
+    if op == "~":
+        return value in "\\".join(values)
+    equal = False
+    for v in values:
+        try:
+            equal = equal or float(v) == float(value)
+        except ValueError:
+            equal = equal or v == value
+    return equal if op == "=" else not equal
+
+
+def matchSeries(header: Dict, predicates: List[Tuple[str, str, str]]) -> bool:
+    """Test if a series matches all the predicates of a search.
+
+    Args:
+        header: Header of a slice of the series
+        predicates: Predicates from parseSearch
+
+    Returns:
+        True if every predicate is true for the header
+    """
+    return all(_matchPredicate(header, p) for p in predicates)
+
+
+def selectLargestSeries(
+    seriessets: List[List],
+    headers: Dict[str, Optional[Dict]],
+    search: Optional[str] = None,
+) -> Optional[List]:
+    """Select the largest series, optionally among those matching a search.
+
+    Args:
+        seriessets: Series from groupSeries
+        headers: The headers the series were grouped from
+        search: Series search string (see parseSearch), or None
+
+    Returns:
+        The selected [series_id, directory, file_list], or None if no series
+        matches
+    """
+    candidates = seriessets
+    if search:
+        predicates = parseSearch(search)
+        candidates = [
+            ss for ss in seriessets if matchSeries(headers[ss[2][0]], predicates)
+        ]
+        print("Search", predicates)
+        for ss in seriessets:
+            header = headers[ss[2][0]]
+            print(
+                "    match" if ss in candidates else "    skip ",
+                ss[0],
+                repr(header.get("SeriesDescription") or ""),
+                len(ss[2]),
+                "slices",
+            )
+
+    if len(candidates) == 0:
+        return None
+    return max(candidates, key=lambda x: len(x[2]))
+
 
-    files, dirs = scanDirForDicom(dicomdir)
+def findLargestSeries(
+    dicomdir: str, cacheDir: Optional[str] = None, search: Optional[str] = None
+) -> Optional[Tuple[str, List[str], List[Dict]]]:
+    """Find the largest DICOM series in a directory without decoding it.
 
-    if (len(files) == 0) or (len(dirs) == 0):
+    With a cache directory, the directory walk's classification of the
+    files and their headers are kept in the series index (see
+    getTreeHeaders), so a later run only opens new or changed files.
+
+    Args:
+        dicomdir: Directory path to scan recursively
+        cacheDir: Directory of the series index cache, or None for no cache
+        search: Series search string (see parseSearch).  If given, only the
+            series matching it are considered.
+
+    Returns:
+        Tuple of (series ID, sorted file list, slice headers), or None if no
+        series is found
+    """
+    headers = getTreeHeaders(dicomdir, cacheDir=cacheDir)
+
+    if not any(headers.values()):
         print("Error in loadLargestSeries. No files found.")
         print("dicomdir =", dicomdir)
         return None
-    seriessets = getAllSeries(dirs)
-    maxsize = 0
-    maxindex = -1
-
-    for count, ss in enumerate(seriessets):
-        size = len(ss[2])
-        if size > maxsize:
-            maxsize = size
-            maxindex = count
-    if maxindex < 0:
+    ss = selectLargestSeries(groupSeries(headers), headers, search)
+    if ss is None:
         print("Error: no series found")
         return None
-    isr = sitk.ImageSeriesReader()
-    ss = seriessets[maxindex]
-    files = ss[2]
-    isr.SetFileNames(files)
-    print("\nLoading series", ss[0], "in directory", ss[1])
-    img = isr.Execute()
+    print("\nFound series", ss[0], "in directory", ss[1])
+    return ss[0], ss[2], [headers[f] for f in ss[2]]
 
-    firstslice = sitk.ReadImage(files[0])
-    modality = getModality(firstslice)
 
+def findLargestZipSeries(
+    name: str, search: Optional[str] = None, workers: Optional[int] = None
+) -> Optional[Tuple[str, List, List[Dict]]]:
+    """Find the largest DICOM series in a ZIP file without extracting it.
+
+    The headers of the archive members are read straight from the archive,
+    by a pool of threads like readDicomHeaders.
+
+    Args:
+        name: Path to ZIP file containing DICOM images
+        search: Series search string (see parseSearch).  If given, only the
+            series matching it are considered.
+        workers: Number of header reader threads
+
+    Returns:
+        Tuple of (series ID, sorted list of (zip name, member name) slice
+        sources, slice headers), or None if no series is found
+    """
+    print("Reading Dicom zip file:", name)
+    try:
+        with zipfile.ZipFile(name, "r") as myzip:
+            members = [m.filename for m in myzip.infolist() if not m.is_dir()]
+            headers = readDicomHeaders(members, workers, myzip.open)
+    except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+        print("Zip read failed:", e)
+        return None
+
+    ss = selectLargestSeries(groupSeries(headers), headers, search)
+    if ss is None:
+        print("Error: no series found in", name)
+        return None
+    print("\nFound series", ss[0], "in zip directory", ss[1])
+    return ss[0], [(name, m) for m in ss[2]], [headers[m] for m in ss[2]]
+
+
+def loadSeries(
+    sources: List,
+    headers: List[Dict],
+    workers: Optional[int] = None,
+    tempDir: Optional[str] = None,
+    decoder: Optional[str] = None,
+    box: Optional[Tuple[int, int, int, int]] = None,
+    binning: Optional[Tuple[int, int]] = None,
+) -> Tuple[sitk.Image, str]:
+    """Decode a sorted DICOM series.
+
+    Args:
+        sources: Slice file paths, or (zip name, member name) tuples, in
+            slice order
+        headers: Slice headers, in the same order as sources
+        workers: Number of processes that decode the slices in parallel
+            (0 for one per CPU).  If None, files are loaded by the SimpleITK
+            series reader (unless a decoder is given) and zip members are
+            decoded in this process.
+        tempDir: Directory for spool files of very large zip members
+        decoder: Slice decoder backend, one of seriesreader.DECODERS.  None
+            is "auto".
+        box: (x0, y0, x1, y1) half open in-plane index box.  If given,
+            every slice is cropped as it is decoded.
+        binning: (x, y) in-plane bin factors.  If given, every slice is
+            averaged over bins of this size as it is decoded.
+
+    Returns:
+        Tuple of (SimpleITK image, modality string)
+    """
+    modality = headers[0].get("Modality") or ""
+    if (
+        workers is None
+        and decoder is None
+        and box is None
+        and binning is None
+        and isinstance(sources[0], str)
+    ):
+        isr = sitk.ImageSeriesReader()
+        isr.SetFileNames(sources)
+        img = isr.Execute()
+        return img, modality
+
+    if workers is None:
+        workers = 1
+    img = seriesreader.readSeries(
+        sources, headers, workers, tempDir, decoder or "auto", box, binning
+    )
     return img, modality
 
 
-def loadZipDicom(name: str, tempDir: str) -> Optional[Tuple[sitk.Image, str]]:
-    """Extract and load DICOM series from a ZIP file.
-    
-    Unzips DICOM images to a temporary directory and loads the series
+def loadLargestSeries(
+    dicomdir: str,
+    cacheDir: Optional[str] = None,
+    workers: Optional[int] = None,
+    search: Optional[str] = None,
+    decoder: Optional[str] = None,
+) -> Optional[Tuple[sitk.Image, str]]:
+    """Load the largest DICOM series found in a directory.
+
+    Scans the directory recursively for DICOM files and loads the series
     with the most slices.
-    
+
+    Args:
+        dicomdir: Directory path to scan
+        cacheDir: Directory of the series index cache, or None for no cache
+        workers: Number of processes that decode the slices in parallel
+            (0 for one per CPU).  If None, the SimpleITK series reader
+            loads the series.
+        search: Series search string (see parseSearch).  If given, the
+            largest series matching it is loaded.
+        decoder: Slice decoder backend (see loadSeries)
+
+    Returns:
+        Tuple of (SimpleITK image, modality string), or None if no series found
+    """
+    found = findLargestSeries(dicomdir, cacheDir, search)
+    if found is None:
+        return None
+    _, files, headers = found
+    return loadSeries(files, headers, workers, decoder=decoder)
+
+
+def loadZipDicom(
+    name: str,
+    tempDir: Optional[str] = None,
+    workers: Optional[int] = 1,
+    search: Optional[str] = None,
+    decoder: Optional[str] = None,
+) -> Optional[Tuple[sitk.Image, str]]:
+    """Load the largest DICOM series in a ZIP file without extracting it.
+
+    The headers of the archive members are read straight from the archive to
+    find the series with the most slices.  Only that series' members are
+    then decoded, from memory or from a bounded spool file.  Nothing else in
+    the archive is decompressed to disk.
+
     Args:
         name: Path to ZIP file containing DICOM images
-        tempDir: Temporary directory for extraction
-        
+        tempDir: Directory for spool files of very large members, or None
+            for the system default
+        workers: Number of processes that decode the slices in parallel
+            (0 or None for one per CPU)
+        search: Series search string (see parseSearch).  If given, the
+            largest series matching it is loaded.
+        decoder: Slice decoder backend (see loadSeries)
+
     Returns:
         Tuple of (SimpleITK image, modality string), or None if loading fails
     """
-    print("Reading Dicom zip file:", name)
-    print("tempDir =", tempDir)
-    with zipfile.ZipFile(name, "r") as myzip:
+    if tempDir is not None:
+        os.makedirs(tempDir, exist_ok=True)
 
-        try:
-            myzip.extractall(tempDir)
-        except RuntimeError:
-            print("Zip extract failed")
+    found = findLargestZipSeries(name, search)
+    if found is None:
+        return None
+    _, sources, headers = found
 
-    return loadLargestSeries(tempDir)
+    try:
+        return loadSeries(sources, headers, workers or 0, tempDir, decoder)
+    except (zipfile.BadZipFile, RuntimeError, NotImplementedError) as e:
+        print("Zip read failed:", e)
+    return None
 
 
 #
@@ -181,20 +827,20 @@ if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: dicomutils.py <dicom_directory>")
         sys.exit(1)
-    
+
     print("\ndicomutils.py")
     print("Scanning:", sys.argv[1])
-    
+
     dcm_files, dcm_dirs = scanDirForDicom(sys.argv[1])
-    
+
     print("\nFiles found:")
     for f in dcm_files:
         print(" ", f)
-    
+
     print("\nDirectories:")
     for d in dcm_dirs:
         print(" ", d)
-    
+
     print("\nSeries:")
     series_found = getAllSeries(dcm_dirs)
     for sf in series_found:
@@ -0,0 +1,500 @@
+#! /usr/bin/env python
+
+"""
+Lazy volume handles.
+
+A lazy volume knows the modality, size, spacing, origin and direction of a
+volume from its headers alone, and only decodes the pixels when GetImage is
+called.  That lets the pipeline reject a study or write its metadata before
+paying for the pixel decode.
+
+The geometry methods are named like the SimpleITK Image methods, so code
+that only needs the geometry works with either a lazy volume or an image.
+
+A lazy volume can be restricted to a region of interest, and shrunk,
+before it is decoded.  Dicom slices outside the region, or skipped by the
+shrink, are never decoded, and the slices that are read are cropped and
+binned as they are decoded.  So memory and load time scale with the output
+volume rather than with the whole study.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import math
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import SimpleITK as sitk
+
+from dicom2stl.utils import dicomutils
+from dicom2stl.utils import seriesreader
+from dicom2stl.utils import volumecache
+from dicom2stl.utils import volumestats
+
+
+class LazyVolume:
+    """Base class of the lazy volume handles."""
+
+    def __init__(
+        self,
+        size: List[int],
+        origin: List[float],
+        spacing: List[float],
+        direction: List[float],
+        modality: str = "",
+        cacheFiles: Optional[List[str]] = None,
+        seriesUID: str = "",
+        componentSize: int = 2,
+        components: int = 1,
+    ) -> None:
+        """Create a lazy volume from its geometry.
+
+        Args:
+            size: Volume size in voxels
+            origin: Physical position of the first voxel
+            spacing: Voxel spacing
+            direction: Direction cosine matrix, row major
+            modality: Imaging modality (e.g. 'CT', 'MR'), or empty string
+            cacheFiles: Input files the volume cache key is made from
+            seriesUID: Series Instance UID, if the volume is a Dicom series
+            componentSize: Bytes per pixel component of the decoded volume
+            components: Number of components per pixel
+        """
+        self.size = tuple(size)
+        self.origin = tuple(origin)
+        self.spacing = tuple(spacing)
+        self.direction = tuple(direction)
+        self.modality = modality
+        self.cacheFiles = cacheFiles or []
+        self.seriesUID = seriesUID
+        self.componentSize = componentSize
+        self.components = components
+        self.volumeCacheDir: Optional[str] = None
+        self.fullSize = self.size
+        self.fullOrigin = self.origin
+        self.fullSpacing = self.spacing
+        self.region: Optional[Tuple[Tuple, Tuple]] = None
+        self.shrink: Optional[Tuple] = None
+        self.stats: Optional[Dict] = None
+        self._statsImage: Optional[weakref.ref] = None
+        self._statsKey: Optional[str] = None
+
+    def GetSize(self) -> Tuple:
+        """Get the volume size in voxels."""
+        return self.size
+
+    def GetOrigin(self) -> Tuple:
+        """Get the physical position of the first voxel."""
+        return self.origin
+
+    def GetSpacing(self) -> Tuple:
+        """Get the voxel spacing."""
+        return self.spacing
+
+    def GetDirection(self) -> Tuple:
+        """Get the direction cosine matrix, row major."""
+        return self.direction
+
+    def GetDimension(self) -> int:
+        """Get the number of dimensions."""
+        return len(self.size)
+
+    def GetSizeOfPixelComponent(self) -> int:
+        """Get the bytes per pixel component of the decoded volume."""
+        return self.componentSize
+
+    def GetNumberOfComponentsPerPixel(self) -> int:
+        """Get the number of components per pixel."""
+        return self.components
+
+    def GetModality(self) -> str:
+        """Get the imaging modality, or an empty string."""
+        return self.modality
+
+    def SetRegion(self, index: List[int], size: List[int]) -> None:
+        """Restrict the volume to a box of voxels.
+
+        The box is given in voxel indices of the whole volume and is
+        clipped to it.  The geometry getters then describe the region, and
+        GetImage decodes only the region.
+
+        Args:
+            index: Index of the first voxel of the region
+            size: Size of the region in voxels
+
+        Raises:
+            ValueError: If the region does not overlap the volume
+        """
+        dim = len(self.fullSize)
+        lower = [max(0, int(i)) for i in index[:dim]]
+        upper = [
+            min(n, int(i) + int(s))
+            for n, i, s in zip(self.fullSize, index[:dim], size[:dim])
+        ]
+        if any(hi <= lo for lo, hi in zip(lower, upper)):
+            raise ValueError(f"Region {index} {size} is outside the volume")
+
+        self.region = (tuple(lower), tuple(hi - lo for lo, hi in zip(lower, upper)))
+        self._updateGeometry()
+        print("Region of interest:", self.region[0], self.region[1])
+
+    def SetShrink(self, factors: List[int]) -> None:
+        """Shrink the volume while it is decoded.
+
+        Slices are skipped by the slice direction factor, keeping every Nth
+        slice, and pixels are averaged over blocks of the in-plane factors,
+        like sitk.BinShrink.  Only the kept slices are decoded.  The shrink
+        applies to the region, if one is set.
+
+        Args:
+            factors: Shrink factor of each dimension
+        """
+        factors = tuple(max(1, int(f)) for f in factors[: len(self.fullSize)])
+        self.shrink = None if all(f == 1 for f in factors) else factors
+        self._updateGeometry()
+        if self.shrink is not None:
+            print("Shrink on load:", self.shrink, "->", self.size)
+
+    def _updateGeometry(self) -> None:
+        """Set the size, origin and spacing to those of the region and shrink."""
+        self.size, self.origin, self.spacing = self._geometry()
+
+    def _geometry(self) -> Tuple[Tuple, Tuple, Tuple]:
+        """Compute the size, origin and spacing of the region and shrink."""
+        dim = len(self.fullSize)
+        index, size = self.region or ((0,) * dim, self.fullSize)
+        spacing = np.array(self.fullSpacing)
+        # physical offset of the first output voxel, in index units
+        offset = np.array(index, dtype=np.float64)
+        if self.shrink is not None:
+            factors = np.array(self.shrink)
+            binned = np.arange(dim) < 2
+            # bins are averaged in-plane, slices are picked
+            size = [
+                n // f if b else (n + f - 1) // f
+                for n, f, b in zip(size, self.shrink, binned)
+            ]
+            offset = offset + np.where(binned, (factors - 1) / 2.0, 0.0)
+            spacing = spacing * factors
+        d = np.reshape(self.direction, (dim, dim))
+        shift = d @ (offset * np.array(self.fullSpacing))
+        return (
+            tuple(int(n) for n in size),
+            tuple(float(o + s) for o, s in zip(self.fullOrigin, shift)),
+            tuple(float(s) for s in spacing),
+        )
+
+    def SetPhysicalRegion(self, lower: List[float], upper: List[float]) -> None:
+        """Restrict the volume to the voxels inside a physical box.
+
+        Args:
+            lower: Physical coordinates of one corner of the box
+            upper: Physical coordinates of the opposite corner
+        """
+        dim = len(self.fullSize)
+        d = np.reshape(self.direction, (dim, dim))
+        corners = np.array(
+            [
+                [(lower, upper)[(c >> k) & 1][k] for k in range(dim)]
+                for c in range(2**dim)
+            ],
+            dtype=np.float64,
+        )
+        # continuous indices of the corners of the box
+        indices = (corners - np.array(self.fullOrigin)) @ d / np.array(self.fullSpacing)
+        first = [math.floor(i) for i in indices.min(axis=0)]
+        last = [math.ceil(i) for i in indices.max(axis=0)]
+        self.SetRegion(first, [b - a + 1 for a, b in zip(first, last)])
+
+    def SetVolumeCache(self, cacheDir: Optional[str]) -> None:
+        """Cache decoded pixels in cacheDir and reuse them on later runs."""
+        self.volumeCacheDir = cacheDir
+
+    def GetImage(self) -> sitk.Image:
+        """Decode the pixels, or load them from the volume cache.
+
+        The intensity statistics of the image are computed the first time
+        GetStatistics is called, or loaded with the image from the volume
+        cache.
+
+        Returns:
+            The volume as a SimpleITK image
+        """
+        self.stats = None
+        self._statsImage = None
+        self._statsKey = None
+        key = None
+        if self.volumeCacheDir and self.cacheFiles:
+            key = volumecache.cacheKey(
+                self.cacheFiles,
+                self.seriesUID,
+                str((self.region, self.shrink)),
+            )
+            # only the whole volume's statistics are worth keeping
+            if self.region is None and self.shrink is None:
+                self._statsKey = key
+            cached = volumecache.loadCachedVolume(self.volumeCacheDir, key)
+            if cached is not None:
+                img = cached[0]
+                if self._statsKey is not None:
+                    self.stats = volumecache.loadCachedStats(self.volumeCacheDir, key)
+                self._statsImage = weakref.ref(img)
+                return img
+
+        img = self._decode()
+
+        if key is not None:
+            volumecache.storeCachedVolume(
+                self.volumeCacheDir, key, img, self.modality, self.seriesUID
+            )
+        self._statsImage = weakref.ref(img)
+        return img
+
+    def GetStatistics(self) -> Optional[Dict]:
+        """Get the intensity statistics of the image last returned by
+        GetImage, from volumestats.computeStats.
+
+        The statistics are computed on the first call and kept in the
+        volume cache, if the whole volume was loaded.
+
+        Returns:
+            The statistics, or None before GetImage or once the image has
+            been freed
+        """
+        if self.stats is None and self._statsImage is not None:
+            img = self._statsImage()
+            if img is None:
+                return None
+            self.stats = volumestats.computeStats(img)
+            if self._statsKey is not None:
+                volumecache.storeCachedStats(
+                    self.volumeCacheDir, self._statsKey, self.stats
+                )
+        return self.stats
+
+    def GetSlab(self, z0: int, z1: int) -> sitk.Image:
+        """Decode a z slab of the volume, without the volume cache.
+
+        Args:
+            z0: First slice of the slab, in the volume's (region and shrink)
+                index space
+            z1: End of the slab, half open
+
+        Returns:
+            The slab as a SimpleITK image
+        """
+        region, shrink = self.region, self.shrink
+        dim = len(self.fullSize)
+        index, size = region or ((0,) * dim, self.fullSize)
+        step = shrink[2] if shrink else 1
+        first = index[2] + z0 * step
+        last = index[2] + (z1 - 1) * step + 1
+        self.region = (
+            tuple(index[:2]) + (first,),
+            tuple(size[:2]) + (last - first,),
+        )
+        try:
+            return self._decode()
+        finally:
+            self.region = region
+
+    def GetLoadCopies(self) -> int:
+        """Get the number of copies of the volume held while it is decoded."""
+        return 1
+
+    def _decode(self) -> sitk.Image:
+        raise NotImplementedError
+
+    def _sliceRange(self) -> Tuple[int, int, int]:
+        """Get the half open range of slices in the region and the slice
+        step of the shrink."""
+        step = self.shrink[2] if self.shrink and len(self.shrink) > 2 else 1
+        if self.region is None or len(self.fullSize) < 3:
+            return 0, self.fullSize[-1], step
+        return self.region[0][2], self.region[0][2] + self.region[1][2], step
+
+    def _planeBinning(self) -> Optional[Tuple[int, int]]:
+        """Get the in-plane bin factors of the shrink, or None."""
+        if self.shrink is None or self.shrink[:2] == (1, 1):
+            return None
+        return self.shrink[0], self.shrink[1]
+
+    def _shrinkImage(self, img: sitk.Image) -> sitk.Image:
+        """Bin and skip slices of a decoded image of the whole region."""
+        if self.shrink is None:
+            return img
+        factors = list(self.shrink[:2]) + [1] * (img.GetDimension() - 2)
+        img = sitk.BinShrink(img, factors)
+        if img.GetDimension() > 2:
+            img = img[:, :, :: self.shrink[2]]
+        return img
+
+    def _planeBox(self) -> Optional[Tuple[int, int, int, int]]:
+        """Get the (x0, y0, x1, y1) in-plane box of the region, or None if
+        the region covers whole slices."""
+        if self.region is None:
+            return None
+        (x0, y0), (nx, ny) = self.region[0][:2], self.region[1][:2]
+        if (nx, ny) == tuple(self.fullSize[:2]):
+            return None
+        return x0, y0, x0 + nx, y0 + ny
+
+
+class DicomSeriesVolume(LazyVolume):
+    """A Dicom series, from slice files or zip archive members."""
+
+    def __init__(
+        self,
+        sources: List,
+        headers: List[Dict],
+        seriesUID: str = "",
+        workers: Optional[int] = None,
+        tempDir: Optional[str] = None,
+        cacheFiles: Optional[List[str]] = None,
+        decoder: Optional[str] = None,
+    ) -> None:
+        """Create a lazy Dicom series.
+
+        Args:
+            sources: Slice file paths, or (zip name, member name) tuples, in
+                slice order
+            headers: Slice headers, in the same order as sources
+            seriesUID: Series Instance UID
+            workers: Decode worker processes, see dicomutils.loadSeries
+            tempDir: Directory for spool files of very large zip members
+            cacheFiles: Input files for the volume cache key (default: the
+                slice files)
+            decoder: Slice decoder backend, see dicomutils.loadSeries
+        """
+        size, origin, spacing, direction = seriesreader.seriesGeometry(headers)
+        if cacheFiles is None:
+            cacheFiles = [s for s in sources if isinstance(s, str)]
+        super().__init__(
+            size,
+            origin,
+            spacing,
+            direction,
+            headers[0].get("Modality") or "",
+            cacheFiles,
+            seriesUID,
+            seriesreader.volumePixelType(headers).itemsize,
+            headers[0].get("SamplesPerPixel") or 1,
+        )
+        self.sources = sources
+        self.headers = headers
+        self.workers = workers
+        self.tempDir = tempDir
+        self.decoder = decoder
+
+    def GetLoadCopies(self) -> int:
+        """Get the number of copies of the volume held while it is decoded.
+
+        Parallel decoding copies the shared memory volume into the image,
+        see seriesreader.readSeries."""
+        if self.workers is None:
+            return 1
+        return 2 if seriesreader.decodeWorkers(self.headers, self.workers) > 1 else 1
+
+    def _decode(self) -> sitk.Image:
+        z0, z1, step = self._sliceRange()
+        img, _ = dicomutils.loadSeries(
+            self.sources[z0:z1:step],
+            self.headers[z0:z1:step],
+            self.workers,
+            self.tempDir,
+            self.decoder,
+            self._planeBox(),
+            self._planeBinning(),
+        )
+        return img
+
+
+class ImageFileVolume(LazyVolume):
+    """A single volume image file in any format SimpleITK can read."""
+
+    def __init__(self, file_name: str) -> None:
+        """Create a lazy volume from an image file, reading only its header.
+
+        Args:
+            file_name: Path of the image file
+        """
+        self.reader = sitk.ImageFileReader()
+        self.reader.SetFileName(file_name)
+        self.reader.ReadImageInformation()
+        modality = ""
+        if self.reader.HasMetaDataKey("0008|0060"):
+            modality = self.reader.GetMetaData("0008|0060")
+        pixel = sitk.Image([1] * self.reader.GetDimension(), self.reader.GetPixelID())
+        super().__init__(
+            self.reader.GetSize(),
+            self.reader.GetOrigin(),
+            self.reader.GetSpacing(),
+            self.reader.GetDirection(),
+            modality,
+            [file_name],
+            "",
+            pixel.GetSizeOfPixelComponent(),
+            self.reader.GetNumberOfComponents(),
+        )
+
+    def _decode(self) -> sitk.Image:
+        if self.region is not None:
+            # Formats that support streaming read only the region
+            self.reader.SetExtractIndex(self.region[0])
+            self.reader.SetExtractSize(self.region[1])
+        else:
+            # an empty extract region reads the whole image, e.g. after
+            # GetSlab has read a slab and restored the region
+            self.reader.SetExtractIndex([])
+            self.reader.SetExtractSize([])
+        return self._shrinkImage(self.reader.Execute())
+
+
+class ImageSeriesVolume(LazyVolume):
+    """A stack of 2-d image files, in the given order."""
+
+    def __init__(self, file_names: List[str]) -> None:
+        """Create a lazy volume from a list of slice files.
+
+        Only the header of the first file is read.  Like the SimpleITK
+        series reader for non-Dicom files, the slice spacing is 1.
+
+        Args:
+            file_names: Slice file paths, in slice order
+        """
+        first = ImageFileVolume(file_names[0])
+        size = list(first.GetSize()[:2]) + [len(file_names)]
+        origin = list(first.GetOrigin()[:2]) + [0.0]
+        spacing = list(first.GetSpacing()[:2]) + [1.0]
+        super().__init__(
+            size,
+            origin,
+            spacing,
+            [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0],
+            first.GetModality(),
+            file_names,
+            "",
+            first.GetSizeOfPixelComponent(),
+            first.GetNumberOfComponentsPerPixel(),
+        )
+        self.file_names = file_names
+
+    def _decode(self) -> sitk.Image:
+        z0, z1, step = self._sliceRange()
+        isr = sitk.ImageSeriesReader()
+        isr.SetFileNames(self.file_names[z0:z1:step])
+        img = isr.Execute()
+        box = self._planeBox()
+        if box is not None:
+            x0, y0, x1, y1 = box
+            img = img[x0:x1, y0:y1, :]
+        if self._planeBinning() is not None:
+            img = sitk.BinShrink(img, list(self._planeBinning()) + [1])
+        _, origin, spacing = self._geometry()
+        img.SetOrigin(origin)
+        img.SetSpacing(spacing)
+        return img
@@ -0,0 +1,418 @@
+#! /usr/bin/env python
+
+"""
+Memory budget planning for the dicom2stl pipeline.
+
+The peak memory of each pipeline stage is estimated from the volume
+geometry alone (size and pixel type, as known from the headers), before any
+pixels are decoded.  From these estimates a plan is chosen that keeps the
+run under a memory budget: the smallest shrink factor at which the run
+fits, and, if the whole volume does not fit, the depth of the z slabs the
+volume filters should stream it in (see slabpipeline).
+
+The estimates are deliberately conservative approximations of what the
+SimpleITK and VTK filters allocate, not measurements.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import math
+import re
+from typing import Dict, List, Optional
+
+from dicom2stl.utils import volumefilters
+
+# Resident size of the Python interpreter with SimpleITK, VTK and numpy
+# loaded, before any volume is read.
+RUNTIME_OVERHEAD = 300 * 2**20
+
+# Voxels of padding added on each side of the volume before the surface
+# is extracted (see volumeProcessingPipeline)
+PAD = 5
+
+# Approximate bytes per triangle of a VTK mesh with normals, and the number
+# of copies of the mesh alive at once in the mesh pipeline (contour, clean,
+# connectivity, smooth, decimate)
+MESH_BYTES_PER_TRIANGLE = 64
+MESH_COPIES = 3
+
+# float32 buffers each smoothing engine holds at once, besides its input:
+# the float32 cast, the output and the engine's working buffers.  The
+# recursive engine holds the image, its smoothing, the gradient, the edge
+# weight and the temporaries of its update.
+SMOOTHING_BUFFERS = {"curvature": 3, "gradient": 3, "bilateral": 3, "recursive": 6}
+
+_SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+
+def parseMemorySize(text: str) -> int:
+    """Parse a memory size such as "4G", "512M", "1.5GB" or "1000000".
+
+    Args:
+        text: Size with an optional K, M, G or T suffix (powers of 1024)
+
+    Returns:
+        The size in bytes
+
+    Raises:
+        ValueError: If the text is not a memory size
+    """
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)I?B?\s*", text.upper())
+    if match is None:
+        raise ValueError(f"Bad memory size: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def formatBytes(n: float) -> str:
+    """Format a byte count for printing, e.g. "1.5 GB"."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(n) < 1024.0:
+            return f"{n:.1f} {unit}"
+        n /= 1024.0
+    return f"{n:.1f} TB"
+
+
+def _voxels(size: List[int]) -> int:
+    return int(math.prod(size))
+
+
+def meshBytes(size: List[int]) -> int:
+    """Estimate the memory of the meshes extracted from a volume.
+
+    The triangle count of an isosurface scales with the area of the volume,
+    so it is estimated as 4 triangles per voxel face of the volume's
+    bounding box.  That is about 3 times the count of a bone surface of a
+    CT scan, but noise-like volumes can give several triangles per voxel.
+    """
+    nx, ny, nz = size
+    triangles = 4 * 2 * (nx * ny + ny * nz + nz * nx)
+    return triangles * MESH_BYTES_PER_TRIANGLE * MESH_COPIES
+
+
+def medianBytesPerVoxel(engine: str, pixelBytes: int, thresholded: bool) -> int:
+    """Bytes per voxel a median engine needs while it runs.
+
+    Args:
+        engine: Median engine, one of volumefilters.MEDIAN_ENGINES.  "auto"
+            is costed as the engine it picks at the most.
+        pixelBytes: Bytes per voxel of the input volume
+        thresholded: Whether the volume has already been thresholded to
+            8 bit labels
+
+    Returns:
+        Bytes per voxel of the input, the output and any working buffers
+    """
+    b = 1 if thresholded else pixelBytes
+    if engine == "auto":
+        engine = "majority" if thresholded else "histogram"
+    if engine == "median":
+        return 2 * b
+    if engine == "histogram":
+        # input, its 8 bit offset copy, the padded copy, the rank output and
+        # its crop, then the cast back
+        return 2 * b + 3
+    if engine == "majority":
+        # input, float32 padded copy, float32 box mean and its crop
+        return b + 3 * 4
+    if engine == "morphology":
+        # input, the opening's erosion and the output
+        return 3 * b
+    raise ValueError(f"Unknown median engine {engine}")
+
+
+def filterBytesPerVoxel(
+    stage: str,
+    pixelBytes: int,
+    thresholded: bool,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+) -> int:
+    """Bytes per voxel a volume filter needs while it runs.
+
+    Args:
+        stage: "anisotropic", "threshold" or "median"
+        pixelBytes: Bytes per voxel of the input volume
+        thresholded: Whether the volume has already been thresholded to
+            8 bit labels
+        smoothingEngine: One of volumefilters.SMOOTHING_ENGINES
+        medianEngine: One of volumefilters.MEDIAN_ENGINES
+
+    Returns:
+        Bytes per voxel of the input, the output and any working buffers
+    """
+    if stage == "anisotropic":
+        if smoothingEngine not in SMOOTHING_BUFFERS:
+            raise ValueError(f"Unknown smoothing engine {smoothingEngine}")
+        return pixelBytes + SMOOTHING_BUFFERS[smoothingEngine] * 4
+    if stage == "threshold":
+        return pixelBytes + 1
+    if stage == "median":
+        return medianBytesPerVoxel(medianEngine, pixelBytes, thresholded)
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def stageHalo(
+    stage: str,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+    medianRadius: List[int] = [3, 3, 1],
+) -> int:
+    """Slices of context a volume filter needs above and below a slab, as
+    slabpipeline runs it.  The double threshold only classifies voxels on
+    slabs, its reconstruction runs on the whole 8 bit class volume."""
+    if stage == "anisotropic":
+        return volumefilters.smoothingHalo(smoothingEngine)
+    if stage == "threshold":
+        return 0
+    if stage == "median":
+        return volumefilters.medianHalo(medianEngine, medianRadius)
+    raise ValueError(f"Unknown stage {stage}")
+
+
+def stagePeaks(
+    size: List[int],
+    pixelBytes: int,
+    stages: List[str],
+    sliceBytes: int = 0,
+    loadCopies: int = 1,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+) -> Dict[str, int]:
+    """Estimate the peak memory of each enabled pipeline stage.
+
+    Args:
+        size: Size of the volume the pipeline runs on
+        pixelBytes: Bytes per voxel of the loaded volume
+        stages: Enabled volume filters, in pipeline order, from
+            "anisotropic", "threshold" and "median"
+        sliceBytes: Bytes of one full resolution decoded slice, the
+            transient buffer when shrinking on load
+        loadCopies: Copies of the volume held while it is decoded, 2 when
+            worker processes decode into shared memory that is copied into
+            the image (see LazyVolume.GetLoadCopies)
+        smoothingEngine: Engine of the anisotropic stage
+        medianEngine: Engine of the median stage
+
+    Returns:
+        Dictionary mapping each stage to its estimated peak in bytes,
+        including the runtime overhead
+    """
+    n = _voxels(size)
+    padded = [s + 2 * PAD for s in size]
+    npad = _voxels(padded)
+
+    peaks = {"load": loadCopies * n * pixelBytes + sliceBytes}
+    thresholded = False
+    for stage in stages:
+        peaks[stage] = n * filterBytesPerVoxel(
+            stage, pixelBytes, thresholded, smoothingEngine, medianEngine
+        )
+        thresholded = thresholded or stage == "threshold"
+
+    b = 1 if thresholded else pixelBytes
+    # input plus the padded copy
+    peaks["pad"] = n * b + npad * b
+    # the VTK image shares the padded volume's buffer (see sitk2vtk)
+    peaks["vtk"] = npad * b
+    peaks["contour"] = npad * b + meshBytes(padded)
+
+    return {k: v + RUNTIME_OVERHEAD for k, v in peaks.items()}
+
+
+def _slabCosts(
+    size: List[int],
+    pixelBytes: int,
+    stages: List[str],
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+    medianRadius: List[int] = [3, 3, 1],
+):
+    """Get the resident bytes, the bytes per slab slice and the total halo
+    of the volume filters run on slabs by slabpipeline.
+
+    Only the padded output volume stays resident, and, with the double
+    threshold, the 8 bit class volume and its reconstruction.  A slab and
+    its halo slices are read from the lazy volume and passed through every
+    filter, so the working memory per slice is that of the most expensive
+    filter.
+    """
+    thresholded = False
+    per_voxel = pixelBytes
+    for stage in stages:
+        cost = filterBytesPerVoxel(
+            stage, pixelBytes, thresholded, smoothingEngine, medianEngine
+        )
+        per_voxel = max(per_voxel, cost)
+        thresholded = thresholded or stage == "threshold"
+    out_bytes = 1 if thresholded else pixelBytes
+    padded = [s + 2 * PAD for s in size]
+    resident = _voxels(padded) * out_bytes
+    if thresholded:
+        resident += 2 * _voxels(size)
+    halo = sum(
+        stageHalo(stage, smoothingEngine, medianEngine, medianRadius)
+        for stage in stages
+    )
+    return resident, size[0] * size[1] * per_voxel, halo
+
+
+def slabDepth(
+    size: List[int],
+    pixelBytes: int,
+    stages: List[str],
+    budget: int,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+    medianRadius: List[int] = [3, 3, 1],
+) -> Optional[int]:
+    """Find the deepest z slab the volume filters can run on within budget.
+
+    Args:
+        size: Size of the volume
+        pixelBytes: Bytes per voxel of the volume
+        stages: Enabled volume filters, in pipeline order
+        budget: Memory budget in bytes
+        smoothingEngine: Engine of the anisotropic stage
+        medianEngine: Engine of the median stage
+        medianRadius: Kernel radius of the median stage, (x, y, z)
+
+    Returns:
+        Number of slices per slab, or None if not even one slice fits
+    """
+    resident, per_slice, halo = _slabCosts(
+        size, pixelBytes, stages, smoothingEngine, medianEngine, medianRadius
+    )
+    depth = (budget - RUNTIME_OVERHEAD - resident) // per_slice - 2 * halo
+    if depth < 1:
+        return None
+    return int(min(depth, size[2]))
+
+
+def slabPeaks(
+    size: List[int],
+    pixelBytes: int,
+    stages: List[str],
+    depth: int,
+    loadCopies: int = 1,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+    medianRadius: List[int] = [3, 3, 1],
+) -> Dict[str, int]:
+    """Estimate the peak memory of the load, filter and pad stages when the
+    volume filters run on z slabs.
+
+    Args:
+        size: Size of the volume
+        pixelBytes: Bytes per voxel of the volume
+        stages: Enabled volume filters, in pipeline order
+        depth: Slices per slab
+        loadCopies: Copies of a slab held while it is decoded
+        smoothingEngine: Engine of the anisotropic stage
+        medianEngine: Engine of the median stage
+        medianRadius: Kernel radius of the median stage, (x, y, z)
+
+    Returns:
+        Dictionary mapping each of those stages to its estimated peak in
+        bytes, including the runtime overhead
+    """
+    resident, per_slice, halo = _slabCosts(
+        size, pixelBytes, stages, smoothingEngine, medianEngine, medianRadius
+    )
+    slab = min(size[2], depth + 2 * halo)
+    plane = size[0] * size[1]
+    peaks = {"load": resident + loadCopies * slab * plane * pixelBytes}
+    for stage in stages:
+        peaks[stage] = resident + slab * per_slice
+    # the slabs are pasted into the padded output image, so it is not copied
+    peaks["pad"] = resident
+    return {k: v + RUNTIME_OVERHEAD for k, v in peaks.items()}
+
+
+def planMemory(
+    size: List[int],
+    pixelBytes: int,
+    budget: int,
+    stages: List[str],
+    allowSlabs: bool = True,
+    loadCopies: int = 1,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+    medianRadius: List[int] = [3, 3, 1],
+) -> Optional[Dict]:
+    """Choose the resolution and slab strategy that fit a memory budget.
+
+    Shrink factors 1, 2, 3, ... are tried in turn, and the first one at
+    which every stage fits is chosen.  The volume is assumed to be shrunk
+    while it is loaded.  If the run does not fit with the whole volume in
+    memory but does when the volume filters stream it in z slabs, the slab
+    depth is part of the plan.
+
+    Args:
+        size: Full size of the volume, from its headers
+        pixelBytes: Bytes per voxel of the volume
+        budget: Memory budget in bytes
+        stages: Enabled volume filters, in pipeline order, from
+            "anisotropic", "threshold" and "median"
+        allowSlabs: Whether the volume filters may run on slabs
+        loadCopies: Copies of the volume held while it is decoded
+        smoothingEngine: Engine of the anisotropic stage, one of
+            volumefilters.SMOOTHING_ENGINES
+        medianEngine: Engine of the median stage, one of
+            volumefilters.MEDIAN_ENGINES
+        medianRadius: Kernel radius of the median stage, (x, y, z)
+
+    Returns:
+        Dictionary with the "shrink" factors, the shrunk "size", the
+        "slabDepth" (None to filter the whole volume), the per stage
+        "peaks" and the overall "peak" in bytes.  None if the run does not
+        fit in the budget at any resolution.
+    """
+    sliceBytes = size[0] * size[1] * (pixelBytes + 8)
+    for f in range(1, max(size) + 1):
+        shrunk = [max(1, s // f) for s in size[:2]] + [
+            max(1, (size[2] + f - 1) // f)
+        ]
+        peaks = stagePeaks(
+            shrunk,
+            pixelBytes,
+            stages,
+            sliceBytes if f > 1 else 0,
+            loadCopies,
+            smoothingEngine,
+            medianEngine,
+        )
+        depth = None
+        if max(peaks.values()) > budget:
+            if not allowSlabs:
+                continue
+            engines = (smoothingEngine, medianEngine, medianRadius)
+            depth = slabDepth(shrunk, pixelBytes, stages, budget, *engines)
+            if depth is None:
+                continue
+            peaks.update(
+                slabPeaks(shrunk, pixelBytes, stages, depth, loadCopies, *engines)
+            )
+            if max(peaks.values()) > budget:
+                continue
+
+        return {
+            "shrink": [f, f, f],
+            "size": shrunk,
+            "slabDepth": depth,
+            "peaks": peaks,
+            "peak": max(peaks.values()),
+        }
+    return None
+
+
+def printPlan(plan: Dict, budget: int) -> None:
+    """Print a memory plan from planMemory."""
+    print("Memory budget:", formatBytes(budget))
+    for stage, peak in plan["peaks"].items():
+        print(f"    {stage:12s} {formatBytes(peak)}")
+    print("Shrink factors:", plan["shrink"], "->", plan["size"])
+    if plan["slabDepth"] is not None:
+        print("Volume filters run on slabs of", plan["slabDepth"], "slices")
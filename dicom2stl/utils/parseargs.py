@@ -19,6 +19,22 @@ except PackageNotFoundError:
     pass
 
 
+ISOVALUE_METHODS = ["otsu", "multiotsu"]
+
+
+def isovalueType(value: str) -> Any:
+    """Parse an isovalue: a number, or the name of a method that picks one
+    from the volume's histogram."""
+    if value.lower() in ISOVALUE_METHODS:
+        return value.lower()
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"isovalue must be a number or one of {', '.join(ISOVALUE_METHODS)}"
+        )
+
+
 class disableFilter(argparse.Action):
     """Custom argparse action to disable a filter by prepending 'no' to its name."""
 
@@ -134,19 +150,134 @@ def createParser() -> argparse.ArgumentParser:
         action="store_true",
         default=False,
         dest="clean",
-        help="Clean up temp files",
+        help="Deprecated, has no effect: zip files are read in place and no"
+        " temp files are left behind",
     )
 
     parser.add_argument(
         "--temp", "-T", action="store", dest="temp", help="Temporary directory"
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        dest="cache_dir",
+        help="Directory for the Dicom series index cache.  Re-runs on the same "
+        "Dicom directory only re-read files that have changed",
+    )
+
+    parser.add_argument(
+        "--cache-volume",
+        action="store_true",
+        default=False,
+        dest="cache_volume",
+        help="Cache the decoded volume in the cache directory, so later runs on "
+        "the same input read it instead of decoding it again",
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-j",
+        action="store",
+        dest="workers",
+        type=int,
+        help="Decode Dicom slices with this many parallel processes, 0 for one "
+        "per CPU (default: use the SimpleITK series reader)",
+    )
+
+    parser.add_argument(
+        "--decoder",
+        action="store",
+        dest="decoder",
+        choices=["auto", "gdcm", "pydicom"],
+        help="Dicom slice decoder backend.  auto uses GDCM for JPEG family "
+        "transfer syntaxes and pydicom otherwise (default: use the SimpleITK "
+        "series reader, or auto with --workers)",
+    )
+
     parser.add_argument(
         "--search",
         "-s",
         action="store",
         dest="search",
-        help="Dicom series search string",
+        help="Dicom series search string: semicolon separated header predicates "
+        'such as "description~bone; thickness<=1; type=AXIAL; kernel=B70f". '
+        "Fields: description, type, kernel, thickness, modality, number or any "
+        "indexed header keyword, such as Rows, Columns, PixelSpacing or "
+        "BitsStored.  Operators: = != ~ (contains) < <= > >=.  "
+        "A plain word matches the series description.  The largest matching "
+        "series is loaded",
+    )
+
+    parser.add_argument(
+        "--slices",
+        action="store",
+        dest="slices",
+        help='Load only the slices START:STOP (e.g. "100:350"), half open like '
+        "a Python slice.  Slices outside the range are never decoded",
+    )
+
+    parser.add_argument(
+        "--roi",
+        action="store",
+        dest="roi",
+        help='Load only the in-plane voxel box "X0,Y0,X1,Y1" (half open).  '
+        "Slices are cropped as they are decoded",
+    )
+
+    parser.add_argument(
+        "--roi-mm",
+        action="store",
+        dest="roi_mm",
+        help='Load only the voxels inside the physical box "X0,Y0,Z0,X1,Y1,Z1" '
+        "in patient coordinates (mm).  Cannot be combined with --slices or --roi",
+    )
+
+    parser.add_argument(
+        "--shrink-on-load",
+        action="store_true",
+        default=False,
+        dest="shrink_on_load",
+        help="Shrink the volume to 256 max dim while it is decoded, by skipping "
+        "slices and averaging in-plane pixels, so the full resolution volume is "
+        "never in memory",
+    )
+
+    parser.add_argument(
+        "--memory-budget",
+        action="store",
+        dest="memory_budget",
+        help='Keep the run under this much memory, e.g. "4G" or "512M".  The '
+        "resolution is chosen from the volume headers to fit the budget, "
+        "instead of shrinking to 256 max dim",
+    )
+
+    parser.add_argument(
+        "--slab-depth",
+        action="store",
+        dest="slab_depth",
+        type=int,
+        help="Stream the volume through the volume filters in z slabs of this "
+        "many slices, decoding each slab from the input, so the whole volume is "
+        "never in memory (default: chosen by --memory-budget, or no slabs)",
+    )
+
+    parser.add_argument(
+        "--threads",
+        action="store",
+        dest="threads",
+        type=int,
+        help="Number of threads for the SimpleITK and VTK filters, 0 for one "
+        "per CPU (default: the libraries' own defaults)",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action="store",
+        dest="profile",
+        help="Write a JSON profile of the run to this file: the wall time, CPU "
+        "time, resident memory, peak memory delta, thread count and input and "
+        "output voxel or triangle counts of every stage",
     )
 
     parser.add_argument("--version", action="version", version=f"{__version__}")
@@ -163,6 +294,14 @@ def createParser() -> argparse.ArgumentParser:
         help="Tissue type for CT extraction (skin, bone, soft tissue, or fat)",
     )
 
+    vol_group.add_argument(
+        "--tissues",
+        action="store",
+        dest="tissues",
+        help="Comma separated tissue types (e.g. bone,skin) to mesh from one "
+        "load of the volume, each written to OUTPUT_<type>.stl",
+    )
+
     vol_group.add_argument(
         "--anisotropic",
         "-a",
@@ -170,14 +309,43 @@ def createParser() -> argparse.ArgumentParser:
         help="Apply anisotropic smoothing to the volume",
     )
 
+    vol_group.add_argument(
+        "--smoothing-engine",
+        action="store",
+        dest="smoothing_engine",
+        choices=["curvature", "gradient", "bilateral", "recursive"],
+        help="Edge preserving smoothing engine, fastest last: curvature or "
+        "gradient anisotropic diffusion, bilateral, or recursive Gaussian with "
+        "edge stopping.  Enables the smoothing (default=curvature)",
+    )
+
+    vol_group.add_argument(
+        "--median-engine",
+        action="store",
+        dest="median_engine",
+        choices=["auto", "median", "histogram", "majority", "morphology"],
+        help="Median filter engine.  histogram (8 bit or narrow range integer "
+        "volumes) and majority (thresholded volumes) give the same result as "
+        "median, faster.  morphology is a binary opening and closing.  auto "
+        "picks the fastest exact engine (default=auto)",
+    )
+
+    vol_group.add_argument(
+        "--median-radius",
+        action="store",
+        dest="median_radius",
+        help='Median filter radius "X,Y,Z" in voxels (default="3,3,1")',
+    )
+
     vol_group.add_argument(
         "--isovalue",
         "-i",
         action="store",
         dest="isovalue",
-        type=float,
+        type=isovalueType,
         default=0.0,
-        help="Iso-surface value",
+        help="Iso-surface value, or otsu or multiotsu to pick one from the "
+        "volume's histogram",
     )
 
     vol_group.add_argument(
@@ -197,6 +365,34 @@ def createParser() -> argparse.ArgumentParser:
         help="Keep only the largest connected component of the mesh",
     )
 
+    mesh_group.add_argument(
+        "--extractor",
+        action="store",
+        dest="extractor",
+        default="flyingedges",
+        choices=[
+            "contour",
+            "flyingedges",
+            "marchingcubes",
+            "synchronized-templates",
+            "discrete-flyingedges",
+            "surfacenets",
+        ],
+        help="Isosurface extraction filter (default=flyingedges, the fastest). "
+        "discrete-flyingedges and surfacenets extract the tissue label made by "
+        "--type, --double or --tissues",
+    )
+
+    mesh_group.add_argument(
+        "--extract-workers",
+        action="store",
+        dest="extract_workers",
+        type=int,
+        default=None,
+        help="Extract the surface in z slabs with this many worker processes "
+        "(0 for one per CPU)",
+    )
+
     mesh_group.add_argument(
         "--rotaxis",
         action="store",
@@ -220,8 +416,9 @@ def createParser() -> argparse.ArgumentParser:
         action="store",
         dest="smooth",
         type=int,
-        default=25,
-        help="Mesh smoothing iterations (default=25)",
+        default=None,
+        help="Mesh smoothing iterations, 0 to skip the smoothing (default=25, "
+        "or 0 with surfacenets, which smooths the surface itself)",
     )
 
     mesh_group.add_argument(
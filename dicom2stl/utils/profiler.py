@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+
+"""
+Per-stage profiling of the dicom2stl pipeline.
+
+Each load, volume and mesh stage of the pipeline is run inside a
+profiler.stage() block, which records its wall time, CPU time, resident
+memory, peak resident memory, the thread count of the process and the
+size of its input and output (voxels for volumes, triangles for meshes).
+Profiling is off until start() is called, so the stage blocks cost next
+to nothing in a normal run.  The records are written as JSON by write().
+
+On Linux the peak resident size of each stage is measured exactly, by
+resetting the kernel's high water mark (VmHWM) at the start of the stage.
+Elsewhere the peak is the process's lifetime peak from getrusage, which is
+only an upper bound for a stage that runs after a bigger one.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import json
+import math
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import SimpleITK as sitk
+import vtk
+
+from dicom2stl.utils import threads
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_STATUS = "/proc/self/status"
+_CLEAR_REFS = "/proc/self/clear_refs"
+
+_records: Optional[List[Dict[str, Any]]] = None
+_open: List[Dict[str, Any]] = []
+_start = 0.0
+# Peak resident size of the run, kept here because resetting the high
+# water mark also resets the process's getrusage peak
+_runPeak = 0
+
+
+def _status() -> Dict[str, int]:
+    """Read the memory (in bytes) and thread fields of /proc/self/status."""
+    fields = {}
+    try:
+        with open(_STATUS) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    fields[key] = int(value.split()[0]) * 1024
+                elif key == "Threads":
+                    fields[key] = int(value)
+    except OSError:
+        pass
+    return fields
+
+
+def _maxRSS() -> Optional[int]:
+    """Lifetime peak resident size of the process, in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _resetPeak() -> bool:
+    """Reset the peak resident size to the current size (Linux only)."""
+    try:
+        with open(_CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def memoryUsage() -> Dict[str, Optional[int]]:
+    """Get the current and peak resident size, in bytes, and the number of
+    threads of the process."""
+    status = _status()
+    return {
+        "rss": status.get("VmRSS"),
+        "peak": status.get("VmHWM", _maxRSS()),
+        "threads": status.get("Threads", threading.active_count()),
+    }
+
+
+def start() -> None:
+    """Start recording stages, discarding any earlier records."""
+    global _records, _start, _runPeak
+    _records = []
+    _open.clear()
+    _start = time.perf_counter()
+    _runPeak = memoryUsage()["peak"] or 0
+
+
+def stop() -> None:
+    """Stop recording stages."""
+    global _records
+    _records = None
+    _open.clear()
+
+
+def enabled() -> bool:
+    """Whether stages are being recorded."""
+    return _records is not None
+
+
+def records() -> List[Dict[str, Any]]:
+    """Get the stage records so far."""
+    return list(_records or [])
+
+
+@contextmanager
+def stage(name: str, **info: Any) -> Iterator[Dict[str, Any]]:
+    """Profile a pipeline stage.
+
+    The yielded dictionary is the stage's record, so output counts known
+    only once the stage has run can be added to it, e.g.
+
+        with profiler.stage("median", input=voxels(img)) as rec:
+            img = sitk.Median(img)
+            rec["output"] = voxels(img)
+
+    Stages may be nested.  An enclosing stage's peak includes the peaks of
+    the stages inside it.
+
+    Args:
+        name: Stage name
+        info: Extra fields of the record, such as the input size
+
+    Yields:
+        The stage record, or a throwaway dictionary when profiling is off
+    """
+    global _runPeak
+    if _records is None:
+        yield dict(info)
+        return
+
+    # the high water mark so far belongs to the stages already open
+    before = memoryUsage()
+    _runPeak = max(_runPeak, before["peak"] or 0)
+    for rec in _open:
+        rec["_peak"] = max(rec["_peak"], _runPeak)
+    exact = _resetPeak()
+    rss = memoryUsage()["rss"] if exact else before["rss"]
+
+    rec = {"name": name, **info}
+    rec["_peak"] = rss or 0
+    _open.append(rec)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield rec
+    finally:
+        rec["start"] = wall - _start
+        rec["wall"] = time.perf_counter() - wall
+        rec["cpu"] = time.process_time() - cpu
+        after = memoryUsage()
+        _open.remove(rec)
+        peak = max(rec.pop("_peak"), after["peak"] or 0)
+        _runPeak = max(_runPeak, peak)
+        for outer in _open:
+            outer["_peak"] = max(outer["_peak"], peak)
+        rec["rss"] = after["rss"]
+        rec["rssDelta"] = None
+        rec["peakRSS"] = peak or None
+        rec["peakRSSDelta"] = None
+        if rss is not None and after["rss"] is not None:
+            rec["rssDelta"] = after["rss"] - rss
+            rec["peakRSSDelta"] = peak - rss
+        rec["threads"] = after["threads"]
+        if _records is not None:
+            _records.append(rec)
+
+
+def voxels(img) -> int:
+    """Number of voxels of a SimpleITK image, VTK image or lazy volume."""
+    if isinstance(img, sitk.Image):
+        return img.GetNumberOfPixels()
+    if isinstance(img, vtk.vtkImageData):
+        return img.GetNumberOfPoints()
+    return int(math.prod(img.GetSize()))
+
+
+def triangles(mesh) -> Optional[int]:
+    """Number of polygons of a VTK mesh, None for no mesh."""
+    return None if mesh is None else mesh.GetNumberOfPolys()
+
+
+def report(extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Get the profile: the stage records plus information about the run.
+
+    Args:
+        extra: More run information, e.g. the command line options
+
+    Returns:
+        Dictionary with the "stages", the total "wall" time, the "peakRSS"
+        of the process, the library "threads" settings and the run
+        information
+    """
+    usage = memoryUsage()
+    result = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "simpleitk": sitk.Version.VersionString(),
+        "vtk": vtk.vtkVersion.GetVTKVersion(),
+        "threads": threads.getNumberOfThreads(),
+        "wall": time.perf_counter() - _start,
+        "cpu": time.process_time(),
+        "peakRSS": max(_runPeak, usage["peak"] or 0) or None,
+        "stages": records(),
+    }
+    if extra:
+        result.update(extra)
+    return result
+
+
+def write(fileName: str, extra: Optional[Dict[str, Any]] = None) -> None:
+    """Write the profile as a JSON file.
+
+    Args:
+        fileName: Output file name
+        extra: More run information, e.g. the command line options
+    """
+    with open(fileName, "w") as f:
+        json.dump(report(extra), f, indent=2, default=str)
+    print("Profile:", fileName)
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+
+"""
+Persistent on-disk index of DICOM file headers.
+
+The index is an SQLite database that remembers, for every file it has seen,
+the file's size and modification time along with the header fields used to
+group and order DICOM series.  On later runs only the files whose stat has
+changed are read again, and the files a directory walk no longer finds are
+pruned.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import json
+import os
+import sqlite3
+from typing import Callable, Dict, List, Optional
+
+
+def defaultCacheDir() -> str:
+    """Get the default dicom2stl cache directory.
+
+    Returns:
+        $XDG_CACHE_HOME/dicom2stl, or ~/.cache/dicom2stl if XDG_CACHE_HOME
+        is not set
+    """
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "dicom2stl")
+
+
+class SeriesIndex:
+    """An SQLite index of DICOM headers keyed by file path and stat."""
+
+    # Bump when the stored header fields change so stale indices are rebuilt
+    SCHEMA_VERSION = 4
+    DB_NAME = "series_index.sqlite"
+
+    def __init__(self, cacheDir: Optional[str] = None) -> None:
+        """Open (or create) the index in a cache directory.
+
+        Args:
+            cacheDir: Directory holding the index database.  If None, the
+                default cache directory is used.
+        """
+        if cacheDir is None:
+            cacheDir = defaultCacheDir()
+        os.makedirs(cacheDir, exist_ok=True)
+        self.path = os.path.join(cacheDir, SeriesIndex.DB_NAME)
+        self.db = sqlite3.connect(self.path)
+        self._createTables()
+
+    def _createTables(self) -> None:
+        """Create the index tables, dropping them if the schema is out of date."""
+        cur = self.db.cursor()
+        cur.execute("PRAGMA user_version")
+        version = cur.fetchone()[0]
+        if version != SeriesIndex.SCHEMA_VERSION:
+            cur.execute("DROP TABLE IF EXISTS files")
+            cur.execute(f"PRAGMA user_version = {SeriesIndex.SCHEMA_VERSION}")
+        cur.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER,
+                mtime INTEGER,
+                series_uid TEXT,
+                instance INTEGER,
+                position TEXT,
+                header TEXT
+            )"""
+        )
+        self.db.commit()
+
+    def lookup(self, file_path: str, size: int, mtime: int):
+        """Look up a file in the index.
+
+        Args:
+            file_path: Absolute path of the file
+            size: Current size of the file in bytes
+            mtime: Current modification time of the file in nanoseconds
+
+        Returns:
+            (found, header) where found is False if the file is not in the
+            index or its stat has changed.  header is None for files that
+            are not DICOM images.
+        """
+        cur = self.db.execute(
+            "SELECT size, mtime, header FROM files WHERE path = ?", (file_path,)
+        )
+        row = cur.fetchone()
+        if row is None or row[0] != size or row[1] != mtime:
+            return False, None
+        if row[2] is None:
+            return True, None
+        return True, json.loads(row[2])
+
+    def store(self, entries: List) -> None:
+        """Store files and their headers in the index.
+
+        Args:
+            entries: List of (path, size, mtime, header) tuples.  header is
+                None for files that are not DICOM images.
+        """
+        rows = []
+        for file_path, size, mtime, header in entries:
+            if header is None:
+                rows.append((file_path, size, mtime, None, None, None, None))
+            else:
+                rows.append(
+                    (
+                        file_path,
+                        size,
+                        mtime,
+                        header.get("SeriesInstanceUID"),
+                        header.get("InstanceNumber"),
+                        json.dumps(header.get("ImagePositionPatient")),
+                        json.dumps(header),
+                    )
+                )
+        self.db.executemany(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.db.commit()
+
+    def headers(
+        self,
+        file_paths: List[str],
+        reader: Callable[[List[str]], Dict[str, Optional[Dict]]],
+    ) -> Dict[str, Optional[Dict]]:
+        """Get the headers of a set of files, reading only changed files.
+
+        Args:
+            file_paths: Paths of the files
+            reader: Function that reads the headers of a list of files and
+                returns a dictionary mapping path to header, such as
+                dicomutils.readDicomHeaders
+
+        Returns:
+            Dictionary mapping each file path to its header, or to None if
+            the file is not a DICOM image
+        """
+        result = {}
+        stale = []
+        for f in file_paths:
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            full_path = os.path.abspath(f)
+            found, header = self.lookup(full_path, st.st_size, st.st_mtime_ns)
+            if found:
+                result[f] = header
+            else:
+                stale.append((f, full_path, st.st_size, st.st_mtime_ns))
+
+        if stale:
+            print("Series index: reading", len(stale), "new or changed files")
+            new_headers = reader([s[0] for s in stale])
+            entries = []
+            for f, full_path, size, mtime in stale:
+                header = new_headers.get(f)
+                result[f] = header
+                entries.append((full_path, size, mtime, header))
+            self.store(entries)
+
+        # keep the caller's file order
+        return {f: result[f] for f in file_paths if f in result}
+
+    def prune(self, root: str, file_paths: List[str]) -> int:
+        """Remove the files under a directory that a walk did not find.
+
+        Args:
+            root: Directory that was walked
+            file_paths: Paths of all the files found under root
+
+        Returns:
+            The number of files removed from the index
+        """
+        prefix = os.path.join(os.path.abspath(root), "")
+        seen = {os.path.abspath(f) for f in file_paths}
+        cur = self.db.execute(
+            "SELECT path FROM files WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix),
+        )
+        gone = [(row[0],) for row in cur if row[0] not in seen]
+        if gone:
+            self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+            self.db.commit()
+        return len(gone)
+
+    def close(self) -> None:
+        """Close the index database."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
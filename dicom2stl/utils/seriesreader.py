@@ -0,0 +1,664 @@
+#! /usr/bin/env python
+
+"""
+Functions to build a SimpleITK volume from individually decoded Dicom slices.
+
+The geometry (size, origin, spacing and direction) and the output pixel
+type of a series are computed from the slice headers alone, so the volume
+can be allocated before any pixel data is decoded.  Slices are decoded and
+rescaled into the volume, either one at a time, straight into the buffer
+of the SimpleITK image, or by a pool of worker processes that write into a
+shared memory volume that is then copied into the image.
+
+Each slice is decoded by one of two backends: pydicom, or GDCM through the
+SimpleITK image reader.  They support different sets of compressed transfer
+syntaxes and differ in speed, so the backend can be chosen per run, or
+picked from the series' transfer syntax ("auto").
+
+A slice source is either a file path or a (zip file name, member name)
+tuple for a slice stored in a zip archive.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pydicom
+import SimpleITK as sitk
+
+from dicom2stl.utils import threads
+
+try:
+    from pydicom.pixels import get_decoder
+except ImportError:
+    # pydicom < 3
+    get_decoder = None
+
+# Slice decoder backends.  "auto" uses GDCM for the JPEG family transfer
+# syntaxes, where its codecs are faster, and for anything pydicom cannot
+# decode.  Native and RLE slices are decoded faster by pydicom.
+DECODERS = ["auto", "gdcm", "pydicom"]
+
+GDCM_TRANSFER_SYNTAXES = {
+    "1.2.840.10008.1.2.4.50",  # JPEG baseline
+    "1.2.840.10008.1.2.4.51",  # JPEG extended
+    "1.2.840.10008.1.2.4.57",  # JPEG lossless
+    "1.2.840.10008.1.2.4.70",  # JPEG lossless, first order prediction
+    "1.2.840.10008.1.2.4.80",  # JPEG-LS lossless
+    "1.2.840.10008.1.2.4.81",  # JPEG-LS near lossless
+    "1.2.840.10008.1.2.4.90",  # JPEG 2000 lossless
+    "1.2.840.10008.1.2.4.91",  # JPEG 2000
+}
+
+
+def sliceNormal(orientation: List[float]) -> List[float]:
+    """Compute the slice normal from an ImageOrientationPatient value.
+
+    Args:
+        orientation: The 6 direction cosines of the image row and column
+
+    Returns:
+        The cross product of the row and column directions
+    """
+    row = orientation[:3]
+    col = orientation[3:]
+    return [
+        row[1] * col[2] - row[2] * col[1],
+        row[2] * col[0] - row[0] * col[2],
+        row[0] * col[1] - row[1] * col[0],
+    ]
+
+
+def seriesGeometry(headers: List[Dict]) -> Tuple[List, List, List, List]:
+    """Compute the volume geometry of a sorted series from its slice headers.
+
+    Args:
+        headers: Slice headers, in slice order, as returned by
+            dicomutils.readDicomHeader
+
+    Returns:
+        Tuple of (size, origin, spacing, direction) in SimpleITK conventions
+    """
+    first = headers[0]
+    size = [first["Columns"], first["Rows"], len(headers)]
+
+    orientation = first.get("ImageOrientationPatient") or [1, 0, 0, 0, 1, 0]
+    normal = sliceNormal(orientation)
+    direction = [
+        orientation[0], orientation[3], normal[0],
+        orientation[1], orientation[4], normal[1],
+        orientation[2], orientation[5], normal[2],
+    ]
+
+    pixel_spacing = first.get("PixelSpacing") or [1.0, 1.0]
+    zspacing = first.get("SliceThickness") or 1.0
+    origin = first.get("ImagePositionPatient") or [0.0, 0.0, 0.0]
+    last = headers[-1].get("ImagePositionPatient")
+    if len(headers) > 1 and last:
+        dist = sum((b - a) * n for a, b, n in zip(origin, last, normal))
+        if dist != 0.0:
+            zspacing = abs(dist) / (len(headers) - 1)
+
+    # PixelSpacing is (row spacing, column spacing), i.e. (y, x)
+    spacing = [pixel_spacing[1], pixel_spacing[0], zspacing]
+    return size, list(origin), spacing, direction
+
+
+def cropGeometry(geometry: Tuple, box: Tuple[int, int, int, int]) -> Tuple:
+    """Compute the geometry of an in-plane crop of a volume.
+
+    Args:
+        geometry: (size, origin, spacing, direction) from seriesGeometry
+        box: (x0, y0, x1, y1) half open in-plane index box
+
+    Returns:
+        (size, origin, spacing, direction) of the cropped volume
+    """
+    size, origin, spacing, direction = geometry
+    x0, y0, x1, y1 = box
+    d = np.reshape(direction, (3, 3))
+    shift = d @ np.array([x0 * spacing[0], y0 * spacing[1], 0.0])
+    origin = [float(o + s) for o, s in zip(origin, shift)]
+    return [x1 - x0, y1 - y0, size[2]], origin, spacing, direction
+
+
+def binGeometry(geometry: Tuple, binning: Tuple[int, int]) -> Tuple:
+    """Compute the geometry of a volume whose slices are binned in-plane.
+
+    Like sitk.BinShrink, the size is rounded down and the origin moves to
+    the center of the first bin.
+
+    Args:
+        geometry: (size, origin, spacing, direction) from seriesGeometry
+        binning: (x, y) bin factors
+
+    Returns:
+        (size, origin, spacing, direction) of the binned volume
+    """
+    size, origin, spacing, direction = geometry
+    fx, fy = binning
+    d = np.reshape(direction, (3, 3))
+    shift = d @ np.array(
+        [(fx - 1) / 2.0 * spacing[0], (fy - 1) / 2.0 * spacing[1], 0.0]
+    )
+    origin = [float(o + s) for o, s in zip(origin, shift)]
+    spacing = [spacing[0] * fx, spacing[1] * fy, spacing[2]]
+    return [size[0] // fx, size[1] // fy, size[2]], origin, spacing, direction
+
+
+def seriesPixelType(header: Dict) -> np.dtype:
+    """Choose the numpy type that holds a series' rescaled pixel values.
+
+    Like GDCM, the smallest integer type that holds the rescaled range of
+    the stored bits is used, or float32 if the rescale slope or intercept
+    is not integral.
+
+    Args:
+        header: Header of a slice of the series
+
+    Returns:
+        numpy dtype of the rescaled pixels
+    """
+    bits = header.get("BitsStored") or header.get("BitsAllocated") or 16
+    slope = header.get("RescaleSlope")
+    intercept = header.get("RescaleIntercept")
+    slope = 1.0 if slope is None else slope
+    intercept = 0.0 if intercept is None else intercept
+
+    if header.get("PixelRepresentation") == 1:
+        lo, hi = -(2 ** (bits - 1)), 2 ** (bits - 1) - 1
+    else:
+        lo, hi = 0, 2**bits - 1
+
+    if slope != math.floor(slope) or intercept != math.floor(intercept):
+        return np.dtype(np.float32)
+
+    lo, hi = sorted((slope * lo + intercept, slope * hi + intercept))
+    for t in (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32):
+        info = np.iinfo(t)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(t)
+    return np.dtype(np.float64)
+
+
+# Header fields that must agree across a series for its slices to be
+# decoded by one backend into one pixel type
+PIXEL_FORMAT_FIELDS = [
+    "BitsAllocated",
+    "BitsStored",
+    "PixelRepresentation",
+    "SamplesPerPixel",
+    "TransferSyntaxUID",
+]
+
+
+def uniformPixelFormat(headers: List[Dict]) -> bool:
+    """Test if every slice of a series has the same pixel format.
+
+    Args:
+        headers: Slice headers of the series
+
+    Returns:
+        True if the PIXEL_FORMAT_FIELDS of all the headers are the same
+    """
+    formats = {tuple(h.get(k) for k in PIXEL_FORMAT_FIELDS) for h in headers}
+    return len(formats) <= 1
+
+
+def volumePixelType(headers: List[Dict]) -> np.dtype:
+    """Choose the numpy type that holds the rescaled pixels of every slice.
+
+    Args:
+        headers: Slice headers of the series
+
+    Returns:
+        The smallest numpy dtype that all the slices' seriesPixelType
+        convert to without loss
+    """
+    return np.result_type(*{seriesPixelType(h) for h in headers})
+
+
+def decodeWorkers(headers: List[Dict], workers: Optional[int] = None) -> int:
+    """Get the number of processes readSeries decodes a series with.
+
+    Series whose slices differ in pixel format are always decoded slice by
+    slice in this process.
+
+    Args:
+        headers: Slice headers of the series
+        workers: Requested worker processes, see readSeries
+
+    Returns:
+        Number of worker processes, 1 to decode in this process
+    """
+    if not uniformPixelFormat(headers):
+        return 1
+    if not workers:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, len(headers)))
+
+
+def pydicomCanDecode(transferSyntax: Optional[str]) -> bool:
+    """Test if pydicom has a usable codec for a transfer syntax.
+
+    Args:
+        transferSyntax: Transfer Syntax UID of the slice files
+
+    Returns:
+        True if pydicom can decode pixel data with this transfer syntax
+    """
+    if not transferSyntax:
+        return True
+    uid = pydicom.uid.UID(transferSyntax)
+    if get_decoder is not None:
+        try:
+            return get_decoder(uid).is_available
+        except NotImplementedError:
+            return False
+
+    for handler in pydicom.config.pixel_data_handlers:
+        if handler.is_available() and handler.supports_transfer_syntax(uid):
+            return True
+    return False
+
+
+def chooseDecoder(header: Dict, decoder: str = "auto") -> str:
+    """Choose the backend that decodes the slices of a series.
+
+    Args:
+        header: Header of a slice of the series
+        decoder: One of DECODERS
+
+    Returns:
+        "gdcm" or "pydicom"
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Unknown decoder {decoder!r}, expected one of {DECODERS}")
+    if decoder != "auto":
+        return decoder
+    transfer_syntax = header.get("TransferSyntaxUID")
+    if transfer_syntax in GDCM_TRANSFER_SYNTAXES:
+        return "gdcm"
+    if pydicomCanDecode(transfer_syntax):
+        return "pydicom"
+    return "gdcm"
+
+
+def datasetTransferSyntax(ds: pydicom.Dataset) -> Optional[str]:
+    """Get the transfer syntax of a dataset read by pydicom.
+
+    Files without a preamble and file meta information, as read with
+    force=True, have no TransferSyntaxUID, so it is taken from the
+    encoding the dataset was read with.
+
+    Args:
+        ds: The dataset
+
+    Returns:
+        Transfer Syntax UID, or None if it is not known
+    """
+    meta = getattr(ds, "file_meta", None)
+    if meta is not None and meta.get("TransferSyntaxUID"):
+        return str(meta.TransferSyntaxUID)
+    encoding = getattr(ds, "original_encoding", None)
+    if encoding is None:
+        # pydicom < 3
+        encoding = (ds.is_implicit_VR, ds.is_little_endian)
+    implicit, little = encoding
+    if implicit is None or little is None:
+        return None
+    if implicit:
+        return pydicom.uid.ImplicitVRLittleEndian
+    if little:
+        return pydicom.uid.ExplicitVRLittleEndian
+    return pydicom.uid.ExplicitVRBigEndian
+
+
+def decodeSlice(source: Union[str, BinaryIO], dtype: np.dtype) -> np.ndarray:
+    """Decode the pixels of one Dicom slice with pydicom and apply its rescale.
+
+    Args:
+        source: Path or file object of the Dicom slice
+        dtype: numpy type of the output, as returned by seriesPixelType
+
+    Returns:
+        (rows, columns) array of rescaled pixel values, or (rows,
+        columns, samples) for color slices
+    """
+    ds = pydicom.dcmread(source, force=True)
+    if "TransferSyntaxUID" not in getattr(ds, "file_meta", {}):
+        # a file without file meta information, see datasetTransferSyntax
+        transfer_syntax = datasetTransferSyntax(ds)
+        ds.file_meta = pydicom.dataset.FileMetaDataset()
+        ds.file_meta.TransferSyntaxUID = transfer_syntax
+    pixels = ds.pixel_array
+    slope = float(ds.get("RescaleSlope", 1.0))
+    intercept = float(ds.get("RescaleIntercept", 0.0))
+
+    if slope == 1.0:
+        pixels = pixels.astype(dtype, copy=False)
+        if intercept != 0.0:
+            pixels += np.asarray(intercept).astype(dtype)
+        return pixels
+    return (pixels * slope + intercept).astype(dtype)
+
+
+def decodeSliceGDCM(file_path: str, dtype: np.dtype) -> np.ndarray:
+    """Decode the pixels of one Dicom slice file with GDCM.
+
+    GDCM applies the rescale slope and intercept itself.
+
+    Args:
+        file_path: Path of the Dicom slice
+        dtype: numpy type of the output, as returned by seriesPixelType
+
+    Returns:
+        (rows, columns) array of rescaled pixel values, or (rows,
+        columns, samples) for color slices
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetImageIO("GDCMImageIO")
+    reader.SetFileName(file_path)
+    img = reader.Execute()
+    pixels = sitk.GetArrayViewFromImage(img)
+    if img.GetDimension() == 3:
+        pixels = pixels[0]
+    return pixels.astype(dtype)
+
+
+# Zip members larger than this are spooled to a temporary file when they
+# are decoded, smaller ones stay in memory.
+ZIP_SPOOL_SIZE = 64 * 1024 * 1024
+
+# Zip files opened by this process, keyed by file name
+_zipFiles: Dict[str, zipfile.ZipFile] = {}
+
+
+def decodeSource(
+    source: Union[str, Tuple[str, str]],
+    dtype: np.dtype,
+    spoolDir: Optional[str] = None,
+    decoder: str = "pydicom",
+) -> np.ndarray:
+    """Decode a slice from a file or from a zip archive member.
+
+    Args:
+        source: File path, or (zip file name, member name) tuple
+        dtype: numpy type of the output, as returned by seriesPixelType
+        spoolDir: Directory for spool files of large zip members, or None
+            for the system default
+        decoder: Decoder backend, "gdcm" or "pydicom"
+
+    Returns:
+        (rows, columns) array of rescaled pixel values, or (rows,
+        columns, samples) for color slices
+    """
+    if isinstance(source, str):
+        if decoder == "gdcm":
+            return decodeSliceGDCM(source, dtype)
+        return decodeSlice(source, dtype)
+
+    zipname, member = source
+    if zipname not in _zipFiles:
+        _zipFiles[zipname] = zipfile.ZipFile(zipname, "r")
+
+    if decoder == "gdcm":
+        # GDCM only reads from files, so the member is always spooled to disk
+        with tempfile.NamedTemporaryFile(
+            suffix=".dcm", dir=spoolDir, delete=False
+        ) as spool:
+            with _zipFiles[zipname].open(member) as fp:
+                shutil.copyfileobj(fp, spool)
+        try:
+            return decodeSliceGDCM(spool.name, dtype)
+        finally:
+            os.remove(spool.name)
+
+    with tempfile.SpooledTemporaryFile(
+        max_size=ZIP_SPOOL_SIZE, dir=spoolDir
+    ) as spool:
+        with _zipFiles[zipname].open(member) as fp:
+            shutil.copyfileobj(fp, spool)
+        spool.seek(0)
+        return decodeSlice(spool, dtype)
+
+
+def closeZipFiles() -> None:
+    """Close the zip files opened by decodeSource in this process."""
+    for zf in _zipFiles.values():
+        zf.close()
+    _zipFiles.clear()
+
+
+# Per worker process state for readSeries
+_worker = {}
+
+
+def _initWorker(
+    name: str,
+    shape: Tuple,
+    dtype: str,
+    spoolDir: Optional[str],
+    decoder: str,
+    box: Optional[Tuple[int, int, int, int]],
+    binning: Optional[Tuple[int, int]],
+) -> None:
+    """Process pool initializer: attach to the shared memory volume.
+
+    The workers share the parent's resource tracker, so attaching does not
+    add another owner that could unlink the block."""
+    shm = shared_memory.SharedMemory(name=name)
+    _worker["shm"] = shm
+    _worker["volume"] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _worker["spoolDir"] = spoolDir
+    _worker["decoder"] = decoder
+    _worker["box"] = box
+    _worker["binning"] = binning
+
+
+def _decodeInto(job: Tuple[int, Union[str, Tuple[str, str]]]) -> int:
+    """Decode one slice into the shared memory volume."""
+    index, source = job
+    volume = _worker["volume"]
+    volume[index] = reduceSlice(
+        decodeSource(source, volume.dtype, _worker["spoolDir"], _worker["decoder"]),
+        _worker["box"],
+        _worker["binning"],
+    )
+    return index
+
+
+def reduceSlice(
+    pixels: np.ndarray,
+    box: Optional[Tuple[int, int, int, int]] = None,
+    binning: Optional[Tuple[int, int]] = None,
+) -> np.ndarray:
+    """Crop a decoded (rows, columns[, samples]) slice and average it over bins.
+
+    Args:
+        pixels: The decoded slice
+        box: (x0, y0, x1, y1) half open box to keep, or None
+        binning: (x, y) bin factors, or None.  Partial bins at the right
+            and bottom edges are dropped, as by sitk.BinShrink.
+
+    Returns:
+        The reduced slice, with the type of pixels
+    """
+    if box is not None:
+        x0, y0, x1, y1 = box
+        pixels = pixels[y0:y1, x0:x1]
+    if binning is None:
+        return pixels
+
+    fx, fy = binning
+    ny, nx = pixels.shape[0] // fy, pixels.shape[1] // fx
+    bins = pixels[: ny * fy, : nx * fx].reshape(ny, fy, nx, fx, *pixels.shape[2:])
+    mean = bins.mean(axis=(1, 3))
+    if np.issubdtype(pixels.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(pixels.dtype)
+
+
+def readSeries(
+    sources: List,
+    headers: List[Dict],
+    workers: Optional[int] = None,
+    spoolDir: Optional[str] = None,
+    decoder: str = "auto",
+    box: Optional[Tuple[int, int, int, int]] = None,
+    binning: Optional[Tuple[int, int]] = None,
+) -> sitk.Image:
+    """Decode a sorted series of slices into a SimpleITK volume.
+
+    With one worker, each slice is decoded and pasted into a preallocated
+    SimpleITK image.  With more, the slices are decoded in parallel by
+    worker processes that write directly into a preallocated shared memory
+    volume, which is then copied into a SimpleITK image.  A series whose
+    slices differ in pixel format (see uniformPixelFormat) is always
+    decoded slice by slice, each with its own backend, into the type that
+    holds every slice's pixels.  If an in-plane box or bin
+    factors are given, each slice is cropped and binned as soon as it is
+    decoded, so only the reduced slices are held for the whole volume.  The
+    decoder backend and the decode throughput are printed.
+
+    Args:
+        sources: Slice sources (file paths or zip member tuples) in slice order
+        headers: Slice headers, in the same order as sources
+        workers: Number of worker processes.  None or 0 uses all the CPUs,
+            1 decodes in this process.
+        spoolDir: Directory for spool files of large zip members
+        decoder: Slice decoder backend, one of DECODERS
+        box: (x0, y0, x1, y1) half open in-plane index box to keep, or None
+            for the whole slices
+        binning: (x, y) in-plane bin factors, or None for no binning
+
+    Returns:
+        SimpleITK image with the geometry given by the slice headers
+    """
+    geometry = seriesGeometry(headers)
+    if box is not None:
+        geometry = cropGeometry(geometry, box)
+    if binning is not None:
+        geometry = binGeometry(geometry, binning)
+    dtype = volumePixelType(headers)
+    components = {h.get("SamplesPerPixel") or 1 for h in headers}
+    if len(components) > 1:
+        raise ValueError("The slices differ in samples per pixel")
+    components = components.pop()
+    size = geometry[0]
+    shape = (size[2], size[1], size[0])
+    if components > 1:
+        # (y, x, component) slices of a vector image, e.g. RGB
+        shape += (components,)
+    nslices = len(sources)
+    workers = decodeWorkers(headers, workers)
+    if uniformPixelFormat(headers):
+        backends = [chooseDecoder(headers[0], decoder)] * nslices
+    else:
+        print("Warning: the slices differ in pixel format, decoding each alone")
+        backends = [chooseDecoder(h, decoder) for h in headers]
+    backend = "/".join(sorted(set(backends)))
+
+    print(f"Decoding {nslices} slices with {backend}, {workers} worker(s)")
+    start = time.perf_counter()
+
+    if workers <= 1:
+        img = emptyImage(dtype, geometry, components)
+        for i, (source, sliceBackend) in enumerate(zip(sources, backends)):
+            pixels = decodeSource(source, dtype, spoolDir, sliceBackend)
+            img[:, :, i] = sitk.GetImageFromArray(
+                reduceSlice(pixels, box, binning), isVector=components > 1
+            )
+        closeZipFiles()
+        _printThroughput(
+            backend, nslices, int(np.prod(shape)) * dtype.itemsize, start
+        )
+        return img
+
+    # The shared memory volume is copied into the SimpleITK image, so the
+    # volume is held twice while it is wrapped (see memorybudget.stagePeaks)
+    nbytes = max(1, int(np.prod(shape)) * dtype.itemsize)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=threads.processContext(),
+            initializer=_initWorker,
+            initargs=(
+                shm.name, shape, dtype.str, spoolDir, backends[0], box, binning
+            ),
+        ) as pool:
+            chunksize = max(1, nslices // (workers * 4))
+            for _ in pool.map(_decodeInto, enumerate(sources), chunksize=chunksize):
+                pass
+        volume = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        img = imageFromArray(volume, geometry)
+        del volume
+    finally:
+        shm.close()
+        shm.unlink()
+    _printThroughput(backend, nslices, nbytes, start)
+    return img
+
+
+def _printThroughput(backend: str, nslices: int, nbytes: int, start: float) -> None:
+    """Print the slice decode rate since start."""
+    dt = max(time.perf_counter() - start, 1e-9)
+    print(
+        f"    {backend}: {nslices} slices in {dt:4.3f} seconds, "
+        f"{nslices / dt:.1f} slices/s, {nbytes / dt / 1e6:.1f} MB/s"
+    )
+
+
+def emptyImage(dtype: np.dtype, geometry: Tuple, components: int = 1) -> sitk.Image:
+    """Allocate a SimpleITK image of a numpy pixel type with a geometry.
+
+    Args:
+        dtype: numpy type of the pixels
+        geometry: (size, origin, spacing, direction) from seriesGeometry
+        components: Components per pixel.  More than one makes a vector
+            image.
+
+    Returns:
+        Zero filled SimpleITK image
+    """
+    size, origin, spacing, direction = geometry
+    pixelID = sitk.GetImageFromArray(
+        np.zeros((1, 1, components), dtype), isVector=components > 1
+    ).GetPixelID()
+    img = sitk.Image([int(s) for s in size], pixelID, components)
+    img.SetOrigin(origin)
+    img.SetSpacing(spacing)
+    img.SetDirection(direction)
+    return img
+
+
+def imageFromArray(volume: np.ndarray, geometry: Tuple) -> sitk.Image:
+    """Copy a (z, y, x) volume array into a SimpleITK image with a geometry.
+
+    Args:
+        volume: numpy array of the volume in (z, y, x) order, or (z, y, x,
+            component) order for a vector image
+        geometry: (size, origin, spacing, direction) from seriesGeometry
+
+    Returns:
+        SimpleITK image with the array's pixels and the given geometry
+    """
+    _, origin, spacing, direction = geometry
+    img = sitk.GetImageFromArray(volume, isVector=volume.ndim > 3)
+    img.SetOrigin(origin)
+    img.SetSpacing(spacing)
+    img.SetDirection(direction)
+    return img
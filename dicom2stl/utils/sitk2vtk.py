@@ -3,6 +3,13 @@
 """
 Function to convert a SimpleITK image to a VTK image.
 
+The VTK image shares the SimpleITK image's pixel buffer instead of copying
+it.  The VTK scalar array holds a private SimpleITK image that shares the
+buffer and is never written to, so the buffer lives as long as the VTK
+array does, even after every other reference to it is gone.  SimpleITK
+copies on write, so writing to the caller's image afterwards gives it a
+new buffer and leaves the VTK image as it was.
+
 Written by David T. Chen from the National Institute of Allergy
 and Infectious Diseases, dchen@mail.nih.gov.
 It is covered by the Apache License, Version 2.0:
@@ -15,25 +22,33 @@ from vtk.util import numpy_support
 
 
 def sitk2vtk(img: sitk.Image, debugOn: bool = False) -> vtk.vtkImageData:
-    """Convert a SimpleITK image to a VTK image, via numpy.
-    
-    This function handles the coordinate system differences between SimpleITK and VTK:
+    """Convert a SimpleITK image to a VTK image without copying its pixels.
+
+    This function handles the coordinate system differences between
+    SimpleITK and VTK:
     - SimpleITK uses ITK conventions with physical space coordinates (mm, etc.)
-    - When converted to numpy, arrays use ZYX ordering (axis 0 = Z, axis 1 = Y, axis 2 = X)
+    - When converted to numpy, arrays use ZYX ordering (axis 0 = Z,
+      axis 1 = Y, axis 2 = X)
     - VTK uses XYZ ordering for dimensions, spacing, and extent
-    - The numpy array is raveled (flattened) in C-order, which VTK interprets correctly
-    
+    - The numpy view is raveled (flattened) in C-order, which VTK
+      interprets correctly
+
+    The VTK scalar array wraps the pixel buffer of img, through a numpy view
+    from sitk.GetArrayViewFromImage, and keeps a private copy of img, which
+    shares that buffer, alive.
+
     The function also:
     - Converts 2D images to 3D by adding a singleton dimension
     - Preserves image origin, spacing, and number of components
     - Sets the direction matrix (for VTK version 9+)
-    
+
     Args:
         img: SimpleITK image to convert
         debugOn: If True, print debug information about the conversion
-        
+
     Returns:
-        VTK image data object with the same voxel data and metadata
+        VTK image data object sharing the voxel data of img, with the same
+        metadata
     """
 
     size = list(img.GetSize())
@@ -44,11 +59,10 @@ def sitk2vtk(img: sitk.Image, debugOn: bool = False) -> vtk.vtkImageData:
 
     # there doesn't seem to be a way to specify the image orientation in VTK
 
-    # convert the SimpleITK image to a numpy array
-    i2 = sitk.GetArrayFromImage(img)
+    # a numpy view of the SimpleITK image's buffer, one row per pixel
+    i2 = sitk.GetArrayViewFromImage(img).reshape(-1, ncomp)
     if debugOn:
-        i2_string = i2.tostring()
-        print("data string address inside sitk2vtk", hex(id(i2_string)))
+        print("data address inside sitk2vtk", hex(i2.__array_interface__["data"][0]))
 
     vtk_image = vtk.vtkImageData()
 
@@ -85,8 +99,15 @@ def sitk2vtk(img: sitk.Image, debugOn: bool = False) -> vtk.vtkImageData:
     else:
         vtk_image.SetDirectionMatrix(direction)
 
-    depth_array = numpy_support.numpy_to_vtk(i2.ravel())
-    depth_array.SetNumberOfComponents(ncomp)
+    if ncomp == 1:
+        i2 = i2.reshape(-1)
+    depth_array = numpy_support.numpy_to_vtk(i2, deep=False)
+    # The view does not own the buffer, the SimpleITK image does.  VTK keeps
+    # the Python attributes of a wrapped object while the object lives, so
+    # the keeper lives as long as the array.  The keeper is a shallow copy
+    # that nothing writes to: a write to img would move img to a new buffer
+    # and free this one once img was the last owner.
+    depth_array._sitk_image = sitk.Image(img)
     vtk_image.GetPointData().SetScalars(depth_array)
 
     vtk_image.Modified()
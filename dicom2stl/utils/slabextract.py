@@ -0,0 +1,243 @@
+#! /usr/bin/env python
+
+"""
+Surface extraction in z slabs across worker processes.
+
+The volume is copied once into shared memory and split into z slabs that
+overlap by one slice, so every cell of the volume is in exactly one slab.
+Each worker process wraps its slab of the shared volume as a VTK image,
+with the slab's own extent, and extracts its part of the surface.  A
+worker only reads its slab's pages of the shared volume and only allocates
+its part of the surface, so its memory does not grow with the volume.
+
+The parent joins the parts and welds the duplicate vertices on the shared
+slices with vtkStaticCleanPolyData.  The extractors interpolate a vertex
+from the same two voxels in the neighbouring slabs, so seam vertices are
+identical and the welded mesh is as watertight as a single extraction.
+Surface nets relaxes its vertices over the whole surface, so it is always
+run in one process.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import vtk
+from vtk.util import numpy_support
+
+from dicom2stl.utils import threads
+from dicom2stl.utils import vtkutils
+
+# Slabs per worker, so a slow slab does not hold up the others
+SLABS_PER_WORKER = 4
+
+# Per worker process state
+_worker: Dict = {}
+
+
+def slabRanges(nz: int, depth: int) -> List[Tuple[int, int]]:
+    """Split the slices of a volume into slabs that share one slice.
+
+    Args:
+        nz: Number of slices
+        depth: Cells (slice gaps) per slab
+
+    Returns:
+        List of (first, last) slice indices of each slab, inclusive.  Each
+        slab's last slice is the next slab's first.
+    """
+    depth = max(1, depth)
+    ranges = []
+    z0 = 0
+    while z0 < nz - 1:
+        z1 = min(z0 + depth, nz - 1)
+        ranges.append((z0, z1))
+        z0 = z1
+    return ranges or [(0, nz - 1)]
+
+
+def _initWorker(name: str, shape: Tuple, dtype: str, geometry: Tuple) -> None:
+    """Process pool initializer: attach to the shared memory volume.
+
+    The workers share the parent's resource tracker, so attaching does not
+    add another owner that could unlink the block."""
+    shm = shared_memory.SharedMemory(name=name)
+    _worker["shm"] = shm
+    _worker["volume"] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _worker["geometry"] = geometry
+    # the workers are the parallelism, so VTK runs one thread in each
+    vtk.vtkSMPTools.Initialize(1)
+
+
+def _extractSlab(job: Tuple[int, int, float, str]) -> Tuple:
+    """Extract the surface of one slab of the shared memory volume.
+
+    Returns:
+        Tuple of (points, cell offsets, cell connectivity) numpy arrays
+    """
+    z0, z1, isovalue, extractor = job
+    volume = _worker["volume"]
+    origin, spacing, direction, start = _worker["geometry"]
+    nz, ny, nx = volume.shape
+
+    # the slab's extent within the volume's, so its points are in place
+    slab = vtk.vtkImageData()
+    slab.SetExtent(
+        start[0],
+        start[0] + nx - 1,
+        start[1],
+        start[1] + ny - 1,
+        start[2] + z0,
+        start[2] + z1,
+    )
+    slab.SetOrigin(origin)
+    slab.SetSpacing(spacing)
+    slab.SetDirectionMatrix(direction)
+    scalars = numpy_support.numpy_to_vtk(volume[z0 : z1 + 1].reshape(-1), deep=False)
+    slab.GetPointData().SetScalars(scalars)
+
+    iso = vtkutils.isosurfaceFilter(extractor)
+    iso.SetInputData(slab)
+    iso.SetValue(0, isovalue)
+    iso.Update()
+    mesh = iso.GetOutput()
+    polys = mesh.GetPolys()
+    if mesh.GetNumberOfPoints() == 0:
+        return (
+            np.empty((0, 3), np.float32),
+            np.zeros(1, np.int64),
+            np.empty(0, np.int64),
+        )
+    return (
+        numpy_support.vtk_to_numpy(mesh.GetPoints().GetData()).copy(),
+        numpy_support.vtk_to_numpy(polys.GetOffsetsArray()).astype(np.int64),
+        numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).astype(np.int64),
+    )
+
+
+def mergeParts(parts: List[Tuple]) -> vtk.vtkPolyData:
+    """Join the slab surfaces and weld their duplicate vertices.
+
+    Args:
+        parts: (points, cell offsets, cell connectivity) of each slab
+
+    Returns:
+        The welded mesh
+    """
+    points, offsets, connectivity = [], [np.zeros(1, np.int64)], []
+    npoints = ncells = 0
+    for p, o, c in parts:
+        points.append(p)
+        offsets.append(o[1:] + ncells)
+        connectivity.append(c + npoints)
+        npoints += len(p)
+        ncells += len(c)
+
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(np.concatenate(points), deep=True))
+    cells = vtk.vtkCellArray()
+    cells.SetData(
+        numpy_support.numpy_to_vtkIdTypeArray(np.concatenate(offsets), deep=True),
+        numpy_support.numpy_to_vtkIdTypeArray(np.concatenate(connectivity), deep=True),
+    )
+    joined = vtk.vtkPolyData()
+    joined.SetPoints(vtkPoints)
+    joined.SetPolys(cells)
+
+    # merge only exactly coincident points
+    weld = vtk.vtkStaticCleanPolyData()
+    weld.SetInputData(joined)
+    weld.ToleranceIsAbsoluteOn()
+    weld.SetAbsoluteTolerance(0.0)
+    weld.Update()
+    return weld.GetOutput()
+
+
+def extractSurfaceSlabs(
+    vol: vtk.vtkImageData,
+    isovalue: float = 0.0,
+    extractor: str = "flyingedges",
+    workers: Optional[int] = None,
+    depth: Optional[int] = None,
+) -> vtk.vtkPolyData:
+    """Extract an isosurface in z slabs, in parallel worker processes.
+
+    Args:
+        vol: VTK image data volume, with one component
+        isovalue: Threshold value for the isosurface, or the label value
+            for a label extractor
+        extractor: Isosurface filter, see vtkutils.extractSurface
+        workers: Number of worker processes.  None or 0 uses all the CPUs.
+        depth: Cells per slab.  None makes SLABS_PER_WORKER slabs per worker.
+
+    Returns:
+        The welded surface mesh
+
+    Raises:
+        ValueError: If the extractor is unknown
+    """
+    vtkutils.isosurfaceFilter(extractor)
+    dims = vol.GetDimensions()
+    scalars = vol.GetPointData().GetScalars()
+    if (
+        extractor in vtkutils.SMOOTH_EXTRACTORS
+        or vol.GetDataDimension() != 3
+        or scalars.GetNumberOfComponents() != 1
+    ):
+        return vtkutils.extractSurface(vol, isovalue, extractor)
+
+    if not workers:
+        workers = os.cpu_count() or 1
+    if depth is None:
+        depth = math.ceil((dims[2] - 1) / (workers * SLABS_PER_WORKER))
+    ranges = slabRanges(dims[2], depth)
+    workers = min(workers, len(ranges))
+
+    t = time.perf_counter()
+    array = numpy_support.vtk_to_numpy(scalars)
+    shape = (dims[2], dims[1], dims[0])
+    dtype = array.dtype
+    matrix = vol.GetDirectionMatrix()
+    direction = [matrix.GetElement(i, j) for i in range(3) for j in range(3)]
+    geometry = (
+        vol.GetOrigin(),
+        vol.GetSpacing(),
+        direction,
+        vol.GetExtent()[0::2],
+    )
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    try:
+        volume = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        volume[...] = array.reshape(shape)
+        del volume, array
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=threads.processContext(),
+            initializer=_initWorker,
+            initargs=(shm.name, shape, dtype.str, geometry),
+        ) as pool:
+            parts = list(
+                pool.map(
+                    _extractSlab,
+                    [(z0, z1, isovalue, extractor) for z0, z1 in ranges],
+                )
+            )
+    finally:
+        shm.close()
+        shm.unlink()
+
+    mesh = mergeParts(parts)
+    print(f"Surface extracted: {extractor}, {len(ranges)} slabs, {workers} worker(s)")
+    print("    ", mesh.GetNumberOfPolys(), "polygons")
+    vtkutils.elapsedTime(t)
+    return mesh
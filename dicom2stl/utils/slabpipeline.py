@@ -0,0 +1,294 @@
+#! /usr/bin/env python
+
+"""
+Slab-wise volume filtering.
+
+Instead of filtering the whole volume at once, which makes a new full-size
+copy for every filter, the volume is streamed through the filters in z
+slabs.  Each slab is read with enough extra slices above and below (the
+halo) that the filters produce the same interior result they would on the
+whole volume, and the interior is pasted into a preallocated SimpleITK
+image, or a memory mapped array, that already includes the padding border.
+
+Slabs are read by a slab reader function, either from an image in memory
+or straight from a lazy volume, in which case the whole input volume is
+never in memory.
+
+The double threshold filter is a reconstruction by dilation: voxels in
+the outer threshold range are kept when they connect to voxels in the
+inner range, through paths of any length, so no halo is exact.  It is
+split into a per voxel classification, which runs on the slabs, and the
+reconstruction, a whole volume stage that runs on the 8 bit class volume
+between two slab passes.  The stages before it and after it then give the
+same results as on the whole volume, except the smoothing engines, which
+scale their edge sensitivity by the average gradient magnitude of their
+input, so on slabs they give slightly different results.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import time
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+import SimpleITK as sitk
+
+from dicom2stl.utils import volumefilters
+from dicom2stl.utils.threads import threadCount
+
+# A pipeline stage: (name, filter function, slices of halo it needs).  A
+# halo of None marks a whole volume stage, which runs between slab passes.
+Stage = Tuple[str, Callable[[sitk.Image], sitk.Image], Optional[int]]
+
+
+def anisotropicStage(engine: str = "curvature") -> Stage:
+    """Edge preserving smoothing with one of volumefilters.SMOOTHING_ENGINES.
+
+    The halo is the reach of the engine, e.g. one slice per iteration of
+    anisotropic diffusion.
+    """
+
+    def smooth(img: sitk.Image) -> sitk.Image:
+        return volumefilters.smoothVolume(img, engine)
+
+    return ("anisotropic", smooth, volumefilters.smoothingHalo(engine))
+
+
+def thresholdStages(thresholds: List[float]) -> List[Stage]:
+    """Double threshold to a 0/255 label volume, as sitk.DoubleThreshold.
+
+    The first stage classifies each voxel as 0 outside the outer range, 1
+    in the outer range only and 2 in both ranges.  The second, whole volume,
+    stage reconstructs the class 2 voxels through the class 1 voxels.
+    """
+
+    def classify(img: sitk.Image) -> sitk.Image:
+        outer = sitk.BinaryThreshold(img, thresholds[0], thresholds[3], 1, 0)
+        inner = sitk.BinaryThreshold(img, thresholds[1], thresholds[2], 1, 0)
+        return outer + (outer & inner)
+
+    def reconstruct(img: sitk.Image) -> sitk.Image:
+        return sitk.DoubleThreshold(img, 1, 2, 2, 2, 255, 0)
+
+    return [("classify", classify, 0), ("threshold", reconstruct, None)]
+
+
+def medianStage(
+    radius: List[int] = [3, 3, 1], engine: str = "auto", binary: bool = False
+) -> Stage:
+    """Median filter with one of volumefilters.MEDIAN_ENGINES.  The halo is
+    the reach of the engine in z."""
+
+    def median(img: sitk.Image) -> sitk.Image:
+        return volumefilters.medianVolume(img, radius, engine, binary)
+
+    return ("median", median, volumefilters.medianHalo(engine, radius))
+
+
+def pipelineStages(
+    anisotropicSmoothing: bool = False,
+    thresholds: Optional[List[float]] = None,
+    medianFilter: bool = False,
+    smoothingEngine: str = "curvature",
+    medianEngine: str = "auto",
+    medianRadius: List[int] = [3, 3, 1],
+) -> List[Stage]:
+    """Get the stages of the volume filter pipeline, in the order
+    volumeProcessingPipeline runs them."""
+    stages = []
+    if anisotropicSmoothing:
+        stages.append(anisotropicStage(smoothingEngine))
+    binary = isinstance(thresholds, list) and len(thresholds) == 4
+    if binary:
+        stages.extend(thresholdStages(thresholds))
+    if medianFilter:
+        stages.append(medianStage(medianRadius, medianEngine, binary))
+    return stages
+
+
+def imageSlabReader(img: sitk.Image) -> Callable[[int, int], sitk.Image]:
+    """Get a slab reader for an image in memory."""
+    return lambda z0, z1: img[:, :, z0:z1]
+
+
+def volumeSlabReader(vol) -> Callable[[int, int], sitk.Image]:
+    """Get a slab reader that decodes slabs from a lazy volume."""
+    return vol.GetSlab
+
+
+def allocateOutput(
+    shape: Tuple[int, ...], dtype: np.dtype, fileName: Optional[str] = None
+) -> np.ndarray:
+    """Allocate the output array, in memory or memory mapped on a file.
+
+    Args:
+        shape: Array shape, (z, y, x)
+        dtype: Array type
+        fileName: File to memory map the array on, or None for memory
+
+    Returns:
+        The uninitialized array
+    """
+    if fileName is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(fileName, mode="w+", dtype=dtype, shape=shape)
+
+
+def runSlabPipeline(
+    readSlab: Callable[[int, int], sitk.Image],
+    depth: int,
+    stages: List[Stage],
+    nslices: int,
+    pad: int = 5,
+    outFile: Optional[str] = None,
+    numThreads: Optional[int] = None,
+) -> Tuple[Union[sitk.Image, np.ndarray], Tuple]:
+    """Stream a volume through filters in z slabs into a padded output.
+
+    The slab reads include the sum of the halos of the stages above and
+    below the slab, clipped to the volume.  A whole volume stage splits the
+    slab stages into passes: the pass before it writes an unpadded image,
+    the stage runs on that image, and the next pass reads its slabs from
+    the result.  The border of the output is filled with the minimum
+    filtered value, as volumeProcessingPipeline pads with.
+
+    Args:
+        readSlab: Function returning the slices z0 to z1 (half open) of the
+            input volume, e.g. from imageSlabReader or volumeSlabReader
+        depth: Output slices per slab
+        stages: Filter stages, e.g. from pipelineStages
+        nslices: Number of slices of the input volume
+        pad: Voxels of padding on each side of the output
+        outFile: .npy file to memory map the output on, or None to keep it
+            in memory
+        numThreads: Number of threads the filters use (0 for one per CPU), or
+            None to keep the current setting, see threads.threadCount
+
+    Returns:
+        Tuple of (output, (origin, spacing, direction) of the output).  The
+        output is a SimpleITK image with that geometry, or, with outFile, a
+        memory mapped array in (z, y, x) order.
+    """
+    t = time.perf_counter()
+    depth = max(1, min(depth, nslices))
+    passes: List[List[Stage]] = [[]]
+    wholeStages = []
+    for stage in stages:
+        if stage[2] is None:
+            wholeStages.append(stage)
+            passes.append([])
+        else:
+            passes[-1].append(stage)
+
+    with threadCount(numThreads):
+        for slabStages, (name, func, _) in zip(passes, wholeStages):
+            img, _ = _slabPass(readSlab, depth, slabStages, nslices, 0, None)
+            print(f"Whole volume stage: {name}")
+            img = func(img)
+            readSlab = imageSlabReader(img)
+        out, geometry = _slabPass(readSlab, depth, passes[-1], nslices, pad, outFile)
+
+    halo = max(sum(stage[2] for stage in p) for p in passes)
+    nslabs = (nslices + depth - 1) // depth
+    dt = time.perf_counter() - t
+    print(f"Filtered {nslabs} slabs of {depth} slices, halo {halo}")
+    print(f"    {dt:4.3f} seconds")
+    return out, geometry
+
+
+def _slabPass(
+    readSlab: Callable[[int, int], sitk.Image],
+    depth: int,
+    stages: List[Stage],
+    nslices: int,
+    pad: int,
+    outFile: Optional[str],
+) -> Tuple[Union[sitk.Image, np.ndarray], Tuple]:
+    """Run slab stages over the whole volume, see runSlabPipeline."""
+    halo = sum(stage[2] for stage in stages)
+    out = None
+    minVal = None
+    geometry = None
+
+    for z0 in range(0, nslices, depth):
+        z1 = min(z0 + depth, nslices)
+        r0, r1 = max(0, z0 - halo), min(nslices, z1 + halo)
+        slab = readSlab(r0, r1)
+        for _, func, _ in stages:
+            slab = func(slab)
+        slab = slab[:, :, z0 - r0 : z1 - r0]
+        array = sitk.GetArrayViewFromImage(slab)
+        ny, nx = array.shape[1:]
+
+        if out is None:
+            geometry = _paddedGeometry(slab, pad)
+            if outFile is None:
+                # pasted into in place, so the output is never copied
+                out = sitk.Image(
+                    [nx + 2 * pad, ny + 2 * pad, nslices + 2 * pad],
+                    slab.GetPixelID(),
+                )
+                out.SetOrigin(geometry[0])
+                out.SetSpacing(geometry[1])
+                out.SetDirection(geometry[2])
+            else:
+                shape = (nslices + 2 * pad, ny + 2 * pad, nx + 2 * pad)
+                out = allocateOutput(shape, array.dtype, outFile)
+
+        if isinstance(out, sitk.Image):
+            out[pad : pad + nx, pad : pad + ny, pad + z0 : pad + z1] = slab
+        else:
+            out[pad + z0 : pad + z1, pad : pad + ny, pad : pad + nx] = array
+        slabMin = array.min()
+        minVal = slabMin if minVal is None else min(minVal, slabMin)
+        del array, slab
+
+    if pad > 0:
+        _fillBorder(out, pad, minVal.item())
+    return out, geometry
+
+
+def _fillBorder(out: Union[sitk.Image, np.ndarray], pad: int, value) -> None:
+    """Fill the padding border of the output with a value."""
+    if isinstance(out, sitk.Image):
+        nx, ny, nz = out.GetSize()
+        out[:pad, :, :] = value
+        out[nx - pad :, :, :] = value
+        out[:, :pad, :] = value
+        out[:, ny - pad :, :] = value
+        out[:, :, :pad] = value
+        out[:, :, nz - pad :] = value
+        return
+    out[:pad] = value
+    out[out.shape[0] - pad :] = value
+    out[:, :pad] = value
+    out[:, out.shape[1] - pad :] = value
+    out[:, :, :pad] = value
+    out[:, :, out.shape[2] - pad :] = value
+
+
+def _paddedGeometry(slab: sitk.Image, pad: int) -> Tuple:
+    """Get the geometry of the padded output from the first slab."""
+    spacing = np.array(slab.GetSpacing())
+    d = np.reshape(slab.GetDirection(), (3, 3))
+    origin = np.array(slab.GetOrigin()) - d @ (pad * spacing)
+    return tuple(origin), slab.GetSpacing(), slab.GetDirection()
+
+
+def slabsToImage(out: Union[sitk.Image, np.ndarray], geometry: Tuple) -> sitk.Image:
+    """Make a SimpleITK image of the output of runSlabPipeline.
+
+    An image output is returned as it is.  A memory mapped output is read
+    into a new image.
+    """
+    if isinstance(out, sitk.Image):
+        return out
+    origin, spacing, direction = geometry
+    img = sitk.GetImageFromArray(out)
+    img.SetOrigin(origin)
+    img.SetSpacing(spacing)
+    img.SetDirection(direction)
+    return img
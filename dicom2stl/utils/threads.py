@@ -0,0 +1,132 @@
+#! /usr/bin/env python
+
+"""
+Thread count control for SimpleITK and VTK.
+
+By default ITK and VTK each size their thread pools from the number of
+cores the machine reports, which oversubscribes a node that runs several
+dicom2stl jobs at once.  setNumberOfThreads sets ITK's global default
+thread count and VTK's SMP tools and multi-threader limits to the same
+value.  threadCount does the same for a block of code and then restores
+the previous settings, for the per-call threads parameter of the
+pipeline functions.
+
+The worker process pools are started with processContext, not by forking
+the parent after its ITK and VTK thread pools are running.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import contextlib
+import multiprocessing
+import os
+from typing import Dict, Iterator, Optional
+
+import SimpleITK as sitk
+from vtkmodules.vtkCommonCore import vtkMultiThreader, vtkSMPTools
+
+
+def setNumberOfThreads(threads: Optional[int]) -> Optional[int]:
+    """Set the number of threads SimpleITK and VTK filters use.
+
+    If VTK's SMP backend is the sequential one and more than one thread is
+    asked for, the STDThread backend is selected, so VTK honours the count.
+
+    Args:
+        threads: Number of threads, 0 for one per CPU, or None to keep the
+            libraries' defaults
+
+    Returns:
+        The number of threads set, or None if the defaults were kept
+
+    Raises:
+        ValueError: If threads is negative
+    """
+    if threads is None:
+        return None
+    if threads < 0:
+        raise ValueError(f"Bad thread count: {threads}")
+    if threads == 0:
+        threads = os.cpu_count() or 1
+
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(threads)
+
+    if threads > 1 and vtkSMPTools.GetBackend() == "Sequential":
+        vtkSMPTools.SetBackend("STDThread")
+    vtkSMPTools.Initialize(threads)
+    vtkMultiThreader.SetGlobalMaximumNumberOfThreads(threads)
+    vtkMultiThreader.SetGlobalDefaultNumberOfThreads(threads)
+
+    print("Threads:", threads)
+    return threads
+
+
+def getNumberOfThreads() -> Dict[str, object]:
+    """Get the thread settings of SimpleITK and VTK.
+
+    Returns:
+        Dictionary with the ITK global default thread count, the VTK SMP
+        backend and its estimated thread count, and the VTK multi-threader
+        maximum (0 for no limit)
+    """
+    return {
+        "itk": sitk.ProcessObject.GetGlobalDefaultNumberOfThreads(),
+        "vtkBackend": vtkSMPTools.GetBackend(),
+        "vtkSMP": vtkSMPTools.GetEstimatedNumberOfThreads(),
+        "vtkMultiThreader": vtkMultiThreader.GetGlobalMaximumNumberOfThreads(),
+    }
+
+
+@contextlib.contextmanager
+def threadCount(threads: Optional[int]) -> Iterator[Optional[int]]:
+    """Set the number of threads for a block of code, see setNumberOfThreads.
+
+    The previous SimpleITK and VTK thread settings are restored when the
+    block exits.
+
+    Args:
+        threads: Number of threads, 0 for one per CPU, or None to keep the
+            current settings
+
+    Yields:
+        The number of threads set, or None if the settings were kept
+
+    Raises:
+        ValueError: If threads is negative
+    """
+    if threads is None:
+        yield None
+        return
+
+    itk = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+    backend = vtkSMPTools.GetBackend()
+    smp = vtkSMPTools.GetEstimatedNumberOfThreads()
+    maximum = vtkMultiThreader.GetGlobalMaximumNumberOfThreads()
+    default = vtkMultiThreader.GetGlobalDefaultNumberOfThreads()
+    try:
+        yield setNumberOfThreads(threads)
+    finally:
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(itk)
+        vtkSMPTools.SetBackend(backend)
+        vtkSMPTools.Initialize(smp)
+        vtkMultiThreader.SetGlobalMaximumNumberOfThreads(maximum)
+        vtkMultiThreader.SetGlobalDefaultNumberOfThreads(default)
+
+
+def processContext() -> multiprocessing.context.BaseContext:
+    """Get the multiprocessing context for worker process pools.
+
+    A forked child inherits the ITK and VTK thread pools' locks in whatever
+    state the parent's threads left them, and can deadlock.  The forkserver
+    context forks workers from a clean server process instead, and spawn
+    is used where forkserver is not available.
+
+    Returns:
+        The forkserver context, or the spawn context
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
@@ -0,0 +1,173 @@
+#! /usr/bin/env python
+
+"""
+On-disk cache of decoded volumes.
+
+After a series is decoded the first time, its pixel buffer is saved as a raw
+numpy .npy file next to a JSON sidecar holding the geometry and modality.
+The sidecar also keeps the volume's intensity statistics (see
+volumestats), so a cached volume needs no pass over its voxels.
+The files are named by a key made from the series UID and the stat of every
+input file, so any change to the inputs gives a new key.  Later runs read
+the .npy file instead of decoding the Dicom files again.  A cache hit is a
+plain read of the file into an array, which is then copied into a new
+SimpleITK image, so it briefly needs twice the volume's memory.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import SimpleITK as sitk
+
+
+def cacheKey(file_paths: List[str], seriesUID: str = "", region: str = "") -> str:
+    """Compute the cache key of a volume.
+
+    Args:
+        file_paths: The input files of the volume (Dicom slices, a zip file
+            or a volume image file)
+        seriesUID: Series Instance UID of the volume, if it is a Dicom series
+        region: Description of the region loaded, if not the whole volume
+
+    Returns:
+        Hex digest identifying the series, the region and the current state
+        of its files
+    """
+    h = hashlib.sha1(seriesUID.encode())
+    h.update(region.encode())
+    for f in sorted(file_paths):
+        st = os.stat(f)
+        h.update(os.path.abspath(f).encode())
+        h.update(f"{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def _cachePaths(cacheDir: str, key: str) -> Tuple[str, str]:
+    """Get the .npy and .json file names for a cache key."""
+    base = os.path.join(cacheDir, key)
+    return base + ".npy", base + ".json"
+
+
+def loadCachedVolume(cacheDir: str, key: str) -> Optional[Tuple[sitk.Image, str]]:
+    """Load a volume from the cache.
+
+    The .npy file is read into an array, then copied into a new image.
+
+    Args:
+        cacheDir: Volume cache directory
+        key: Cache key from cacheKey
+
+    Returns:
+        Tuple of (SimpleITK image, modality string), or None if the volume
+        is not in the cache
+    """
+    npy_name, json_name = _cachePaths(cacheDir, key)
+    if not (os.path.exists(npy_name) and os.path.exists(json_name)):
+        return None
+
+    try:
+        with open(json_name, "r") as fp:
+            meta = json.load(fp)
+        array = np.load(npy_name)
+    except (OSError, ValueError) as e:
+        print("Volume cache read failed:", e)
+        return None
+
+    print("Loading cached volume", npy_name)
+    img = sitk.GetImageFromArray(array, isVector=meta["components"] > 1)
+    img.SetOrigin(meta["origin"])
+    img.SetSpacing(meta["spacing"])
+    img.SetDirection(meta["direction"])
+    del array
+    return img, meta["modality"]
+
+
+def storeCachedVolume(
+    cacheDir: str, key: str, img: sitk.Image, modality: str, seriesUID: str = ""
+) -> None:
+    """Save a decoded volume in the cache.
+
+    The .npy file is written first and both files are moved into place
+    atomically, so a volume is never loaded half written.
+
+    Args:
+        cacheDir: Volume cache directory
+        key: Cache key from cacheKey
+        img: The decoded volume
+        modality: Imaging modality of the volume
+        seriesUID: Series Instance UID of the volume, for reference
+    """
+    os.makedirs(cacheDir, exist_ok=True)
+    npy_name, json_name = _cachePaths(cacheDir, key)
+    meta = {
+        "series": seriesUID,
+        "size": list(img.GetSize()),
+        "origin": list(img.GetOrigin()),
+        "spacing": list(img.GetSpacing()),
+        "direction": list(img.GetDirection()),
+        "components": img.GetNumberOfComponentsPerPixel(),
+        "pixel_type": img.GetPixelIDTypeAsString(),
+        "modality": modality,
+    }
+
+    try:
+        tmp_npy = npy_name + ".tmp"
+        with open(tmp_npy, "wb") as fp:
+            np.save(fp, sitk.GetArrayViewFromImage(img))
+        os.replace(tmp_npy, npy_name)
+
+        tmp_json = json_name + ".tmp"
+        with open(tmp_json, "w") as fp:
+            json.dump(meta, fp, indent=1)
+        os.replace(tmp_json, json_name)
+        print("Cached volume", npy_name)
+    except OSError as e:
+        print("Volume cache write failed:", e)
+
+
+def loadCachedStats(cacheDir: str, key: str) -> Optional[Dict]:
+    """Load the intensity statistics of a cached volume.
+
+    Args:
+        cacheDir: Volume cache directory
+        key: Cache key from cacheKey
+
+    Returns:
+        The statistics from volumestats.computeStats, or None if there are
+        none in the sidecar
+    """
+    _, json_name = _cachePaths(cacheDir, key)
+    try:
+        with open(json_name, "r") as fp:
+            return json.load(fp).get("stats")
+    except (OSError, ValueError):
+        return None
+
+
+def storeCachedStats(cacheDir: str, key: str, stats: Dict) -> None:
+    """Add the intensity statistics of a cached volume to its sidecar.
+
+    Args:
+        cacheDir: Volume cache directory
+        key: Cache key from cacheKey
+        stats: The statistics from volumestats.computeStats
+    """
+    _, json_name = _cachePaths(cacheDir, key)
+    try:
+        with open(json_name, "r") as fp:
+            meta = json.load(fp)
+        meta["stats"] = stats
+        tmp_json = json_name + ".tmp"
+        with open(tmp_json, "w") as fp:
+            json.dump(meta, fp, indent=1)
+        os.replace(tmp_json, json_name)
+    except (OSError, ValueError) as e:
+        print("Volume cache write failed:", e)
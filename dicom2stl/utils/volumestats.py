@@ -0,0 +1,269 @@
+#! /usr/bin/env python
+
+"""
+Single pass intensity statistics of a volume.
+
+One pass over the voxels builds an exact histogram, from which the minimum,
+maximum, mean, percentiles and Otsu and multi-Otsu thresholds are derived.
+The pipeline takes its pad value, its isovalue suggestions and its tissue
+threshold sanity checks from these statistics instead of making more full
+volume passes, and the statistics are kept in the volume cache sidecar so
+a cached volume needs no pass at all.
+
+Integer volumes of 16 bits or less are histogrammed exactly, one bin per
+value, a slice at a time so the temporary memory is one slice.  Other
+volumes need a minimum and maximum pass first, then get a 4096 bin
+histogram.  The statistics keep a 256 bin summary of the histogram for
+later range queries.
+
+Written by David T. Chen from the National Institute of Allergy
+and Infectious Diseases, dchen@mail.nih.gov.
+It is covered by the Apache License, Version 2.0:
+http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import SimpleITK as sitk
+
+PERCENTILES = [0.5, 1, 5, 25, 50, 75, 95, 99, 99.5]
+
+# Bins of the histogram of volumes that are not 16 bit integers
+FLOAT_BINS = 4096
+
+# Bins of the histogram summary kept with the statistics
+SUMMARY_BINS = 256
+
+
+def _histogram(array: np.ndarray) -> Tuple[np.ndarray, float, float, bool]:
+    """Histogram a voxel array.
+
+    Returns:
+        Tuple of (counts, value of the first bin's lower edge, bin width,
+        whether there is one bin per integer value)
+    """
+    if array.dtype.kind in "iu" and array.dtype.itemsize <= 2:
+        # one bin per value of the type, a slice at a time
+        lowest = int(np.iinfo(array.dtype).min)
+        nbins = 2 ** (8 * array.dtype.itemsize)
+        counts = np.zeros(nbins, dtype=np.int64)
+        for plane in array:
+            values = plane.ravel().astype(np.int32)
+            if lowest:
+                values -= lowest
+            counts += np.bincount(values, minlength=nbins)
+        # integer values sit in the middle of their bins
+        return counts, lowest - 0.5, 1.0, True
+
+    lo, hi = float(np.min(array)), float(np.max(array))
+    if hi <= lo:
+        hi = lo + 1.0
+    counts = np.zeros(FLOAT_BINS, dtype=np.int64)
+    for plane in array:
+        counts += np.histogram(plane, bins=FLOAT_BINS, range=(lo, hi))[0]
+    return counts, lo, (hi - lo) / FLOAT_BINS, False
+
+
+def _otsu(counts: np.ndarray, centers: np.ndarray) -> float:
+    """Otsu threshold of a histogram: the upper edge of the lower class."""
+    w0 = np.cumsum(counts, dtype=np.float64)
+    m0 = np.cumsum(counts * centers, dtype=np.float64)
+    total, mtotal = w0[-1], m0[-1]
+    w1 = total - w0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (m0 * total - mtotal * w0) ** 2 / (w0 * w1)
+    between[~np.isfinite(between)] = -1.0
+    i = int(np.argmax(between))
+    return float(centers[i])
+
+
+def _multiOtsu(counts: np.ndarray, centers: np.ndarray) -> List[float]:
+    """Two thresholds that split a histogram into 3 classes maximizing the
+    between class variance."""
+    w = np.concatenate([[0.0], np.cumsum(counts, dtype=np.float64)])
+    m = np.concatenate([[0.0], np.cumsum(counts * centers, dtype=np.float64)])
+    n = len(counts)
+
+    def classTerm(a, b):
+        # sum of class mean squared times weight, for bins a..b-1
+        wc = w[b] - w[a]
+        mc = m[b] - m[a]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(wc > 0, mc * mc / wc, 0.0)
+
+    i = np.arange(1, n - 1)[:, None]
+    j = np.arange(2, n)[None, :]
+    score = classTerm(0, i) + classTerm(i, j) + classTerm(j, n)
+    score = np.where(j > i, score, -1.0)
+    a, b = np.unravel_index(int(np.argmax(score)), score.shape)
+    return [float(centers[a]), float(centers[b + 1])]
+
+
+def _summary(counts: np.ndarray, first: float, width: float):
+    """Rebin the occupied part of a histogram to SUMMARY_BINS bins."""
+    occupied = np.nonzero(counts)[0]
+    lo, hi = occupied[0], occupied[-1] + 1
+    counts = counts[lo:hi]
+    group = max(1, -(-len(counts) // SUMMARY_BINS))
+    pad = (-len(counts)) % group
+    counts = np.concatenate([counts, np.zeros(pad, dtype=counts.dtype)])
+    coarse = counts.reshape(-1, group).sum(axis=1)
+    return coarse, first + lo * width, width * group
+
+
+def computeStats(img: sitk.Image) -> Dict:
+    """Compute the intensity statistics of a volume in a single pass.
+
+    Args:
+        img: The volume
+
+    Returns:
+        Dictionary with the "min", "max", "mean", voxel "count",
+        "percentiles" (a dictionary keyed by percent), the "otsu" threshold,
+        the two "multiOtsu" thresholds and the "histogram" summary (bin
+        "counts", lower edge "start" and bin "width")
+    """
+    array = sitk.GetArrayViewFromImage(img)
+    counts, first, width, exactValues = _histogram(array)
+    del array
+
+    occupied = np.nonzero(counts)[0]
+    total = int(counts.sum())
+    centers = first + (np.arange(len(counts)) + 0.5) * width
+    lo, hi = occupied[0], occupied[-1]
+
+    cumulative = np.cumsum(counts)
+    percentiles = {}
+    for p in PERCENTILES:
+        i = int(np.searchsorted(cumulative, p / 100.0 * total))
+        percentiles[str(p)] = float(centers[min(i, len(centers) - 1)])
+
+    # the thresholds only need the occupied range, in at most 4096 bins
+    coarse, start, step = counts[lo : hi + 1], centers[lo] - 0.5 * width, width
+    if len(coarse) > FLOAT_BINS:
+        group = -(-len(coarse) // FLOAT_BINS)
+        pad = (-len(coarse)) % group
+        coarse = np.concatenate([coarse, np.zeros(pad, dtype=coarse.dtype)])
+        coarse = coarse.reshape(-1, group).sum(axis=1)
+        step = width * group
+    coarseCenters = start + (np.arange(len(coarse)) + 0.5) * step
+    summary, sstart, swidth = _summary(counts, first, width)
+    summaryCenters = sstart + (np.arange(len(summary)) + 0.5) * swidth
+
+    stats = {
+        "min": float(centers[lo]) if exactValues else float(first + lo * width),
+        "max": float(centers[hi]) if exactValues else float(first + (hi + 1) * width),
+        "mean": float(np.dot(counts[lo : hi + 1], centers[lo : hi + 1]) / total),
+        "count": total,
+        "percentiles": percentiles,
+        "otsu": _otsu(coarse, coarseCenters),
+        "multiOtsu": (
+            _multiOtsu(summary, summaryCenters) if len(summary) >= 3 else []
+        ),
+        "histogram": {
+            "counts": summary.tolist(),
+            "start": float(sstart),
+            "width": float(swidth),
+        },
+    }
+    return stats
+
+
+def percentile(stats: Dict, p: float) -> float:
+    """Get a percentile of the intensities from the statistics summary."""
+    if str(p) in stats["percentiles"]:
+        return stats["percentiles"][str(p)]
+    hist = stats["histogram"]
+    cumulative = np.cumsum(hist["counts"])
+    i = int(np.searchsorted(cumulative, p / 100.0 * cumulative[-1]))
+    return hist["start"] + (i + 0.5) * hist["width"]
+
+
+def fractionInRange(stats: Dict, lower: float, upper: float) -> float:
+    """Estimate the fraction of voxels with intensities in [lower, upper]
+    from the statistics' histogram summary."""
+    hist = stats["histogram"]
+    counts = np.asarray(hist["counts"], dtype=np.float64)
+    edges = hist["start"] + np.arange(len(counts) + 1) * hist["width"]
+    # the part of each bin inside the range, assuming uniform bins
+    overlap = np.clip(
+        (np.minimum(edges[1:], upper) - np.maximum(edges[:-1], lower))
+        / hist["width"],
+        0.0,
+        1.0,
+    )
+    return float(np.dot(counts, overlap) / counts.sum())
+
+
+def suggestIsovalue(stats: Dict, method: str = "otsu") -> float:
+    """Suggest an isovalue.
+
+    Args:
+        stats: Statistics from computeStats
+        method: "otsu" for the Otsu threshold, which separates foreground
+            from background, or "multiotsu" for the upper of the two
+            multi-Otsu thresholds, which separates the densest class
+
+    Returns:
+        The isovalue
+    """
+    if method == "otsu":
+        return stats["otsu"]
+    if method == "multiotsu":
+        if not stats["multiOtsu"]:
+            return stats["otsu"]
+        return stats["multiOtsu"][-1]
+    raise ValueError(f"Unknown isovalue method {method}")
+
+
+def checkThresholds(stats: Dict, thresholds: List[float]) -> List[str]:
+    """Check that double threshold values make sense for a volume.
+
+    Args:
+        stats: Statistics from computeStats
+        thresholds: The 4 double threshold values
+
+    Returns:
+        List of warning messages, empty if the thresholds look fine
+    """
+    warnings = []
+    if stats["max"] < thresholds[1] or stats["min"] > thresholds[2]:
+        warnings.append(
+            f"the intensity range [{stats['min']:g}, {stats['max']:g}] misses the "
+            f"inner threshold range [{thresholds[1]:g}, {thresholds[2]:g}].  "
+            "Is the volume a CT scan in Hounsfield units?"
+        )
+    elif fractionInRange(stats, thresholds[1], thresholds[2]) < 1e-5:
+        warnings.append(
+            f"almost no voxels are in the inner threshold range "
+            f"[{thresholds[1]:g}, {thresholds[2]:g}], the mesh may be empty"
+        )
+    return warnings
+
+
+def printStats(stats: Dict) -> None:
+    """Print the statistics and the isovalue suggestions."""
+    p = stats["percentiles"]
+    print(
+        f"Intensity range [{stats['min']:g}, {stats['max']:g}], "
+        f"mean {stats['mean']:.1f}, median {p['50']:g}, "
+        f"1-99% [{p['1']:g}, {p['99']:g}]"
+    )
+    print(
+        f"Suggested isovalues: otsu {stats['otsu']:g}, multi-otsu "
+        + ", ".join(f"{t:g}" for t in stats["multiOtsu"])
+    )
+
+
+def padValue(stats: Optional[Dict], img: sitk.Image) -> float:
+    """Get the value to pad a volume with, its minimum.
+
+    Uses the statistics if there are any, and only makes a pass over the
+    volume if there are none.
+    """
+    if stats is not None:
+        return stats["min"]
+    filt = sitk.MinimumMaximumImageFilter()
+    filt.Execute(img)
+    return filt.GetMinimum()
@@ -1,36 +1,119 @@
 #!/usr/bin/env python
 
-""" function for converting a VTK image to a SimpleITK image """
+""" function for converting a VTK image to a SimpleITK image
 
+A VTK image made by sitk2vtk wraps the buffer of a SimpleITK image, so
+converting it back returns a shallow copy of that SimpleITK image, sharing
+the buffer, as long as the geometry is unchanged.  Any other VTK image is
+copied once, straight from its scalar buffer, either into a new SimpleITK
+image or into the buffer of an existing image of the same size and pixel
+type, so VTK and ITK filters can alternate without allocating a new volume
+each time.
+
+SimpleITK has no public call that copies an array into an existing image,
+so the reused buffer relies on the private _SetImageFromArray that
+sitk.GetImageFromArray uses.  It is only used with the SimpleITK major
+version it is tested with; other versions copy into a new image.
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
 import SimpleITK as sitk
 import vtk
 from vtk.util import numpy_support
 
+# SimpleITK major version the private _SetImageFromArray is tested with
+SET_IMAGE_MAJOR_VERSION = 2
+
+if sitk.Version.MajorVersion() == SET_IMAGE_MAJOR_VERSION:
+    # the copy into an existing image's buffer that GetImageFromArray uses
+    from SimpleITK.SimpleITK import _SetImageFromArray
+else:
+    _SetImageFromArray = None
+
+
+def _geometry(vtk_image: vtk.vtkImageData, ndim: int) -> Tuple:
+    """Get the SimpleITK origin, spacing and direction of a VTK image."""
+    direction = None
+    if vtk.vtkVersion.GetVTKMajorVersion() >= 9:
+        matrix = vtk_image.GetDirectionMatrix()
+        direction = tuple(
+            matrix.GetElement(y, x) for y in range(ndim) for x in range(ndim)
+        )
+    return (
+        tuple(vtk_image.GetOrigin()[:ndim]),
+        tuple(vtk_image.GetSpacing()[:ndim]),
+        direction,
+    )
+
+
+def _sharedImage(vtk_image: vtk.vtkImageData) -> Optional[sitk.Image]:
+    """Get a shallow copy of the SimpleITK image whose buffer a VTK image's
+    scalars wrap, if it also has the VTK image's geometry.
+
+    The image sitk2vtk keeps with the scalars is never written to or
+    viewed, since either would give it a buffer of its own, so the buffer
+    is checked by its size only."""
+    scalars = vtk_image.GetPointData().GetScalars()
+    img = getattr(scalars, "_sitk_image", None)
+    if img is None:
+        return None
+    count = scalars.GetNumberOfTuples() * scalars.GetNumberOfComponents()
+    if img.GetNumberOfPixels() * img.GetNumberOfComponentsPerPixel() != count:
+        return None
+
+    # e.g. after vtkImageChangeInformation the pixels are shared but the
+    # geometry is not, and the shared image must not be changed
+    dims = list(vtk_image.GetDimensions())[: img.GetDimension()]
+    origin, spacing, direction = _geometry(vtk_image, img.GetDimension())
+    if (
+        list(img.GetSize()) != dims
+        or not np.allclose(img.GetOrigin(), origin)
+        or not np.allclose(img.GetSpacing(), spacing)
+        or (direction is not None and not np.allclose(img.GetDirection(), direction))
+    ):
+        return None
+    return sitk.Image(img)
+
+
+def vtk2sitk(
+    vtk_image: vtk.vtkImageData,
+    debug: bool = False,
+    out: Optional[sitk.Image] = None,
+) -> sitk.Image:
+    """Convert a VTK image to a SimpleITK image, with at most one copy.
 
-def vtk2sitk(vtk_image: vtk.vtkImageData, debug: bool = False) -> sitk.Image:
-    """Convert a VTK image to a SimpleITK image, via numpy.
-    
     This function performs the reverse conversion of sitk2vtk, handling coordinate
     system differences:
     - VTK uses XYZ ordering for dimensions, spacing, and extent
-    - Numpy arrays are created in C-order from flattened VTK data
+    - Numpy arrays are views, in C-order, of the flattened VTK data
     - Dimensions are reversed to match SimpleITK/ITK conventions (ZYX → XYZ)
     - SimpleITK uses ITK conventions with physical space coordinates
-    
+
     The function also:
     - Extracts scalar data from VTK point data
+    - Makes a vector image if the scalars have several components
     - Preserves image origin, spacing, and direction matrix (VTK 9+)
-    - Reshapes numpy array to match reversed dimensions
-    
+
+    If the VTK image wraps the buffer of a SimpleITK image, as the images
+    made by sitk2vtk do, and has its geometry, a shallow copy of that
+    SimpleITK image is returned and shares the pixels with the VTK image
+    until it is written to.  Otherwise the
+    pixels are copied once, into out if it has the right size, pixel type
+    and components, else into a new image.  A 2-d VTK image gives a 3-d
+    image one slice thick, unless it came from a 2-d SimpleITK image.
+
     Args:
         vtk_image: VTK image data object to convert
         debug: If True, print debug information about the conversion
-        
+        out: Image whose buffer is reused for the pixels, if it matches
+
     Returns:
         SimpleITK image with the same voxel data and metadata
     """
     scalars = vtk_image.GetPointData().GetScalars()
-    numpy_array = numpy_support.vtk_to_numpy(scalars)
+    ncomp = scalars.GetNumberOfComponents()
 
     dims = list(vtk_image.GetDimensions())
     origin = vtk_image.GetOrigin()
@@ -40,21 +123,43 @@ def vtk2sitk(vtk_image: vtk.vtkImageData, debug: bool = False) -> sitk.Image:
         print("dims:", dims)
         print("origin:", origin)
         print("spacing:", spacing)
-        print("numpy type:", numpy_array.dtype)
-        print("numpy shape:", numpy_array.shape)
+        print("components:", ncomp)
+
+    sitk_image = _sharedImage(vtk_image)
+    if sitk_image is not None:
+        if debug:
+            print("sharing the buffer of a SimpleITK image")
+        return sitk_image
 
+    # a view of the VTK buffer, so the only copy is into the ITK image
+    numpy_array = numpy_support.vtk_to_numpy(scalars)
     dims.reverse()
-    numpy_array.shape = tuple(dims)
+    if ncomp > 1:
+        dims.append(ncomp)
+    numpy_array = numpy_array.reshape(dims)
     if debug:
+        print("numpy type:", numpy_array.dtype)
         print("new shape:", numpy_array.shape)
-    sitk_image = sitk.GetImageFromArray(numpy_array)
+
+    if (
+        _SetImageFromArray is not None
+        and out is not None
+        and out.GetDimension() == 3
+        and list(out.GetSize()) == dims[2::-1]
+        and out.GetNumberOfComponentsPerPixel() == ncomp
+        and sitk.GetArrayViewFromImage(out).dtype == numpy_array.dtype
+    ):
+        # MakeUnique, so images sharing the buffer keep their pixels
+        out.MakeUnique()
+        _SetImageFromArray(numpy_array, out)
+        sitk_image = out
+    else:
+        sitk_image = sitk.GetImageFromArray(numpy_array, isVector=ncomp > 1)
+
+    origin, spacing, direction = _geometry(vtk_image, sitk_image.GetDimension())
     sitk_image.SetSpacing(spacing)
     sitk_image.SetOrigin(origin)
-
-    if vtk.vtkVersion.GetVTKMajorVersion() >= 9:
-        direction_matrix = vtk_image.GetDirectionMatrix()
-        direction = [direction_matrix.GetElement(y, x) 
-                    for y in range(3) for x in range(3)]
+    if direction is not None:
         sitk_image.SetDirection(direction)
-    
+
     return sitk_image
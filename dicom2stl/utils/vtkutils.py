@@ -29,23 +29,85 @@ def elapsedTime(start_time: float) -> None:
 #
 #  Isosurface extraction
 #
-def extractSurface(vol: vtk.vtkImageData, isovalue: float = 0.0) -> Optional[vtk.vtkPolyData]:
+EXTRACTORS = {
+    "contour": vtk.vtkContourFilter,
+    "flyingedges": vtk.vtkFlyingEdges3D,
+    "marchingcubes": vtk.vtkMarchingCubes,
+    "synchronized-templates": vtk.vtkSynchronizedTemplates3D,
+}
+
+# Extractors of the boundary of a label in a label volume
+LABEL_EXTRACTORS = {
+    "discrete-flyingedges": vtk.vtkDiscreteFlyingEdges3D,
+    "surfacenets": vtk.vtkSurfaceNets3D,
+}
+
+# Extractors whose output is already smooth, so smoothMesh is not needed
+SMOOTH_EXTRACTORS = ["surfacenets"]
+
+
+def isosurfaceFilter(extractor: str = "flyingedges") -> vtk.vtkPolyDataAlgorithm:
+    """Make the VTK filter of an extractor, see extractSurface.
+
+    Raises:
+        ValueError: If the extractor is unknown
+    """
+    if extractor in LABEL_EXTRACTORS:
+        iso = LABEL_EXTRACTORS[extractor]()
+        if extractor == "surfacenets":
+            iso.SetOutputMeshTypeToTriangles()
+        return iso
+    if extractor in EXTRACTORS:
+        return EXTRACTORS[extractor]()
+    raise ValueError(f"Unknown surface extractor {extractor}")
+
+
+def extractSurface(
+    vol: vtk.vtkImageData, isovalue: float = 0.0, extractor: str = "flyingedges"
+) -> Optional[vtk.vtkPolyData]:
     """Extract an isosurface from a volume using the marching cubes algorithm.
-    
+
+    The extractors give the same surface.  Flying edges is the fastest, and
+    runs in parallel on VTK's SMP threads.  Where the isovalue equals voxel
+    values exactly, it also makes degenerate triangles that the other
+    extractors drop, which cleanMesh removes.
+
+    The LABEL_EXTRACTORS extract the boundary of the voxels whose value is
+    the isovalue, in a label volume.  Discrete flying edges makes the same
+    staircase surface as contouring a binary label volume.  Surface nets
+    makes a smoothed surface, with slightly fewer triangles, that needs no
+    smoothMesh pass.
+
     Args:
         vol: VTK image data volume
-        isovalue: Threshold value for the isosurface
-        
+        isovalue: Threshold value for the isosurface, or the label value
+            for a label extractor
+        extractor: Isosurface filter, one of EXTRACTORS: "contour" (generic
+            vtkContourFilter), "flyingedges", "marchingcubes" or
+            "synchronized-templates", or one of LABEL_EXTRACTORS:
+            "discrete-flyingedges" or "surfacenets"
+
     Returns:
         Surface mesh as vtkPolyData, or None if extraction fails
+
+    Raises:
+        ValueError: If the extractor is unknown
     """
+    iso = isosurfaceFilter(extractor)
+    # flying edges, synchronized templates and the label extractors only
+    # handle 3-d volumes
+    if vol.GetDataDimension() != 3:
+        if extractor in LABEL_EXTRACTORS:
+            isovalue = 0.5 * isovalue
+        extractor = "contour"
+        iso = isosurfaceFilter(extractor)
+
     try:
         t = time.perf_counter()
-        iso = vtk.vtkContourFilter()
         iso.SetInputData(vol)
         iso.SetValue(0, isovalue)
         iso.Update()
-        print("Surface extracted")
+        print("Surface extracted:", extractor)
         mesh = iso.GetOutput()
         print("    ", mesh.GetNumberOfPolys(), "polygons")
         elapsedTime(t)
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+"""Benchmark the Dicom slice decoder backends on each transfer syntax.
+
+Usage: bench_decoders.py [--slices N] [--workers N]
+
+A synthetic series is written uncompressed and with each of the compressors
+in write_series.compressors.  Every series is decoded with each backend by
+seriesreader.readSeries, and the slice rate of each backend is printed.  A
+backend that has no codec for a transfer syntax is reported as unsupported.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import SimpleITK as sitk
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(thisdir))
+
+from tests import create_data  # noqa: E402
+from tests import write_series  # noqa: E402
+from dicom2stl.utils import dicomutils  # noqa: E402
+from dicom2stl.utils import seriesreader  # noqa: E402
+
+
+def bench_series(dirname, workers, reference):
+    files = dicomutils.getAllSeries([dirname])[0][2]
+    headers = dicomutils.readDicomHeaders(files)
+    headers = [headers[f] for f in files]
+    print("Transfer syntax:", headers[0]["TransferSyntaxUID"])
+    print("auto decoder:", seriesreader.chooseDecoder(headers[0]))
+
+    for backend in ["gdcm", "pydicom"]:
+        t = time.perf_counter()
+        try:
+            img = seriesreader.readSeries(files, headers, workers, decoder=backend)
+        except Exception as e:  # noqa: BLE001
+            print(f"  {backend:8s} unsupported: {type(e).__name__}")
+            continue
+        dt = time.perf_counter() - t
+        same = np.array_equal(
+            sitk.GetArrayViewFromImage(img), sitk.GetArrayViewFromImage(reference)
+        )
+        print(
+            f"  {backend:8s} {len(files) / dt:8.1f} slices/s  "
+            f"{dt:7.3f} seconds  lossless: {same}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--slices", "-n", type=int, default=128, help="Synthetic series size"
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=1, help="Decoder processes"
+    )
+    args = parser.parse_args()
+
+    vol = create_data.make_cylinder(args.slices, pixel_type=sitk.sitkInt16)
+    reference = sitk.GetImageFromArray(sitk.GetArrayFromImage(vol))
+
+    for compressor in [None] + write_series.compressors:
+        tmpdir = tempfile.mkdtemp()
+        print("\nCompressor:", compressor or "none")
+        try:
+            write_series.write_series(vol, tmpdir, compressor=compressor)
+            bench_series(tmpdir, args.workers, reference)
+        finally:
+            shutil.rmtree(tmpdir)
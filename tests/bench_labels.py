@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+"""Benchmark the label extractors on the tissue presets.
+
+Usage: bench_labels.py [--input volume] [--types bone,skin,soft,fat]
+
+For each tissue preset, the input is double thresholded as by --type, and
+the label volume is meshed three ways: flying edges at isovalue 64 followed
+by the 25 iteration smoothMesh pass (the default), discrete flying edges
+followed by smoothMesh, and surface nets without smoothMesh.  The runtime of
+the extraction and of extraction plus mesh processing, the triangles
+extracted and written, and the mean distance (in mm) of each mesh from the
+default mesh are printed.  The default input is examples/Data/ct_example.nii.gz.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(thisdir))
+
+import SimpleITK as sitk  # noqa: E402
+
+from tests.bench_smoothing import deviation  # noqa: E402
+from dicom2stl.utils import vtkutils  # noqa: E402
+from dicom2stl.utils.sitk2vtk import sitk2vtk  # noqa: E402
+from dicom2stl.Dicom2STL import (  # noqa: E402
+    getTissueThresholds,
+    meshProcessingPipeline,
+    volumeProcessingPipeline,
+)
+
+# extractor, isovalue of the 0/255 label volume, mesh smoothing iterations
+METHODS = [
+    ("flyingedges", 64.0, 25),
+    ("discrete-flyingedges", 255.0, 25),
+    ("surfacenets", 255.0, 0),
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--input",
+        "-i",
+        default=os.path.join(
+            os.path.dirname(thisdir), "examples", "Data", "ct_example.nii.gz"
+        ),
+        help="Input CT volume",
+    )
+    parser.add_argument("--types", "-t", default="bone,skin,soft,fat")
+    args = parser.parse_args()
+
+    vol = sitk.ReadImage(args.input)
+    print("Volume", vol.GetSize(), vol.GetPixelIDTypeAsString())
+
+    print(f"{'type':5s} {'extractor':21s} {'extract':>8s} {'total':>8s}"
+          f" {'extracted':>10s} {'written':>8s} {'mean mm':>8s}")
+    for tissue in args.types.split(","):
+        with contextlib.redirect_stdout(io.StringIO()):
+            thresholds, median = getTissueThresholds(tissue)
+            labels = volumeProcessingPipeline(vol, True, False, thresholds, median)
+        vtkimg = sitk2vtk(labels)
+
+        reference = None
+        for extractor, isovalue, smoothN in METHODS:
+            with contextlib.redirect_stdout(io.StringIO()):
+                t = time.perf_counter()
+                mesh = vtkutils.extractSurface(vtkimg, isovalue, extractor)
+                extract = time.perf_counter() - t
+                extracted = mesh.GetNumberOfPolys()
+                mesh = meshProcessingPipeline(
+                    mesh, False, 0.05, smoothN, 0.9, ["X", 0.0]
+                )
+                total = time.perf_counter() - t
+            line = (
+                f"{tissue:5s} {extractor:21s} {extract:8.3f} {total:8.3f}"
+                f" {extracted:10d} {mesh.GetNumberOfPolys():8d}"
+            )
+            if reference is None:
+                reference = mesh
+            else:
+                line += f" {deviation(mesh, reference)[0]:8.3f}"
+            print(line)
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+
+"""Benchmark DICOM series discovery: header-only pydicom threads vs GDCM.
+
+Usage: bench_series_discovery.py [dicom_directory ...]
+
+If no directory is given, a synthetic series is written to a temporary
+directory with write_series.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import SimpleITK as sitk
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(thisdir))
+
+from tests import create_data  # noqa: E402
+from tests import write_series  # noqa: E402
+from dicom2stl.utils import dicomutils  # noqa: E402
+
+
+def time_it(label, func, *args, **kwargs):
+    t = time.perf_counter()
+    result = func(*args, **kwargs)
+    dt = time.perf_counter() - t
+    print(f"{label:28s} {dt:8.3f} seconds")
+    return result, dt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dirs", nargs="*", help="DICOM directories")
+    parser.add_argument(
+        "--slices", "-n", type=int, default=256, help="Synthetic series size"
+    )
+    parser.add_argument(
+        "--workers", "-w", type=int, default=None, help="Header reader threads"
+    )
+    args = parser.parse_args()
+
+    tmpdir = None
+    dirs = args.dirs
+    if len(dirs) == 0:
+        tmpdir = tempfile.mkdtemp()
+        print("Writing", args.slices, "slices to", tmpdir)
+        vol = create_data.make_cylinder(args.slices, pixel_type=sitk.sitkUInt16)
+        write_series.write_series(vol, tmpdir)
+        dirs = [tmpdir]
+
+    gdcm_series, gdcm_time = time_it(
+        "GDCM getAllSeriesGDCM", dicomutils.getAllSeriesGDCM, dirs
+    )
+    fast_series, fast_time = time_it(
+        "pydicom getAllSeries", dicomutils.getAllSeries, dirs, args.workers
+    )
+
+    same = len(gdcm_series) == len(fast_series) and all(
+        g[0] == f[0] and list(g[2]) == f[2]
+        for g, f in zip(
+            sorted(gdcm_series, key=lambda x: (x[0], x[1])),
+            sorted(fast_series, key=lambda x: (x[0], x[1])),
+        )
+    )
+    print("Same series and ordering:", same)
+    if fast_time > 0:
+        print(f"Speedup: {gdcm_time / fast_time:.2f}x")
+
+    if tmpdir:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,89 @@
+#! /usr/bin/env python
+
+"""Benchmark the smoothing engines against curvature anisotropic diffusion.
+
+Usage: bench_smoothing.py [--input volume] [--isovalue V] [--dim N]
+
+Each engine in volumefilters.SMOOTHING_ENGINES smooths the same volume and
+an isosurface is extracted from the result.  The runtime of each engine is
+printed, along with the mean and maximum distance (in mm) of its surface
+from the surface of the curvature engine, the current default.  Without an
+input volume, a noisy create_data.make_tetra volume is used.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(thisdir))
+
+import numpy as np  # noqa: E402
+import SimpleITK as sitk  # noqa: E402
+import vtk  # noqa: E402
+from dicom2stl.utils.sitk2vtk import sitk2vtk  # noqa: E402
+from vtk.util import numpy_support  # noqa: E402
+
+from tests import create_data  # noqa: E402
+from dicom2stl.utils import volumefilters  # noqa: E402
+from dicom2stl.utils import vtkutils  # noqa: E402
+
+
+def surface(img, isovalue):
+    """Extract an isosurface of a SimpleITK image."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return vtkutils.extractSurface(sitk2vtk(img), isovalue)
+
+
+def deviation(mesh, reference):
+    """Mean and maximum distance of a mesh's points from a reference mesh."""
+    dist = vtk.vtkDistancePolyDataFilter()
+    dist.SetInputData(0, mesh)
+    dist.SetInputData(1, reference)
+    dist.SignedDistanceOff()
+    dist.ComputeSecondDistanceOff()
+    dist.Update()
+    d = numpy_support.vtk_to_numpy(dist.GetOutput().GetPointData().GetScalars())
+    return float(np.mean(d)), float(np.max(d))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", "-i", help="Input volume (default: make_tetra)")
+    parser.add_argument(
+        "--isovalue", "-v", type=float, default=100.0, help="Surface isovalue"
+    )
+    parser.add_argument("--dim", "-n", type=int, default=128, help="Tetra size")
+    parser.add_argument("--noise", type=float, default=20.0, help="Tetra noise")
+    args = parser.parse_args()
+
+    if args.input:
+        vol = sitk.ReadImage(args.input)
+    else:
+        vol = create_data.make_tetra(args.dim, pixel_type=sitk.sitkFloat32)
+        vol = sitk.AdditiveGaussianNoise(vol, args.noise, seed=1)
+        vol = sitk.Cast(vol, sitk.sitkInt16)
+    print("Volume", vol.GetSize(), vol.GetPixelIDTypeAsString())
+
+    results = {}
+    for engine in volumefilters.SMOOTHING_ENGINES:
+        t = time.perf_counter()
+        smoothed = volumefilters.smoothVolume(vol, engine)
+        dt = time.perf_counter() - t
+        results[engine] = (dt, surface(smoothed, args.isovalue))
+
+    reference = results["curvature"][1]
+    print(f"{'engine':10s} {'seconds':>8s} {'speedup':>8s} {'triangles':>10s}"
+          f" {'mean mm':>8s} {'max mm':>8s}")
+    for engine, (dt, mesh) in results.items():
+        line = (
+            f"{engine:10s} {dt:8.3f} {results['curvature'][0] / dt:7.2f}x"
+            f" {mesh.GetNumberOfPolys():10d}"
+        )
+        if engine != "curvature":
+            mean, worst = deviation(mesh, reference)
+            line += f" {mean:8.3f} {worst:8.3f}"
+        print(line)
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+
+"""Benchmark each dicom2stl pipeline stage at several thread counts.
+
+Usage: bench_threads.py [--dim N] [--threads 1,2,4,8,16]
+
+A tetrahedron volume from create_data.make_tetra is run through the volume
+pipeline (anisotropic smoothing, double threshold, median, pad), converted
+to VTK and run through the mesh pipeline, once per thread count set with
+threads.setNumberOfThreads.  The stage times are taken from the profiler
+and printed as a table, with the speedup over the first thread count.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+thisdir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(thisdir))
+
+import SimpleITK as sitk  # noqa: E402
+from dicom2stl.utils.sitk2vtk import sitk2vtk  # noqa: E402
+
+from tests import create_data  # noqa: E402
+from dicom2stl.utils import profiler  # noqa: E402
+from dicom2stl.utils import threads  # noqa: E402
+from dicom2stl.utils import vtkutils  # noqa: E402
+from dicom2stl.Dicom2STL import (  # noqa: E402
+    meshProcessingPipeline,
+    volumeProcessingPipeline,
+)
+
+
+def run_pipeline(vol):
+    """Run the whole pipeline on a volume, returning the stage times."""
+    profiler.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        img = volumeProcessingPipeline(
+            vol, False, True, [60.0, 100.0, 250.0, 255.0], True
+        )
+        with profiler.stage("sitk2vtk"):
+            vtkimg = sitk2vtk(img)
+        with profiler.stage("contour"):
+            mesh = vtkutils.extractSurface(vtkimg, 64.0)
+        meshProcessingPipeline(mesh, False, 0.05, 25, 0.9, ["X", 0.0])
+    times = {r["name"]: r["wall"] for r in profiler.records()}
+    profiler.stop()
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", "-n", type=int, default=192, help="Volume size")
+    parser.add_argument(
+        "--threads", "-t", default="1,2,4,8,16", help="Thread counts to run"
+    )
+    args = parser.parse_args()
+    counts = [int(x) for x in args.threads.split(",")]
+
+    vol = create_data.make_tetra(args.dim, pixel_type=sitk.sitkUInt8)
+    print(f"Volume {args.dim}^3, {os.cpu_count()} CPUs")
+
+    results = {}
+    for n in counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            threads.setNumberOfThreads(n)
+        results[n] = run_pipeline(vol)
+
+    stages = list(results[counts[0]])
+    print(f"{'stage':12s}" + "".join(f"{n:>9d}T" for n in counts) + "  speedup")
+    for stage in stages + ["total"]:
+        row = []
+        for n in counts:
+            t = results[n]
+            row.append(sum(t.values()) if stage == "total" else t.get(stage, 0.0))
+        speedup = row[0] / row[-1] if row[-1] > 0 else float("nan")
+        print(
+            f"{stage:12s}"
+            + "".join(f"{x:10.3f}" for x in row)
+            + f"  {speedup:6.2f}x"
+        )
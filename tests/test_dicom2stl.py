@@ -1,9 +1,10 @@
+import json
 import unittest
 import os
 
 import SimpleITK as sitk
 from dicom2stl.utils import parseargs
-from dicom2stl.Dicom2STL import Dicom2STL
+from dicom2stl.Dicom2STL import Dicom2STL, volumeProcessingPipeline
 
 from tests import create_data
 
@@ -41,6 +42,94 @@ class TestDicom2STL(unittest.TestCase):
         if not os.path.exists("testout.stl"):
             self.fail("dicom2stl: no output file")
 
+    def test_profile(self):
+        print("\nDicom2stl profile test")
+        parser = parseargs.createParser()
+        args = parser.parse_args(
+            [
+                "-i", "100", "--profile", "profile-test.json", "-o", "testout.stl",
+                "tetra-test.nii.gz",
+            ]
+        )
+        Dicom2STL(args)
+        with open("profile-test.json") as f:
+            profile = json.load(f)
+        os.remove("profile-test.json")
+
+        names = [s["name"] for s in profile["stages"]]
+        for name in ["open", "load", "pad", "sitk2vtk", "contour", "reduce", "write"]:
+            self.assertIn(name, names)
+        stages = {s["name"]: s for s in profile["stages"]}
+        self.assertEqual(stages["load"]["output"], 128**3)
+        self.assertEqual(stages["pad"]["output"], 138**3)
+        self.assertGreater(stages["contour"]["output"], 0)
+        for s in profile["stages"]:
+            for key in ["wall", "cpu", "peakRSSDelta", "threads"]:
+                self.assertIn(key, s)
+        self.assertEqual(profile["options"]["isovalue"], 100.0)
+
+    def test_otsuIsovalue(self):
+        print("\nDicom2stl otsu isovalue test")
+        parser = parseargs.createParser()
+        args = parser.parse_args(
+            ["-i", "otsu", "-o", "testout.stl", "tetra-test.nii.gz"]
+        )
+        self.assertEqual(args.isovalue, "otsu")
+        Dicom2STL(args)
+        # the tetrahedron is 255 on a 0 background
+        self.assertTrue(0.0 < args.isovalue < 255.0)
+        self.assertTrue(os.path.exists("testout.stl"))
+
+    def test_tissues(self):
+        print("\nDicom2stl multiple tissues test")
+        img = sitk.Cast(create_data.make_tetra(), sitk.sitkInt16) * 10 - 1000
+        sitk.WriteImage(img, "tetra-ct.nii.gz")
+        parser = parseargs.createParser()
+        args = parser.parse_args(
+            ["--tissues", "bone,skin", "-o", "tissues.stl", "tetra-ct.nii.gz"]
+        )
+        Dicom2STL(args)
+        os.remove("tetra-ct.nii.gz")
+        # blobs from -1000 HU (air) up to 1080 HU, in the ranges of both tissues
+        for name in ["tissues_bone.stl", "tissues_skin.stl"]:
+            self.assertTrue(os.path.exists(name))
+            self.assertGreater(os.path.getsize(name), 1000)
+            os.remove(name)
+
+    def test_surfaceNets(self):
+        print("\nDicom2stl surface nets test")
+        parser = parseargs.createParser()
+        args = parser.parse_args(
+            [
+                "--double", "50;100;255;255", "--extractor", "surfacenets",
+                "--profile", "profile-nets.json", "-o", "testout.stl",
+                "tetra-test.nii.gz",
+            ]
+        )
+        Dicom2STL(args)
+        with open("profile-nets.json") as f:
+            profile = json.load(f)
+        os.remove("profile-nets.json")
+        names = [s["name"] for s in profile["stages"]]
+        self.assertIn("contour", names)
+        self.assertNotIn("smooth", names)
+        self.assertEqual(args.isovalue, 255.0)
+        self.assertTrue(os.path.exists("testout.stl"))
+
+        # the label extractors need a label volume
+        args = parser.parse_args(
+            ["-i", "100", "--extractor", "surfacenets", "tetra-test.nii.gz"]
+        )
+        with self.assertRaises(SystemExit):
+            Dicom2STL(args)
+
+    def test_volumeProcessingPipelineShrink(self):
+        print("\nShrink in volumeProcessingPipeline test")
+        img = sitk.Image([300, 20, 600], sitk.sitkUInt8)
+        out = volumeProcessingPipeline(img, shrinkFlag=True)
+        # shrunk to (150, 20, 200), then padded by 5 voxels on each side
+        self.assertEqual(out.GetSize(), (160, 30, 210))
+
 
 if __name__ == "__main__":
     unittest.main()
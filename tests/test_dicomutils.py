@@ -5,7 +5,9 @@ import shutil
 import unittest
 import zipfile
 
+import pydicom
 import SimpleITK as sitk
+from pydicom.filebase import DicomFileLike
 from tests import create_data
 from tests import write_series
 from dicom2stl.utils import dicomutils
@@ -36,6 +38,24 @@ class TestDicomUtils(unittest.TestCase):
         print(matches, dirs)
         self.assertEqual(len(matches), TestDicomUtils.SIZE)
 
+    def test_isDicomFile(self):
+        print("\nTesting DicomUtils.isDicomFile")
+        self.assertTrue(dicomutils.isDicomFile(TestDicomUtils.TMPDIR + "/0.dcm"))
+        self.assertFalse(dicomutils.isDicomFile("tests/__init__.py"))
+        self.assertFalse(dicomutils.isDicomFile("no_such_file"))
+
+    def test_scanDirForDicomNoSuffix(self):
+        print("\nTesting DicomUtils.scanDirForDicom without .dcm suffixes")
+        subdir = TestDicomUtils.TMPDIR + "/uids"
+        os.mkdir(subdir)
+        shutil.copy(TestDicomUtils.TMPDIR + "/0.dcm", subdir + "/1.2.840.1234")
+        with open(subdir + "/notes.txt", "w") as fp:
+            fp.write("not a dicom file\n")
+        matches, dirs = dicomutils.scanDirForDicom(subdir)
+        shutil.rmtree(subdir)
+        self.assertEqual(matches, [subdir + "/1.2.840.1234"])
+        self.assertEqual(dirs, [subdir])
+
     def test_getAllSeries(self):
         print("\nTesting DicomUtils.getAllSeries")
         seriessets = dicomutils.getAllSeries([TestDicomUtils.TMPDIR])
@@ -47,6 +67,144 @@ class TestDicomUtils(unittest.TestCase):
         else:
             self.fail("    Bad series: " + series_id)
 
+    def test_getAllSeriesGDCM(self):
+        print("\nTesting DicomUtils.getAllSeries against GDCM")
+        seriessets = dicomutils.getAllSeries([TestDicomUtils.TMPDIR])
+        gdcmsets = dicomutils.getAllSeriesGDCM([TestDicomUtils.TMPDIR])
+        self.assertEqual(len(seriessets), len(gdcmsets))
+        self.assertEqual(seriessets[0][0], gdcmsets[0][0])
+        self.assertEqual(seriessets[0][2], list(gdcmsets[0][2]))
+
+    def test_readDicomHeader(self):
+        print("\nTesting DicomUtils.readDicomHeader")
+        header = dicomutils.readDicomHeader(TestDicomUtils.TMPDIR + "/0.dcm")
+        print(header)
+        self.assertEqual(header["Modality"], "CT")
+        self.assertEqual(header["Rows"], TestDicomUtils.SIZE)
+        self.assertEqual(len(header["ImagePositionPatient"]), 3)
+        self.assertIsNone(dicomutils.readDicomHeader("tests/__init__.py"))
+
+    def test_sortSlices(self):
+        print("\nTesting DicomUtils.sortSlices")
+        orientation = [1, 0, 0, 0, 0, -1]  # coronal, normal is +y
+        zs = [3.0, 0.0, 1.0, 2.0, 5.0, 2.0]
+        files = ["f" + str(i) for i in range(len(zs))]
+        headers = [
+            {
+                "ImagePositionPatient": [0.0, z, 0.0],
+                "ImageOrientationPatient": orientation,
+                "InstanceNumber": i,
+            }
+            for i, z in enumerate(zs)
+        ]
+        ordered, report = dicomutils.sortSlices(files, headers)
+        self.assertEqual(ordered, ["f1", "f2", "f3", "f5", "f0", "f4"])
+        self.assertEqual(report["spacing"], 1.0)
+        self.assertEqual(report["duplicates"], [("f3", "f5")])
+        self.assertEqual(report["gaps"], [("f0", "f4")])
+        self.assertFalse(report["uniform"])
+
+        ordered, report = dicomutils.sortSlices(files[1:4], headers[1:4])
+        self.assertEqual(ordered, ["f1", "f2", "f3"])
+        self.assertTrue(report["uniform"])
+        self.assertEqual(report["duplicates"] + report["gaps"], [])
+
+    def test_parseSearch(self):
+        print("\nTesting DicomUtils.parseSearch")
+        preds = dicomutils.parseSearch("bone; thickness<=1.5;type=AXIAL")
+        self.assertEqual(
+            preds,
+            [
+                ("SeriesDescription", "~", "bone"),
+                ("SliceThickness", "<=", "1.5"),
+                ("ImageType", "=", "AXIAL"),
+            ],
+        )
+        with self.assertRaises(ValueError):
+            dicomutils.parseSearch("nosuchfield=3")
+
+        # split at the first operator, whatever is in the value
+        self.assertEqual(
+            dicomutils.parseSearch("SeriesDescription=a<b; desc~x!=y; number>=3"),
+            [
+                ("SeriesDescription", "=", "a<b"),
+                ("SeriesDescription", "~", "x!=y"),
+                ("SeriesNumber", ">=", "3"),
+            ],
+        )
+        self.assertEqual(
+            dicomutils.parseSearch("description=x>=y"),
+            [("SeriesDescription", "=", "x>=y")],
+        )
+
+    def test_matchSeries(self):
+        print("\nTesting DicomUtils.matchSeries")
+        header = {
+            "SeriesDescription": "Head 1.0 H70h Bone",
+            "ImageType": ["ORIGINAL", "PRIMARY", "AXIAL"],
+            "SliceThickness": 1.0,
+            "ConvolutionKernel": None,
+        }
+        match = dicomutils.matchSeries
+        self.assertTrue(match(header, dicomutils.parseSearch("bone")))
+        self.assertTrue(match(header, dicomutils.parseSearch("type=axial")))
+        self.assertFalse(match(header, dicomutils.parseSearch("type=LOCALIZER")))
+        self.assertTrue(match(header, dicomutils.parseSearch("thickness=1")))
+        self.assertFalse(match(header, dicomutils.parseSearch("thickness>1")))
+        self.assertFalse(match(header, dicomutils.parseSearch("kernel=B70f")))
+        self.assertTrue(match(header, dicomutils.parseSearch("kernel!=B70f")))
+
+    def test_findLargestSeriesSearch(self):
+        print("\nTesting DicomUtils.findLargestSeries with a search")
+        subdir = TestDicomUtils.TMPDIR + "/scout"
+        os.mkdir(subdir)
+        for z in range(4):
+            ds = pydicom.dcmread(TestDicomUtils.TMPDIR + "/" + str(z) + ".dcm")
+            ds.SeriesInstanceUID = "1.2.3.4.5"
+            ds.SeriesDescription = "Scout"
+            ds.save_as(subdir + "/" + str(z) + ".dcm")
+
+        largest = dicomutils.findLargestSeries(TestDicomUtils.TMPDIR)
+        scout = dicomutils.findLargestSeries(TestDicomUtils.TMPDIR, search="scout")
+        none = dicomutils.findLargestSeries(
+            TestDicomUtils.TMPDIR, search="description=nothing"
+        )
+        shutil.rmtree(subdir)
+
+        self.assertEqual(len(largest[1]), TestDicomUtils.SIZE)
+        self.assertEqual(scout[0], "1.2.3.4.5")
+        self.assertEqual(len(scout[1]), 4)
+        self.assertIsNone(none)
+
+    def test_findLargestSeriesNoPreamble(self):
+        print("\nTesting DicomUtils.findLargestSeries without preambles")
+        subdir = TestDicomUtils.TMPDIR + "/raw"
+        os.mkdir(subdir)
+        try:
+            # bare implicit VR datasets, with no preamble or file meta
+            for z in range(TestDicomUtils.SIZE):
+                ds = pydicom.dcmread(TestDicomUtils.TMPDIR + "/" + str(z) + ".dcm")
+                del ds.file_meta
+                with open(subdir + "/" + str(z), "wb") as f:
+                    fp = DicomFileLike(f)
+                    fp.is_little_endian = True
+                    fp.is_implicit_VR = True
+                    pydicom.filewriter.write_dataset(fp, ds)
+            self.assertTrue(dicomutils.isDicomFile(subdir + "/0"))
+
+            uid, files, headers = dicomutils.findLargestSeries(subdir)
+            self.assertEqual(len(files), TestDicomUtils.SIZE)
+            self.assertEqual(headers[0]["TransferSyntaxUID"], "1.2.840.10008.1.2")
+            img, _ = dicomutils.loadSeries(files, headers, workers=1)
+            ref, _ = dicomutils.loadLargestSeries(TestDicomUtils.TMPDIR)
+            self.assertEqual(img.GetSize(), ref.GetSize())
+            self.assertEqual(
+                sitk.GetArrayViewFromImage(img).tolist(),
+                sitk.GetArrayViewFromImage(ref).tolist(),
+            )
+        finally:
+            shutil.rmtree(subdir)
+
     def test_getModality(self):
         print("\nTesting DicomUtils.getModality")
         img = sitk.Image(10, 10, sitk.sitkUInt16)
@@ -74,6 +232,28 @@ class TestDicomUtils(unittest.TestCase):
         img, mod = dicomutils.loadZipDicom("tests/testzip.zip", "tests/ziptmp")
         print(img.GetSize())
         print(mod)
+        self.assertEqual(
+            img.GetSize(),
+            (TestDicomUtils.SIZE, TestDicomUtils.SIZE, TestDicomUtils.SIZE),
+        )
+        self.assertEqual(mod, "CT")
+        # nothing is extracted from the zip
+        self.assertEqual(os.listdir("tests/ziptmp"), [])
+
+        # same pixels and geometry as the GDCM series reader
+        ref, _ = dicomutils.loadLargestSeries(TestDicomUtils.TMPDIR)
+        self.assertEqual(img.GetPixelID(), ref.GetPixelID())
+        self.assertEqual(img.GetSpacing(), ref.GetSpacing())
+        self.assertEqual(img.GetOrigin(), ref.GetOrigin())
+        diff = sitk.GetArrayViewFromImage(img) - sitk.GetArrayViewFromImage(ref)
+        self.assertEqual(abs(diff).max(), 0)
+
+        # the member headers are the same whatever the number of threads
+        serial = dicomutils.findLargestZipSeries("tests/testzip.zip", workers=1)
+        parallel = dicomutils.findLargestZipSeries("tests/testzip.zip", workers=4)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(len(parallel[1]), TestDicomUtils.SIZE)
+
         os.unlink("tests/testzip.zip")
         shutil.rmtree("tests/ziptmp")
 
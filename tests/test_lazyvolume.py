@@ -0,0 +1,222 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import unittest
+from unittest import mock
+
+import numpy as np
+import SimpleITK as sitk
+from tests import create_data
+from tests import write_series
+from dicom2stl.utils import dicomutils
+from dicom2stl.utils import lazyvolume
+from dicom2stl.utils import parseargs
+from dicom2stl.utils import volumecache
+from dicom2stl.utils import volumestats
+from dicom2stl.Dicom2STL import Dicom2STL, openVolume
+
+
+class TestLazyVolume(unittest.TestCase):
+    TMPDIR = "testlazytmp"
+    VOLUME = "tetra-lazy.nii.gz"
+    SIZE = 20
+
+    @classmethod
+    def setUpClass(cls):
+        vol = create_data.make_cylinder(
+            TestLazyVolume.SIZE, pixel_type=sitk.sitkInt16
+        )
+        vol.SetSpacing([0.8, 0.8, 2.5])
+        vol.SetOrigin([5.0, -5.0, 100.0])
+        os.makedirs(TestLazyVolume.TMPDIR, exist_ok=True)
+        write_series.write_series(vol, TestLazyVolume.TMPDIR)
+        sitk.WriteImage(vol, TestLazyVolume.VOLUME)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TestLazyVolume.TMPDIR)
+        os.remove(TestLazyVolume.VOLUME)
+        for f in ["lazy-meta.txt", "lazy-out.stl"]:
+            if os.path.exists(f):
+                os.remove(f)
+
+    def compareGeometry(self, vol, img):
+        self.assertEqual(vol.GetSize(), img.GetSize())
+        np.testing.assert_allclose(vol.GetSpacing(), img.GetSpacing())
+        np.testing.assert_allclose(vol.GetOrigin(), img.GetOrigin())
+        np.testing.assert_allclose(
+            vol.GetDirection(), img.GetDirection(), atol=1e-6
+        )
+
+    def test_DicomSeriesVolume(self):
+        print("\nTesting lazyvolume.DicomSeriesVolume")
+        uid, files, headers = dicomutils.findLargestSeries(TestLazyVolume.TMPDIR)
+        vol = lazyvolume.DicomSeriesVolume(files, headers, uid)
+        self.assertEqual(vol.GetModality(), "CT")
+        self.compareGeometry(vol, vol.GetImage())
+
+    def test_ImageFileVolume(self):
+        print("\nTesting lazyvolume.ImageFileVolume")
+        vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+        self.assertEqual(vol.GetModality(), "")
+        self.compareGeometry(vol, vol.GetImage())
+
+    def compareRegion(self, vol, full, index, size):
+        img = vol.GetImage()
+        ref = full[
+            index[0] : index[0] + size[0],
+            index[1] : index[1] + size[1],
+            index[2] : index[2] + size[2],
+        ]
+        self.compareGeometry(vol, ref)
+        self.compareGeometry(vol, img)
+        np.testing.assert_array_equal(
+            sitk.GetArrayViewFromImage(img), sitk.GetArrayViewFromImage(ref)
+        )
+
+    def test_SetRegion(self):
+        print("\nTesting lazyvolume.LazyVolume.SetRegion")
+        index, size = [3, 5, 4], [10, 8, 6]
+        uid, files, headers = dicomutils.findLargestSeries(TestLazyVolume.TMPDIR)
+        for workers in [None, 2]:
+            vol = lazyvolume.DicomSeriesVolume(files, headers, uid, workers)
+            full = vol.GetImage()
+            vol.SetRegion(index, size)
+            self.assertEqual(vol.GetSize(), tuple(size))
+            self.compareRegion(vol, full, index, size)
+
+        vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+        full = vol.GetImage()
+        vol.SetRegion(index, size)
+        self.compareRegion(vol, full, index, size)
+
+        # clipped to the volume
+        vol.SetRegion([-2, 0, 15], [4, 100, 100])
+        self.assertEqual(vol.GetSize(), (2, TestLazyVolume.SIZE, 5))
+        with self.assertRaises(ValueError):
+            vol.SetRegion([0, 0, 30], [5, 5, 5])
+
+    def test_SetShrink(self):
+        print("\nTesting lazyvolume.LazyVolume.SetShrink")
+        uid, files, headers = dicomutils.findLargestSeries(TestLazyVolume.TMPDIR)
+        vol = lazyvolume.DicomSeriesVolume(files, headers, uid, 1)
+        full = vol.GetImage()[2:, :, 1:]
+        ref = sitk.BinShrink(full, [2, 3, 1])[:, :, ::4]
+
+        vol.SetRegion([2, 0, 1], [100, 100, 100])
+        vol.SetShrink([2, 3, 4])
+        img = vol.GetImage()
+        for v in [vol, img]:
+            self.compareGeometry(v, ref)
+        np.testing.assert_allclose(
+            sitk.GetArrayViewFromImage(img), sitk.GetArrayViewFromImage(ref), atol=1
+        )
+
+        vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+        vol.SetShrink([2, 3, 4])
+        full = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME).GetImage()
+        ref = sitk.BinShrink(full, [2, 3, 1])[:, :, ::4]
+        img = vol.GetImage()
+        for v in [vol, img]:
+            self.compareGeometry(v, ref)
+
+    def test_GetSlab(self):
+        print("\nTesting lazyvolume.LazyVolume.GetSlab")
+        vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+        full = vol.GetImage()
+        slab = vol.GetSlab(4, 9)
+        self.assertEqual(slab.GetSize(), (TestLazyVolume.SIZE,) * 2 + (5,))
+        np.testing.assert_array_equal(
+            sitk.GetArrayFromImage(slab), sitk.GetArrayFromImage(full[:, :, 4:9])
+        )
+        # the whole volume is read again after the slab
+        self.compareRegion(vol, full, [0, 0, 0], [TestLazyVolume.SIZE] * 3)
+
+    def test_SetPhysicalRegion(self):
+        print("\nTesting lazyvolume.LazyVolume.SetPhysicalRegion")
+        vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+        full = vol.GetImage()
+        lower = full.TransformIndexToPhysicalPoint([2, 3, 4])
+        upper = full.TransformIndexToPhysicalPoint([9, 12, 10])
+        vol.SetPhysicalRegion(upper, lower)
+        self.compareRegion(vol, full, [2, 3, 4], [8, 10, 7])
+
+    def test_GetStatistics(self):
+        print("\nTesting lazyvolume.LazyVolume.GetStatistics")
+        cacheDir = TestLazyVolume.TMPDIR + "/stats"
+        compute = mock.Mock(wraps=volumestats.computeStats)
+        with mock.patch.object(volumestats, "computeStats", compute):
+            vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+            vol.SetVolumeCache(cacheDir)
+            img = vol.GetImage()
+            # computed on the first read only
+            compute.assert_not_called()
+            stats = vol.GetStatistics()
+            self.assertIs(vol.GetStatistics(), stats)
+            self.assertEqual(compute.call_count, 1)
+
+            # the whole volume's statistics come from the cache
+            vol = lazyvolume.ImageFileVolume(TestLazyVolume.VOLUME)
+            vol.SetVolumeCache(cacheDir)
+            vol.GetImage()
+            self.assertEqual(vol.GetStatistics(), stats)
+            self.assertEqual(compute.call_count, 1)
+
+            # a region's statistics are not cached
+            vol.SetRegion([0, 0, 0], [10, 10, 10])
+            key = volumecache.cacheKey(
+                vol.cacheFiles, "", str((vol.region, vol.shrink))
+            )
+            img = vol.GetImage()
+            self.assertEqual(vol.GetStatistics()["count"], 1000)
+            self.assertEqual(compute.call_count, 2)
+            self.assertIsNone(volumecache.loadCachedStats(cacheDir, key))
+
+            # nothing to compute once the image is gone
+            img = vol.GetImage()
+            del img
+            self.assertIsNone(vol.GetStatistics())
+
+    def test_openVolume(self):
+        print("\nTesting openVolume")
+        vol = openVolume([TestLazyVolume.TMPDIR])
+        self.assertIsInstance(vol, lazyvolume.DicomSeriesVolume)
+        vol = openVolume([TestLazyVolume.VOLUME])
+        self.assertIsInstance(vol, lazyvolume.ImageFileVolume)
+
+    def test_openVolumeFileList(self):
+        print("\nTesting openVolume on Dicom files with UID names")
+        uid, files, _ = dicomutils.findLargestSeries(TestLazyVolume.TMPDIR)
+        subdir = TestLazyVolume.TMPDIR + "/uids"
+        os.mkdir(subdir)
+        # names whose first integers are in reverse slice order
+        names = []
+        for i, f in enumerate(files):
+            names.append(f"{subdir}/1.3.{len(files) - i}.{i * 7}")
+            shutil.copy(f, names[-1])
+        try:
+            vol = openVolume([subdir + "/1.3.*"])
+            self.assertEqual(vol.sources, names)
+            self.compareGeometry(vol, openVolume([TestLazyVolume.TMPDIR]))
+        finally:
+            shutil.rmtree(subdir)
+
+    def test_ctRejectedBeforeDecode(self):
+        print("\nTesting --ct rejection before the pixels are decoded")
+        parser = parseargs.createParser()
+        args = parser.parse_args(
+            ["--ct", "-m", "lazy-meta.txt", "-o", "lazy-out.stl"]
+            + [TestLazyVolume.VOLUME]
+        )
+        with mock.patch.object(
+            lazyvolume.ImageFileVolume, "_decode", side_effect=AssertionError
+        ) as decode:
+            with self.assertRaises(SystemExit) as cm:
+                Dicom2STL(args)
+            self.assertEqual(cm.exception.code, 1)
+            decode.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
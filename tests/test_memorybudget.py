@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+
+import unittest
+
+from dicom2stl.utils import memorybudget
+from dicom2stl.utils import volumefilters
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_parseMemorySize(self):
+        print("\nTesting memorybudget.parseMemorySize")
+        self.assertEqual(memorybudget.parseMemorySize("4G"), 4 * 2**30)
+        self.assertEqual(memorybudget.parseMemorySize("512mb"), 512 * 2**20)
+        self.assertEqual(memorybudget.parseMemorySize("1.5GiB"), 3 * 2**29)
+        self.assertEqual(memorybudget.parseMemorySize("1000"), 1000)
+        with self.assertRaises(ValueError):
+            memorybudget.parseMemorySize("lots")
+
+    def test_stagePeaks(self):
+        print("\nTesting memorybudget.stagePeaks")
+        size = [512, 512, 400]
+        peaks = memorybudget.stagePeaks(size, 2, ["anisotropic", "threshold"])
+        n = 512 * 512 * 400
+        overhead = memorybudget.RUNTIME_OVERHEAD
+        self.assertEqual(peaks["load"], overhead + 2 * n)
+        self.assertEqual(peaks["anisotropic"], overhead + 14 * n)
+        self.assertEqual(peaks["threshold"], overhead + 3 * n)
+        # the pad and vtk stages work on 8 bit labels after the threshold,
+        # and the VTK image shares the padded volume
+        self.assertEqual(peaks["vtk"], overhead + 522 * 522 * 410)
+
+        # parallel decoding copies the shared memory volume into the image
+        peaks = memorybudget.stagePeaks(size, 2, [], loadCopies=2)
+        self.assertEqual(peaks["load"], overhead + 4 * n)
+
+    def test_planMemory(self):
+        print("\nTesting memorybudget.planMemory")
+        size = [1024, 1024, 3000]
+        stages = ["anisotropic", "threshold", "median"]
+        for gb in [2, 4, 8]:
+            budget = gb * 2**30
+            plan = memorybudget.planMemory(size, 2, budget, stages, False)
+            memorybudget.printPlan(plan, budget)
+            self.assertLessEqual(plan["peak"], budget)
+            self.assertIsNone(plan["slabDepth"])
+            f = plan["shrink"][0]
+            if f > 1:
+                # one step finer does not fit
+                finer = [s // (f - 1) for s in size[:2]] + [-(-size[2] // (f - 1))]
+                peaks = memorybudget.stagePeaks(finer, 2, stages)
+                self.assertGreater(max(peaks.values()), budget)
+
+        # with slabs, the filters no longer limit the resolution
+        budget = 4 * 2**30
+        whole = memorybudget.planMemory(size, 2, budget, stages, False)
+        slabs = memorybudget.planMemory(size, 2, budget, stages, True)
+        self.assertLessEqual(slabs["shrink"][0], whole["shrink"][0])
+        self.assertLessEqual(slabs["peak"], budget)
+        if slabs["slabDepth"] is not None:
+            self.assertGreaterEqual(slabs["slabDepth"], 1)
+
+        self.assertIsNone(memorybudget.planMemory(size, 2, 2**20, stages))
+
+    def test_engines(self):
+        print("\nTesting memorybudget with the filter engines")
+        size = [512, 512, 400]
+        n = 512 * 512 * 400
+        overhead = memorybudget.RUNTIME_OVERHEAD
+        stages = ["threshold", "median"]
+        peaks = memorybudget.stagePeaks(size, 2, stages, medianEngine="majority")
+        self.assertEqual(peaks["median"], overhead + 13 * n)
+        peaks = memorybudget.stagePeaks(size, 2, stages, medianEngine="median")
+        self.assertEqual(peaks["median"], overhead + 2 * n)
+        peaks = memorybudget.stagePeaks(
+            size, 2, ["anisotropic"], smoothingEngine="recursive"
+        )
+        self.assertEqual(peaks["anisotropic"], overhead + 26 * n)
+
+        # the halos are the slab pipeline's
+        self.assertEqual(
+            memorybudget.stageHalo("anisotropic", "recursive"),
+            volumefilters.smoothingHalo("recursive"),
+        )
+        self.assertEqual(
+            memorybudget.stageHalo(
+                "median", medianEngine="morphology", medianRadius=[2, 2, 3]
+            ),
+            12,
+        )
+
+        # costlier engines and wider halos give thinner slabs
+        budget = 2 * 2**30
+        stages = ["anisotropic", "threshold", "median"]
+        cheap = memorybudget.slabDepth(
+            size, 2, stages, budget, "curvature", "median", [3, 3, 1]
+        )
+        costly = memorybudget.slabDepth(
+            size, 2, stages, budget, "recursive", "morphology", [3, 3, 2]
+        )
+        self.assertLess(costly, cheap)
+        plan = memorybudget.planMemory(
+            [1024, 1024, 3000],
+            2,
+            budget,
+            stages,
+            smoothingEngine="recursive",
+            medianEngine="majority",
+            medianRadius=[3, 3, 2],
+        )
+        self.assertLessEqual(plan["peak"], budget)
+        with self.assertRaises(ValueError):
+            memorybudget.stagePeaks(size, 2, ["anisotropic"], smoothingEngine="x")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from dicom2stl.utils import profiler
+
+
+class TestProfiler(unittest.TestCase):
+    def tearDown(self):
+        profiler.stop()
+
+    def test_disabled(self):
+        print("\nTesting profiler.stage when profiling is off")
+        profiler.stop()
+        with profiler.stage("nothing", input=3) as rec:
+            rec["output"] = 4
+        self.assertFalse(profiler.enabled())
+        self.assertEqual(profiler.records(), [])
+
+    def test_stage(self):
+        print("\nTesting profiler.stage")
+        profiler.start()
+        n = 64 * 2**20
+        with profiler.stage("outer") as outer:
+            with profiler.stage("alloc", input=n) as rec:
+                a = np.ones(n, dtype=np.uint8)
+                rec["output"] = int(a.sum())
+                del a
+            outer["output"] = 1
+        records = profiler.records()
+
+        # inner stages finish first
+        self.assertEqual([r["name"] for r in records], ["alloc", "outer"])
+        alloc = records[0]
+        self.assertEqual(alloc["input"], n)
+        self.assertEqual(alloc["output"], n)
+        self.assertGreaterEqual(alloc["wall"], 0.0)
+        self.assertGreaterEqual(alloc["cpu"], 0.0)
+        self.assertGreaterEqual(alloc["threads"], 1)
+        if alloc["peakRSSDelta"] is not None:
+            # the array was freed, but the peak includes it
+            self.assertGreater(alloc["peakRSSDelta"], n // 2)
+            self.assertGreaterEqual(records[1]["peakRSS"], alloc["peakRSS"])
+
+    def test_write(self):
+        print("\nTesting profiler.write")
+        profiler.start()
+        with profiler.stage("sleep"):
+            pass
+        fd, name = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            profiler.write(name, {"options": {"input": "test"}})
+            with open(name) as f:
+                profile = json.load(f)
+        finally:
+            os.remove(name)
+        self.assertEqual(profile["stages"][0]["name"], "sleep")
+        self.assertEqual(profile["options"], {"input": "test"})
+        self.assertIn("peakRSS", profile)
+        self.assertIn("itk", profile["threads"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+#! /usr/bin/env python
+
+import builtins
+import os
+import shutil
+import unittest
+from unittest import mock
+
+import SimpleITK as sitk
+from tests import create_data
+from tests import write_series
+from dicom2stl.utils import dicomutils
+from dicom2stl.utils.seriesindex import SeriesIndex
+
+
+class TestSeriesIndex(unittest.TestCase):
+    TMPDIR = "testindextmp"
+    CACHEDIR = "testindexcache"
+    SIZE = 16
+
+    @classmethod
+    def setUpClass(cls):
+        cyl = create_data.make_cylinder(TestSeriesIndex.SIZE, sitk.sitkUInt16)
+        os.makedirs(TestSeriesIndex.TMPDIR, exist_ok=True)
+        write_series.write_series(cyl, TestSeriesIndex.TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TestSeriesIndex.TMPDIR)
+        shutil.rmtree(TestSeriesIndex.CACHEDIR, ignore_errors=True)
+
+    def test_headers(self):
+        print("\nTesting SeriesIndex.headers")
+        files = sorted(
+            os.path.join(TestSeriesIndex.TMPDIR, f)
+            for f in os.listdir(TestSeriesIndex.TMPDIR)
+        )
+        read_counts = []
+
+        def reader(paths):
+            read_counts.append(len(paths))
+            return dicomutils.readDicomHeaders(paths)
+
+        with SeriesIndex(TestSeriesIndex.CACHEDIR) as index:
+            first = index.headers(files, reader)
+        with SeriesIndex(TestSeriesIndex.CACHEDIR) as index:
+            second = index.headers(files, reader)
+        self.assertEqual(read_counts, [TestSeriesIndex.SIZE])
+        self.assertEqual(first, second)
+
+        # only a changed file is read again
+        st = os.stat(files[3])
+        os.utime(files[3], ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        with SeriesIndex(TestSeriesIndex.CACHEDIR) as index:
+            third = index.headers(files, reader)
+        self.assertEqual(read_counts, [TestSeriesIndex.SIZE, 1])
+        self.assertEqual(first, third)
+
+    def test_findLargestSeries(self):
+        print("\nTesting findLargestSeries opens only changed files")
+        cacheDir = TestSeriesIndex.CACHEDIR + "/find"
+        tmpdir = os.path.abspath(TestSeriesIndex.TMPDIR)
+        with open(os.path.join(TestSeriesIndex.TMPDIR, "notes.txt"), "w") as fp:
+            fp.write("not a Dicom file")
+        opened = []
+        realOpen = builtins.open
+
+        def countingOpen(file, *args, **kwargs):
+            if isinstance(file, str) and os.path.abspath(file).startswith(tmpdir):
+                opened.append(file)
+            return realOpen(file, *args, **kwargs)
+
+        try:
+            results = []
+            for _ in range(2):
+                opened.clear()
+                with mock.patch.object(builtins, "open", countingOpen):
+                    results.append(
+                        dicomutils.findLargestSeries(TestSeriesIndex.TMPDIR, cacheDir)
+                    )
+                if len(results) == 1:
+                    self.assertGreater(len(opened), TestSeriesIndex.SIZE)
+            # the second run classifies and reads nothing
+            self.assertEqual(opened, [])
+            self.assertEqual(results[0], results[1])
+            self.assertEqual(len(results[1][1]), TestSeriesIndex.SIZE)
+
+            # a changed file is the only one opened again
+            files = results[0][1]
+            st = os.stat(files[5])
+            os.utime(files[5], ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+            opened.clear()
+            with mock.patch.object(builtins, "open", countingOpen):
+                dicomutils.findLargestSeries(TestSeriesIndex.TMPDIR, cacheDir)
+            self.assertEqual(set(opened), {files[5]})
+        finally:
+            os.remove(os.path.join(TestSeriesIndex.TMPDIR, "notes.txt"))
+
+    def test_prune(self):
+        print("\nTesting SeriesIndex.prune of deleted files")
+        cacheDir = TestSeriesIndex.CACHEDIR + "/prune"
+        subdir = TestSeriesIndex.TMPDIR + "/copy"
+        shutil.copytree(TestSeriesIndex.TMPDIR, subdir)
+        other = os.path.abspath(TestSeriesIndex.TMPDIR + "other")
+
+        def indexed():
+            with SeriesIndex(cacheDir) as index:
+                return [r[0] for r in index.db.execute("SELECT path FROM files")]
+
+        try:
+            dicomutils.findLargestSeries(TestSeriesIndex.TMPDIR, cacheDir)
+            self.assertEqual(len(indexed()), 2 * TestSeriesIndex.SIZE)
+            # a file of another tree that shares the root's name prefix
+            with SeriesIndex(cacheDir) as index:
+                index.store([(other + "/0.dcm", 1, 1, None)])
+
+            shutil.rmtree(subdir)
+            dicomutils.findLargestSeries(TestSeriesIndex.TMPDIR, cacheDir)
+            paths = indexed()
+            self.assertEqual(len(paths), TestSeriesIndex.SIZE + 1)
+            self.assertIn(other + "/0.dcm", paths)
+            self.assertFalse(any("/copy/" in p for p in paths))
+        finally:
+            shutil.rmtree(subdir, ignore_errors=True)
+
+    def test_loadLargestSeries(self):
+        print("\nTesting loadLargestSeries with a series index")
+        for _ in range(2):
+            img, mod = dicomutils.loadLargestSeries(
+                TestSeriesIndex.TMPDIR, TestSeriesIndex.CACHEDIR
+            )
+            self.assertEqual(img.GetSize(), (TestSeriesIndex.SIZE,) * 3)
+            self.assertEqual(mod, "CT")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import unittest
+import zipfile
+
+import numpy as np
+import SimpleITK as sitk
+from tests import create_data
+from tests import write_series
+from dicom2stl.utils import dicomutils
+from dicom2stl.utils import seriesreader
+
+
+class TestSeriesReader(unittest.TestCase):
+    TMPDIR = "testreadertmp"
+    SIZE = 24
+
+    @classmethod
+    def setUpClass(cls):
+        vol = create_data.make_tetra(
+            TestSeriesReader.SIZE, pixel_type=sitk.sitkInt16
+        )
+        vol.SetSpacing([0.5, 0.75, 2.0])
+        vol.SetOrigin([-10.0, 20.0, 5.0])
+        vol.SetDirection([1, 0, 0, 0, 0, 1, 0, -1, 0])
+        os.makedirs(TestSeriesReader.TMPDIR, exist_ok=True)
+        write_series.write_series(vol, TestSeriesReader.TMPDIR)
+        series = dicomutils.getAllSeries([TestSeriesReader.TMPDIR])
+        cls.files = series[0][2]
+        headers = dicomutils.readDicomHeaders(cls.files)
+        cls.headers = [headers[f] for f in cls.files]
+        isr = sitk.ImageSeriesReader()
+        isr.SetFileNames(cls.files)
+        cls.reference = isr.Execute()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TestSeriesReader.TMPDIR)
+
+    def compare(self, img):
+        ref = TestSeriesReader.reference
+        self.assertEqual(img.GetSize(), ref.GetSize())
+        self.assertEqual(img.GetPixelID(), ref.GetPixelID())
+        np.testing.assert_allclose(img.GetSpacing(), ref.GetSpacing())
+        np.testing.assert_allclose(img.GetOrigin(), ref.GetOrigin())
+        np.testing.assert_allclose(
+            img.GetDirection(), ref.GetDirection(), atol=1e-6
+        )
+        np.testing.assert_array_equal(
+            sitk.GetArrayViewFromImage(img), sitk.GetArrayViewFromImage(ref)
+        )
+
+    def test_seriesPixelType(self):
+        print("\nTesting seriesreader.seriesPixelType")
+        header = {"BitsStored": 12, "PixelRepresentation": 0}
+        self.assertEqual(seriesreader.seriesPixelType(header), np.uint16)
+        header["RescaleIntercept"] = -1024.0
+        header["RescaleSlope"] = 1.0
+        self.assertEqual(seriesreader.seriesPixelType(header), np.int16)
+        header["RescaleSlope"] = 0.5
+        self.assertEqual(seriesreader.seriesPixelType(header), np.float32)
+
+    def test_readSeries(self):
+        print("\nTesting seriesreader.readSeries in one process")
+        img = seriesreader.readSeries(
+            TestSeriesReader.files, TestSeriesReader.headers, workers=1
+        )
+        self.compare(img)
+
+    def test_readSeriesParallel(self):
+        print("\nTesting seriesreader.readSeries with worker processes")
+        img = seriesreader.readSeries(
+            TestSeriesReader.files, TestSeriesReader.headers, workers=3
+        )
+        self.compare(img)
+
+    def test_readSeriesGDCM(self):
+        print("\nTesting seriesreader.readSeries with the GDCM decoder")
+        img = seriesreader.readSeries(
+            TestSeriesReader.files, TestSeriesReader.headers, 1, decoder="gdcm"
+        )
+        self.compare(img)
+        img = seriesreader.readSeries(
+            TestSeriesReader.files, TestSeriesReader.headers, 3, decoder="gdcm"
+        )
+        self.compare(img)
+
+    def test_chooseDecoder(self):
+        print("\nTesting seriesreader.chooseDecoder")
+        header = {"TransferSyntaxUID": "1.2.840.10008.1.2.1"}
+        self.assertEqual(seriesreader.chooseDecoder(header), "pydicom")
+        self.assertEqual(seriesreader.chooseDecoder(header, "gdcm"), "gdcm")
+        header["TransferSyntaxUID"] = "1.2.840.10008.1.2.4.90"
+        self.assertEqual(seriesreader.chooseDecoder(header), "gdcm")
+        self.assertEqual(seriesreader.chooseDecoder(header, "pydicom"), "pydicom")
+        with self.assertRaises(ValueError):
+            seriesreader.chooseDecoder(header, "dcmtk")
+
+    def test_readCompressedSeries(self):
+        print("\nTesting seriesreader.readSeries on compressed series")
+        vol = sitk.GetImageFromArray(
+            sitk.GetArrayFromImage(TestSeriesReader.reference)
+        )
+        for compressor in write_series.compressors:
+            tmpdir = TestSeriesReader.TMPDIR + compressor
+            os.makedirs(tmpdir, exist_ok=True)
+            try:
+                write_series.write_series(vol, tmpdir, compressor=compressor)
+                files = dicomutils.getAllSeries([tmpdir])[0][2]
+                headers = dicomutils.readDicomHeaders(files)
+                headers = [headers[f] for f in files]
+                img = seriesreader.readSeries(files, headers, 1)
+                np.testing.assert_array_equal(
+                    sitk.GetArrayViewFromImage(img),
+                    sitk.GetArrayViewFromImage(TestSeriesReader.reference),
+                )
+            finally:
+                shutil.rmtree(tmpdir)
+
+    def test_readMixedSeries(self):
+        print("\nTesting seriesreader.readSeries on mixed transfer syntaxes")
+        sources = {None: TestSeriesReader.files}
+        headers = {None: TestSeriesReader.headers}
+        dirs = []
+        try:
+            for compressor in ["RLE", "JPEG2000"]:
+                tmpdir = TestSeriesReader.TMPDIR + compressor
+                dirs.append(tmpdir)
+                os.makedirs(tmpdir, exist_ok=True)
+                write_series.write_series(
+                    TestSeriesReader.reference, tmpdir, compressor=compressor
+                )
+                files = dicomutils.getAllSeries([tmpdir])[0][2]
+                h = dicomutils.readDicomHeaders(files)
+                sources[compressor] = files
+                headers[compressor] = [h[f] for f in files]
+
+            # every third slice in each transfer syntax
+            keys = [None, "RLE", "JPEG2000"]
+            mixed = [keys[i % 3] for i in range(TestSeriesReader.SIZE)]
+            files = [sources[k][i] for i, k in enumerate(mixed)]
+            hdrs = [headers[k][i] for i, k in enumerate(mixed)]
+            self.assertFalse(seriesreader.uniformPixelFormat(hdrs))
+            self.assertEqual(seriesreader.decodeWorkers(hdrs, 3), 1)
+            self.assertEqual(seriesreader.decodeWorkers(headers[None], 3), 3)
+            self.compare(seriesreader.readSeries(files, hdrs, workers=3))
+        finally:
+            for tmpdir in dirs:
+                shutil.rmtree(tmpdir)
+
+    def test_readRGBSeries(self):
+        print("\nTesting seriesreader.readSeries on an RGB series")
+        tmpdir = TestSeriesReader.TMPDIR + "rgb"
+        os.makedirs(tmpdir, exist_ok=True)
+        zipname = tmpdir + ".zip"
+        try:
+            gray = create_data.make_cylinder(16, pixel_type=sitk.sitkUInt8)
+            write_series.write_series(
+                sitk.Compose([gray, gray // 2, gray // 3]), tmpdir
+            )
+            _, files, headers = dicomutils.findLargestSeries(tmpdir)
+            isr = sitk.ImageSeriesReader()
+            isr.SetFileNames(files)
+            ref = isr.Execute()
+            self.assertEqual(ref.GetNumberOfComponentsPerPixel(), 3)
+
+            for workers, decoder in [(1, "pydicom"), (3, "pydicom"), (1, "gdcm")]:
+                img = seriesreader.readSeries(files, headers, workers, None, decoder)
+                self.assertEqual(img.GetNumberOfComponentsPerPixel(), 3)
+                np.testing.assert_array_equal(
+                    sitk.GetArrayViewFromImage(img), sitk.GetArrayViewFromImage(ref)
+                )
+
+            # cropped and binned as it is decoded
+            img = seriesreader.readSeries(
+                files, headers, 1, box=(2, 3, 14, 12), binning=(2, 3)
+            )
+            self.assertEqual(img.GetSize(), (6, 3, 16))
+            self.assertEqual(img.GetNumberOfComponentsPerPixel(), 3)
+
+            with zipfile.ZipFile(zipname, "w") as zf:
+                for f in files:
+                    zf.write(f)
+            img, _ = dicomutils.loadZipDicom(zipname)
+            np.testing.assert_array_equal(
+                sitk.GetArrayViewFromImage(img), sitk.GetArrayViewFromImage(ref)
+            )
+        finally:
+            shutil.rmtree(tmpdir)
+            if os.path.exists(zipname):
+                os.remove(zipname)
+
+    def test_volumePixelType(self):
+        print("\nTesting seriesreader.volumePixelType")
+        headers = [
+            {"BitsStored": 8, "PixelRepresentation": 0},
+            {"BitsStored": 8, "PixelRepresentation": 1},
+        ]
+        self.assertEqual(seriesreader.volumePixelType(headers), np.int16)
+        self.assertEqual(seriesreader.volumePixelType(headers[:1]), np.uint8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,13 @@
 #! /usr/bin/env python
 
+import gc
 import unittest
+
+import numpy as np
 import vtk
 import SimpleITK as sitk
-from SimpleITK.utilities.vtk import sitk2vtk
-import platform
+from vtk.util import numpy_support
+from dicom2stl.utils.sitk2vtk import sitk2vtk
 
 
 class TestSITK2VTK(unittest.TestCase):
@@ -28,6 +31,85 @@ class TestSITK2VTK(unittest.TestCase):
         else:
             print("VTK version < 9.  No direction matrix")
 
+    def test_noCopy(self):
+        print("Testing sitk2vtk shares the pixel buffer")
+        img = sitk.GaussianSource(sitk.sitkInt16, [64, 48, 32])
+        # a view after the conversion would copy img, which shares its
+        # buffer with the VTK array's keeper
+        view = sitk.GetArrayViewFromImage(img)
+        vol = sitk2vtk(img)
+        scalars = numpy_support.vtk_to_numpy(vol.GetPointData().GetScalars())
+        self.assertEqual(
+            scalars.__array_interface__["data"][0],
+            view.__array_interface__["data"][0],
+        )
+        self.assertEqual(
+            vol.GetScalarComponentAsFloat(10, 20, 30, 0), img[10, 20, 30]
+        )
+
+        # vector and 2-d images are shared too
+        for vimg in [
+            sitk.Compose([img, img * 2, img * 3]),
+            sitk.GaussianSource(sitk.sitkFloat32, [64, 48]),
+        ]:
+            address = sitk.GetArrayViewFromImage(vimg).__array_interface__["data"][0]
+            vvol = sitk2vtk(vimg)
+            scalars = vvol.GetPointData().GetScalars()
+            self.assertEqual(
+                scalars.GetNumberOfComponents(), vimg.GetNumberOfComponentsPerPixel()
+            )
+            self.assertEqual(
+                numpy_support.vtk_to_numpy(scalars).__array_interface__["data"][0],
+                address,
+            )
+        self.assertEqual(vvol.GetDimensions(), (64, 48, 1))
+
+    def test_lifetime(self):
+        print("Testing sitk2vtk keeps the pixel buffer alive")
+        img = sitk.GaussianSource(sitk.sitkFloat32, [64, 64, 64], mean=[20, 30, 40])
+        expected = sitk.GetArrayFromImage(img).ravel()
+        vol = sitk2vtk(img)
+        del img
+        gc.collect()
+
+        # allocate and fill images that would reuse a freed buffer
+        others = [sitk.Image([64, 64, 64], sitk.sitkFloat32) + 7.0 for _ in range(4)]
+        scalars = numpy_support.vtk_to_numpy(vol.GetPointData().GetScalars())
+        self.assertTrue(np.array_equal(scalars, expected))
+
+        # and through a VTK pipeline, after the Python wrapper of the array
+        # is gone too
+        del scalars, others
+        gc.collect()
+        contour = vtk.vtkFlyingEdges3D()
+        contour.SetInputData(vol)
+        contour.SetValue(0, 0.5 * float(expected.max()))
+        contour.Update()
+        self.assertGreater(contour.GetOutput().GetNumberOfPolys(), 0)
+        self.assertTrue(
+            np.array_equal(
+                numpy_support.vtk_to_numpy(vol.GetPointData().GetScalars()),
+                expected,
+            )
+        )
+
+    def test_copyOnWrite(self):
+        print("Testing sitk2vtk after the source image is written to")
+        img = sitk.GaussianSource(sitk.sitkFloat32, [64, 64, 64], mean=[20, 30, 40])
+        expected = sitk.GetArrayFromImage(img).ravel()
+        vol = sitk2vtk(img)
+
+        # the write moves img to a new buffer, and the other sharer goes
+        img2 = sitk.Image(img)
+        img[0, 0, 0] = 7.0
+        del img2
+        gc.collect()
+        others = [sitk.Image([64, 64, 64], sitk.sitkFloat32) + 7.0 for _ in range(4)]
+        scalars = numpy_support.vtk_to_numpy(vol.GetPointData().GetScalars())
+        self.assertTrue(np.array_equal(scalars, expected))
+        self.assertEqual(img[0, 0, 0], 7.0)
+        del others
+
 
 if __name__ == "__main__":
     unittest.main()
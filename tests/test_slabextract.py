@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+
+import contextlib
+import io
+import unittest
+
+import SimpleITK as sitk
+import vtk
+from tests import create_data
+from dicom2stl.utils import slabextract
+from dicom2stl.utils import vtkutils
+from dicom2stl.utils.sitk2vtk import sitk2vtk
+
+
+def boundaryEdges(mesh):
+    """Number of edges used by only one polygon of a mesh."""
+    edges = vtk.vtkFeatureEdges()
+    edges.SetInputData(mesh)
+    edges.BoundaryEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.NonManifoldEdgesOff()
+    edges.Update()
+    return edges.GetOutput().GetNumberOfCells()
+
+
+def weld(mesh):
+    clean = vtk.vtkStaticCleanPolyData()
+    clean.SetInputData(mesh)
+    clean.ToleranceIsAbsoluteOn()
+    clean.SetAbsoluteTolerance(0.0)
+    clean.Update()
+    return clean.GetOutput()
+
+
+class TestSlabExtract(unittest.TestCase):
+    def test_slabRanges(self):
+        print("\nTesting slabextract.slabRanges")
+        self.assertEqual(
+            slabextract.slabRanges(10, 4), [(0, 4), (4, 8), (8, 9)]
+        )
+        self.assertEqual(slabextract.slabRanges(10, 20), [(0, 9)])
+        self.assertEqual(slabextract.slabRanges(1, 4), [(0, 0)])
+
+    def test_extractSurfaceSlabs(self):
+        print("\nTesting slabextract.extractSurfaceSlabs")
+        img = create_data.make_tetra(64)
+        img.SetOrigin([3.0, 4.0, 5.0])
+        img.SetSpacing([0.5, 0.7, 1.1])
+        vol = sitk2vtk(img)
+        labels = sitk2vtk(sitk.BinaryThreshold(img, 100, 255, 255, 0))
+
+        for volume, isovalue, extractor in [
+            (vol, 100.5, "flyingedges"),
+            (vol, 100.0, "contour"),
+            (labels, 255.0, "discrete-flyingedges"),
+        ]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                single = weld(vtkutils.extractSurface(volume, isovalue, extractor))
+                slabs = slabextract.extractSurfaceSlabs(
+                    volume, isovalue, extractor, workers=2, depth=5
+                )
+            # the seams are welded, so the mesh is the single extraction's
+            self.assertGreater(single.GetNumberOfPolys(), 0)
+            self.assertEqual(slabs.GetNumberOfPolys(), single.GetNumberOfPolys())
+            self.assertEqual(slabs.GetNumberOfPoints(), single.GetNumberOfPoints())
+            self.assertEqual(boundaryEdges(slabs), 0)
+            for a, b in zip(slabs.GetBounds(), single.GetBounds()):
+                self.assertAlmostEqual(a, b, places=5)
+
+    def test_surfaceNets(self):
+        print("\nTesting slabextract.extractSurfaceSlabs with surface nets")
+        labels = sitk.BinaryThreshold(create_data.make_tetra(32), 100, 255, 255, 0)
+        with contextlib.redirect_stdout(io.StringIO()):
+            mesh = slabextract.extractSurfaceSlabs(
+                sitk2vtk(labels), 255.0, "surfacenets", workers=2
+            )
+        self.assertGreater(mesh.GetNumberOfPolys(), 0)
+        with self.assertRaises(ValueError):
+            slabextract.extractSurfaceSlabs(sitk2vtk(labels), 255.0, "cubes")
+
+
+if __name__ == "__main__":
+    unittest.main()
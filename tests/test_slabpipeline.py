@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+from tests import create_data
+from tests import write_series
+from dicom2stl.utils import dicomutils
+from dicom2stl.utils import lazyvolume
+from dicom2stl.utils import slabpipeline
+from dicom2stl.Dicom2STL import volumeProcessingPipeline
+
+
+class TestSlabPipeline(unittest.TestCase):
+    TMPDIR = "testslabtmp"
+    SIZE = 32
+
+    @classmethod
+    def setUpClass(cls):
+        vol = create_data.make_tetra(TestSlabPipeline.SIZE, pixel_type=sitk.sitkInt16)
+        noise = sitk.AdditiveGaussianNoise(
+            sitk.Cast(vol, sitk.sitkFloat32), 20.0, seed=7
+        )
+        vol = sitk.Cast(noise, sitk.sitkInt16)
+        vol.SetSpacing([0.7, 0.7, 1.5])
+        vol.SetOrigin([10.0, -3.0, 40.0])
+        cls.volume = vol
+        os.makedirs(TestSlabPipeline.TMPDIR, exist_ok=True)
+        write_series.write_series(vol, TestSlabPipeline.TMPDIR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TestSlabPipeline.TMPDIR)
+
+    def compare(self, img, ref, atol=0):
+        self.assertEqual(img.GetSize(), ref.GetSize())
+        np.testing.assert_allclose(img.GetOrigin(), ref.GetOrigin(), atol=1e-6)
+        np.testing.assert_allclose(img.GetSpacing(), ref.GetSpacing())
+        np.testing.assert_allclose(
+            sitk.GetArrayViewFromImage(img),
+            sitk.GetArrayViewFromImage(ref),
+            atol=atol,
+        )
+
+    def test_thresholdMedian(self):
+        print("\nTesting slabpipeline with threshold and median")
+        # Equal inner and outer thresholds make the threshold per voxel
+        thresholds = [50.0, 50.0, 300.0, 300.0]
+        ref = volumeProcessingPipeline(
+            TestSlabPipeline.volume, False, False, list(thresholds), True
+        )
+        stages = slabpipeline.thresholdStages(thresholds) + [
+            slabpipeline.medianStage()
+        ]
+        for depth in [1, 5, 100]:
+            out, geometry = slabpipeline.runSlabPipeline(
+                slabpipeline.imageSlabReader(TestSlabPipeline.volume),
+                depth,
+                stages,
+                TestSlabPipeline.SIZE,
+            )
+            self.assertIsInstance(out, sitk.Image)
+            self.compare(slabpipeline.slabsToImage(out, geometry), ref)
+
+    def test_doubleThreshold(self):
+        print("\nTesting slabpipeline with a double threshold")
+        # a long, thin outer range region that only one slab reaches from
+        # the inner range
+        vol = sitk.Image([12, 12, 40], sitk.sitkInt16)
+        vol[4:8, 4:8, 0:40] = 100
+        vol[4:8, 4:8, 0:2] = 200
+        vol[0:2, 0:2, 20:40] = 100
+        thresholds = [50.0, 150.0, 250.0, 300.0]
+        for volume, n in [(vol, 40), (TestSlabPipeline.volume, TestSlabPipeline.SIZE)]:
+            for medianFilter in [False, True]:
+                ref = volumeProcessingPipeline(
+                    volume, False, False, list(thresholds), medianFilter
+                )
+                out, geometry = slabpipeline.runSlabPipeline(
+                    slabpipeline.imageSlabReader(volume),
+                    4,
+                    slabpipeline.pipelineStages(
+                        thresholds=thresholds, medianFilter=medianFilter
+                    ),
+                    n,
+                )
+                self.compare(slabpipeline.slabsToImage(out, geometry), ref)
+
+    def test_lazyVolume(self):
+        print("\nTesting slabpipeline reading slabs from a lazy volume")
+        uid, files, headers = dicomutils.findLargestSeries(TestSlabPipeline.TMPDIR)
+        vol = lazyvolume.DicomSeriesVolume(files, headers, uid, 1)
+        vol.SetShrink([2, 2, 2])
+        ref = volumeProcessingPipeline(vol.GetImage(), False, False, None, True)
+        outFile = os.path.join(TestSlabPipeline.TMPDIR, "slabs.npy")
+        out, geometry = slabpipeline.runSlabPipeline(
+            slabpipeline.volumeSlabReader(vol),
+            3,
+            slabpipeline.pipelineStages(medianFilter=True),
+            vol.GetSize()[2],
+            outFile=outFile,
+        )
+        self.assertIsInstance(out, np.memmap)
+        self.compare(slabpipeline.slabsToImage(out, geometry), ref)
+        del out
+
+    def test_anisotropic(self):
+        print("\nTesting slabpipeline with anisotropic smoothing")
+        ref = volumeProcessingPipeline(TestSlabPipeline.volume, False, True)
+        out, geometry = slabpipeline.runSlabPipeline(
+            slabpipeline.imageSlabReader(TestSlabPipeline.volume),
+            8,
+            slabpipeline.pipelineStages(anisotropicSmoothing=True),
+            TestSlabPipeline.SIZE,
+        )
+        img = slabpipeline.slabsToImage(out, geometry)
+        # the conductance is scaled by each slab's average gradient
+        diff = np.abs(
+            sitk.GetArrayViewFromImage(img).astype(float)
+            - sitk.GetArrayViewFromImage(ref)
+        )
+        self.assertLess(diff.mean(), 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+
+import os
+import unittest
+
+import SimpleITK as sitk
+from vtkmodules.vtkCommonCore import vtkMultiThreader, vtkSMPTools
+from tests import create_data
+from dicom2stl.utils import slabpipeline
+from dicom2stl.utils import threads
+from dicom2stl.Dicom2STL import volumeProcessingPipeline
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        self.itk = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+        self.backend = vtkSMPTools.GetBackend()
+        self.smp = vtkSMPTools.GetEstimatedNumberOfThreads()
+        self.vtk = vtkMultiThreader.GetGlobalMaximumNumberOfThreads()
+        self.vtkDefault = vtkMultiThreader.GetGlobalDefaultNumberOfThreads()
+
+    def tearDown(self):
+        sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(self.itk)
+        vtkSMPTools.SetBackend(self.backend)
+        vtkSMPTools.Initialize(self.smp)
+        vtkMultiThreader.SetGlobalMaximumNumberOfThreads(self.vtk)
+        vtkMultiThreader.SetGlobalDefaultNumberOfThreads(self.vtkDefault)
+
+    def test_setNumberOfThreads(self):
+        print("\nTesting threads.setNumberOfThreads")
+        self.assertEqual(threads.setNumberOfThreads(3), 3)
+        settings = threads.getNumberOfThreads()
+        self.assertEqual(settings["itk"], 3)
+        self.assertEqual(settings["vtkMultiThreader"], 3)
+        self.assertNotEqual(settings["vtkBackend"], "Sequential")
+
+        self.assertEqual(threads.setNumberOfThreads(0), os.cpu_count())
+        self.assertEqual(threads.getNumberOfThreads()["itk"], os.cpu_count())
+
+        # None keeps the current settings
+        self.assertIsNone(threads.setNumberOfThreads(None))
+        self.assertEqual(threads.getNumberOfThreads()["itk"], os.cpu_count())
+
+        with self.assertRaises(ValueError):
+            threads.setNumberOfThreads(-1)
+
+    def test_threadCount(self):
+        print("\nTesting threads.threadCount")
+        before = threads.getNumberOfThreads()
+        with threads.threadCount(3) as n:
+            self.assertEqual(n, 3)
+            self.assertEqual(threads.getNumberOfThreads()["itk"], 3)
+        self.assertEqual(threads.getNumberOfThreads(), before)
+
+        with threads.threadCount(None) as n:
+            self.assertIsNone(n)
+            self.assertEqual(threads.getNumberOfThreads(), before)
+
+        # restored when the block raises too
+        with self.assertRaises(RuntimeError):
+            with threads.threadCount(2):
+                raise RuntimeError
+        self.assertEqual(threads.getNumberOfThreads(), before)
+
+    def test_pipelineThreads(self):
+        print("\nTesting the pipelines' threads parameter")
+        before = threads.getNumberOfThreads()
+        seen = []
+
+        def stage(img):
+            seen.append(threads.getNumberOfThreads()["itk"])
+            return img
+
+        img = create_data.make_tetra(16)
+        volumeProcessingPipeline(img, False, numThreads=2)
+        self.assertEqual(threads.getNumberOfThreads(), before)
+        slabpipeline.runSlabPipeline(
+            slabpipeline.imageSlabReader(img), 8, [("s", stage, 0)], 16, numThreads=3
+        )
+        self.assertEqual(seen, [3, 3])
+        self.assertEqual(threads.getNumberOfThreads(), before)
+
+    def test_processContext(self):
+        print("\nTesting threads.processContext")
+        self.assertIn(
+            threads.processContext().get_start_method(), ["forkserver", "spawn"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
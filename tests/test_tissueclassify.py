@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+import vtk
+from vtk.util import numpy_support
+
+from dicom2stl.Dicom2STL import getTissueThresholds
+from dicom2stl.utils import tissueclassify
+from dicom2stl.utils.sitk2vtk import sitk2vtk
+
+
+class TestTissueClassify(unittest.TestCase):
+    TISSUES = ["bone", "skin", "soft", "fat"]
+
+    def makeCT(self, pixelType=np.int16):
+        """Air, fat, soft tissue and bone, in Hounsfield units, with noise."""
+        rng = np.random.default_rng(7)
+        array = np.full((24, 48, 48), -1000.0)
+        array[2:22, 4:44, 4:44] = -100.0
+        array[4:20, 8:40, 8:40] = 45.0
+        array[8:16, 16:32, 16:32] = 1000.0
+        array += rng.normal(0.0, 15.0, array.shape)
+        return sitk.GetImageFromArray(array.astype(pixelType))
+
+    def thresholds(self):
+        return [getTissueThresholds(x)[0] for x in TestTissueClassify.TISSUES]
+
+    def test_lut(self):
+        print("\nTesting tissueclassify.buildLUT")
+        lut = tissueclassify.buildLUT(np.int16, [[200.0, 800.0, 1300.0, 1500.0]])
+        self.assertEqual(len(lut), 65536)
+        self.assertEqual(lut[199 + 32768], 0)
+        self.assertEqual(lut[200 + 32768], 2)
+        self.assertEqual(lut[1000 + 32768], 3)
+        self.assertEqual(lut[1501 + 32768], 0)
+        self.assertEqual(len(tissueclassify.buildLUT(np.uint8, [])), 256)
+
+    def test_doubleThreshold(self):
+        print("\nTesting tissueclassify against sitk.DoubleThreshold")
+        thresholds = self.thresholds()
+        for pixelType in [np.int16, np.float32]:
+            img = self.makeCT(pixelType)
+            labels = sitk.GetArrayFromImage(
+                tissueclassify.tissueLabels(img, thresholds)
+            )
+            for i, t in enumerate(thresholds):
+                expected = sitk.GetArrayFromImage(sitk.DoubleThreshold(img, *t, 1, 0))
+                self.assertGreater(expected.sum(), 0)
+                self.assertTrue(np.array_equal((labels >> i) & 1, expected))
+
+        with self.assertRaises(ValueError):
+            tissueclassify.classifyVolume(img, thresholds + thresholds[:1])
+
+    def test_median(self):
+        print("\nTesting tissueclassify median filtered tissues")
+        img = self.makeCT()
+        thresholds = self.thresholds()
+        labels = sitk.GetArrayFromImage(
+            tissueclassify.tissueLabels(img, thresholds, [False, False, True, True])
+        )
+        for i, t in enumerate(thresholds):
+            expected = sitk.DoubleThreshold(img, *t, 255, 0)
+            if i >= 2:
+                expected = sitk.Median(expected, [3, 3, 1])
+            expected = sitk.GetArrayFromImage(expected) // 255
+            self.assertTrue(np.array_equal((labels >> i) & 1, expected))
+
+    def test_extractTissue(self):
+        print("\nTesting tissueclassify.extractTissue")
+        labels = tissueclassify.tissueLabels(self.makeCT(), self.thresholds())
+        vtkimg = sitk2vtk(labels)
+        for i in range(len(TestTissueClassify.TISSUES)):
+            tissue = tissueclassify.extractTissue(vtkimg, i)
+            values = numpy_support.vtk_to_numpy(tissue.GetPointData().GetScalars())
+            self.assertEqual(set(np.unique(values)) - {0, 1 << i}, set())
+            self.assertEqual(
+                np.count_nonzero(values),
+                np.count_nonzero((sitk.GetArrayFromImage(labels) >> i) & 1),
+            )
+            self.assertTrue(0 < tissueclassify.tissueIsovalue(i) < (1 << i))
+        self.assertIsInstance(tissue, vtk.vtkImageData)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+from tests import create_data
+from dicom2stl.Dicom2STL import loadVolume
+from dicom2stl.utils import volumecache
+
+
+class TestVolumeCache(unittest.TestCase):
+    CACHEDIR = "testvolcache"
+    VOLUME = "tetra-cache.nrrd"
+
+    @classmethod
+    def setUpClass(cls):
+        img = create_data.make_tetra(32, pixel_type=sitk.sitkInt16)
+        img.SetSpacing([0.5, 0.5, 1.5])
+        img.SetOrigin([1.0, 2.0, 3.0])
+        img.SetMetaData("0008|0060", "CT")
+        sitk.WriteImage(img, TestVolumeCache.VOLUME)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(TestVolumeCache.VOLUME)
+        shutil.rmtree(TestVolumeCache.CACHEDIR, ignore_errors=True)
+
+    def test_cacheKey(self):
+        print("\nTesting volumecache.cacheKey")
+        key1 = volumecache.cacheKey([TestVolumeCache.VOLUME], "1.2.3")
+        key2 = volumecache.cacheKey([TestVolumeCache.VOLUME], "1.2.4")
+        self.assertNotEqual(key1, key2)
+        st = os.stat(TestVolumeCache.VOLUME)
+        os.utime(
+            TestVolumeCache.VOLUME, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9)
+        )
+        key3 = volumecache.cacheKey([TestVolumeCache.VOLUME], "1.2.3")
+        self.assertNotEqual(key1, key3)
+
+    def test_storeAndLoad(self):
+        print("\nTesting volumecache store and load")
+        img = sitk.ReadImage(TestVolumeCache.VOLUME)
+        self.assertIsNone(
+            volumecache.loadCachedVolume(TestVolumeCache.CACHEDIR, "nokey")
+        )
+        volumecache.storeCachedVolume(TestVolumeCache.CACHEDIR, "key", img, "CT")
+        cached, modality = volumecache.loadCachedVolume(
+            TestVolumeCache.CACHEDIR, "key"
+        )
+        self.assertEqual(modality, "CT")
+        self.assertEqual(cached.GetSize(), img.GetSize())
+        self.assertEqual(cached.GetPixelID(), img.GetPixelID())
+        self.assertEqual(cached.GetSpacing(), img.GetSpacing())
+        self.assertEqual(cached.GetOrigin(), img.GetOrigin())
+        np.testing.assert_array_equal(
+            sitk.GetArrayViewFromImage(cached), sitk.GetArrayViewFromImage(img)
+        )
+
+    def test_loadVolume(self):
+        print("\nTesting loadVolume with a volume cache")
+        cachedir = os.path.join(TestVolumeCache.CACHEDIR, "volumes")
+        img1, mod1 = loadVolume([TestVolumeCache.VOLUME], volumeCacheDir=cachedir)
+        self.assertEqual(len(os.listdir(cachedir)), 2)
+        img2, mod2 = loadVolume([TestVolumeCache.VOLUME], volumeCacheDir=cachedir)
+        self.assertEqual(mod1, mod2)
+        self.assertEqual(img1.GetSize(), img2.GetSize())
+        np.testing.assert_array_equal(
+            sitk.GetArrayViewFromImage(img1), sitk.GetArrayViewFromImage(img2)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
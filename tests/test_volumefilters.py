@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+from dicom2stl.utils import volumefilters
+
+
+class TestVolumeFilters(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # a noisy step edge: 0 for x < 16, 200 for x >= 16
+        arr = np.zeros((24, 24, 32), dtype=np.float32)
+        arr[:, :, 16:] = 200.0
+        rng = np.random.default_rng(3)
+        arr += rng.normal(0.0, 20.0, arr.shape).astype(np.float32)
+        cls.volume = sitk.Cast(sitk.GetImageFromArray(arr), sitk.sitkInt16)
+
+    def test_curvature(self):
+        print("\nTesting volumefilters.smoothVolume curvature")
+        ref = sitk.Cast(
+            sitk.CurvatureAnisotropicDiffusion(
+                sitk.Cast(TestVolumeFilters.volume, sitk.sitkFloat32), 0.03
+            ),
+            sitk.sitkInt16,
+        )
+        out = volumefilters.smoothVolume(TestVolumeFilters.volume)
+        np.testing.assert_array_equal(
+            sitk.GetArrayViewFromImage(out), sitk.GetArrayViewFromImage(ref)
+        )
+
+    def test_engines(self):
+        print("\nTesting volumefilters.smoothVolume engines")
+        noisy = sitk.GetArrayViewFromImage(TestVolumeFilters.volume)
+        for engine in volumefilters.SMOOTHING_ENGINES:
+            out = volumefilters.smoothVolume(TestVolumeFilters.volume, engine)
+            self.assertEqual(out.GetSize(), TestVolumeFilters.volume.GetSize())
+            self.assertEqual(out.GetPixelID(), sitk.sitkInt16)
+            arr = sitk.GetArrayViewFromImage(out).astype(float)
+
+            # noise is reduced on both sides of the edge
+            for side in [slice(2, 12), slice(20, 30)]:
+                self.assertLess(
+                    arr[4:-4, 4:-4, side].std(), 0.75 * noisy[4:-4, 4:-4, side].std()
+                )
+            # the edge is kept
+            step = arr[:, :, 17].mean() - arr[:, :, 14].mean()
+            self.assertGreater(step, 150.0, engine)
+
+            self.assertGreaterEqual(volumefilters.smoothingHalo(engine), 1)
+
+        with self.assertRaises(ValueError):
+            volumefilters.smoothVolume(TestVolumeFilters.volume, "box")
+
+    def test_medianEngines(self):
+        print("\nTesting volumefilters.medianVolume engines")
+        label = sitk.BinaryThreshold(TestVolumeFilters.volume, 100, 10000, 255, 0)
+        narrow = sitk.Clamp(TestVolumeFilters.volume, lowerBound=-50, upperBound=150)
+        wide = TestVolumeFilters.volume * 20
+        self.assertEqual(volumefilters.chooseMedianEngine(label, True), "majority")
+        self.assertEqual(volumefilters.chooseMedianEngine(narrow), "histogram")
+        self.assertEqual(volumefilters.chooseMedianEngine(wide), "median")
+
+        for radius in [[3, 3, 1], [2, 2, 2]]:
+            for img, binary, engines in [
+                (label, True, ["auto", "histogram", "majority"]),
+                (narrow, False, ["auto", "histogram"]),
+                (wide, False, ["auto", "histogram"]),
+            ]:
+                ref = sitk.GetArrayFromImage(sitk.Median(img, radius))
+                for engine in engines:
+                    out = volumefilters.medianVolume(img, radius, engine, binary)
+                    self.assertEqual(out.GetPixelID(), img.GetPixelID())
+                    np.testing.assert_array_equal(
+                        sitk.GetArrayFromImage(out), ref, err_msg=engine
+                    )
+
+        # an opening and closing is close to the median, but not the same
+        out = volumefilters.medianVolume(label, [1, 1, 1], "morphology", True)
+        ref = sitk.GetArrayFromImage(sitk.Median(label, [1, 1, 1]))
+        self.assertLess(np.mean(sitk.GetArrayFromImage(out) != ref), 0.05)
+        self.assertEqual(volumefilters.medianHalo("morphology", [1, 1, 1]), 4)
+
+        with self.assertRaises(ValueError):
+            volumefilters.medianVolume(narrow, engine="majority")
+
+
+if __name__ == "__main__":
+    unittest.main()
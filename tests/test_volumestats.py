@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+
+import os
+import shutil
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+from tests import create_data
+from dicom2stl.utils import volumecache
+from dicom2stl.utils import volumestats
+
+
+class TestVolumeStats(unittest.TestCase):
+    CACHEDIR = "teststatscache"
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TestVolumeStats.CACHEDIR, ignore_errors=True)
+
+    def makeCT(self):
+        """Air, soft tissue and bone, in Hounsfield units, with noise."""
+        rng = np.random.default_rng(7)
+        array = np.full((40, 64, 64), -1000.0)
+        array[5:35, 8:56, 8:56] = 40.0
+        array[15:25, 24:40, 24:40] = 1000.0
+        array += rng.normal(0.0, 20.0, array.shape)
+        return sitk.GetImageFromArray(array.astype(np.int16))
+
+    def test_integerStats(self):
+        print("\nTesting volumestats.computeStats on an int16 volume")
+        img = self.makeCT()
+        array = sitk.GetArrayFromImage(img)
+        stats = volumestats.computeStats(img)
+
+        self.assertEqual(stats["min"], array.min())
+        self.assertEqual(stats["max"], array.max())
+        self.assertAlmostEqual(stats["mean"], array.mean(), places=6)
+        self.assertEqual(stats["count"], array.size)
+        for p in volumestats.PERCENTILES:
+            self.assertAlmostEqual(
+                stats["percentiles"][str(p)],
+                np.percentile(array, p, method="inverted_cdf"),
+                delta=1.0,
+            )
+
+        # otsu splits air from the rest, multi-otsu also splits off bone
+        otsu = sitk.OtsuThresholdImageFilter()
+        otsu.Execute(img)
+        self.assertAlmostEqual(stats["otsu"], otsu.GetThreshold(), delta=10.0)
+        self.assertTrue(-1000 < stats["otsu"] < 40)
+        lower, upper = stats["multiOtsu"]
+        self.assertTrue(-1000 < lower < 40)
+        self.assertTrue(40 < upper < 1000)
+        self.assertEqual(volumestats.suggestIsovalue(stats, "multiotsu"), upper)
+        with self.assertRaises(ValueError):
+            volumestats.suggestIsovalue(stats, "median")
+
+        bone = np.count_nonzero((array >= 800) & (array <= 1300)) / array.size
+        self.assertAlmostEqual(
+            volumestats.fractionInRange(stats, 800, 1300), bone, delta=0.002
+        )
+
+    def test_floatStats(self):
+        print("\nTesting volumestats.computeStats on a float volume")
+        img = create_data.make_tetra(32, pixel_type=sitk.sitkFloat32)
+        array = sitk.GetArrayFromImage(img)
+        stats = volumestats.computeStats(img)
+        self.assertEqual(stats["min"], array.min())
+        self.assertEqual(stats["max"], array.max())
+        self.assertAlmostEqual(stats["mean"], array.mean(), delta=1.0)
+        self.assertTrue(array.min() < stats["otsu"] < array.max())
+        self.assertEqual(volumestats.padValue(stats, img), array.min())
+        self.assertEqual(volumestats.padValue(None, img), array.min())
+
+    def test_checkThresholds(self):
+        print("\nTesting volumestats.checkThresholds")
+        stats = volumestats.computeStats(self.makeCT())
+        self.assertEqual(
+            volumestats.checkThresholds(stats, [200.0, 800.0, 1300.0, 1500.0]), []
+        )
+        self.assertEqual(
+            len(volumestats.checkThresholds(stats, [-122.0, -112.0, -96.0, -70.0])),
+            1,
+        )
+        # an 8 bit volume can not be in Hounsfield units
+        small = volumestats.computeStats(create_data.make_tetra(32))
+        warnings = volumestats.checkThresholds(small, [200.0, 800.0, 1300.0, 1500.0])
+        self.assertEqual(len(warnings), 1)
+        self.assertIn("Hounsfield", warnings[0])
+
+    def test_cachedStats(self):
+        print("\nTesting volume cache statistics")
+        img = self.makeCT()
+        stats = volumestats.computeStats(img)
+        cacheDir = TestVolumeStats.CACHEDIR
+        self.assertIsNone(volumecache.loadCachedStats(cacheDir, "key"))
+        volumecache.storeCachedVolume(cacheDir, "key", img, "CT")
+        self.assertIsNone(volumecache.loadCachedStats(cacheDir, "key"))
+        volumecache.storeCachedStats(cacheDir, "key", stats)
+        self.assertEqual(volumecache.loadCachedStats(cacheDir, "key"), stats)
+        self.assertIsNotNone(volumecache.loadCachedVolume(cacheDir, "key"))
+        self.assertTrue(os.path.exists(os.path.join(cacheDir, "key.json")))
+
+
+if __name__ == "__main__":
+    unittest.main()
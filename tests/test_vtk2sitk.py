@@ -1,11 +1,20 @@
 #! /usr/bin/env python
 
+import gc
 import unittest
 
+import numpy as np
 import SimpleITK as sitk
 import vtk
+from vtk.util import numpy_support
 from tests import compare_stats
-from SimpleITK.utilities.vtk import vtk2sitk
+from dicom2stl.utils.sitk2vtk import sitk2vtk
+from dicom2stl.utils import vtk2sitk as vtk2sitk_module
+from dicom2stl.utils.vtk2sitk import vtk2sitk
+
+
+def bufferAddress(img):
+    return sitk.GetArrayViewFromImage(img).__array_interface__["data"][0]
 
 
 def printStats(stats):
@@ -74,6 +83,112 @@ class TestVTK2SITK(unittest.TestCase):
         else:
             self.fail("Statistics comparison failed")
 
+    def test_roundTrip(self):
+        print("\nTesting vtk2sitk shares the buffer of a sitk2vtk image")
+        img = sitk.GaussianSource(sitk.sitkInt16, [64, 48, 32])
+        img.SetSpacing([1.0, 2.0, 3.0])
+        vol = sitk2vtk(img)
+        del img
+        gc.collect()
+
+        # a numpy view of a shared image would copy it, so the sharing is
+        # seen through a pixel written on the VTK side
+        back = vtk2sitk(vol)
+        numpy_support.vtk_to_numpy(vol.GetPointData().GetScalars())[0] = 1234
+        self.assertEqual(back[0, 0, 0], 1234)
+        self.assertEqual(back.GetSize(), (64, 48, 32))
+        self.assertEqual(back.GetSpacing(), (1.0, 2.0, 3.0))
+
+        img2d = sitk.GaussianSource(sitk.sitkFloat32, [40, 30])
+        vol2d = sitk2vtk(img2d)
+        back2d = vtk2sitk(vol2d)
+        numpy_support.vtk_to_numpy(vol2d.GetPointData().GetScalars())[0] = 5.0
+        self.assertEqual(back2d.GetSize(), (40, 30))
+        self.assertEqual(back2d[0, 0], 5.0)
+        self.assertEqual(img2d[0, 0], 5.0)
+
+        # writing to the returned image leaves the VTK image alone
+        back2d[0, 0] = 9.0
+        self.assertEqual(vol2d.GetScalarComponentAsFloat(0, 0, 0, 0), 5.0)
+
+    def test_changedGeometry(self):
+        print("\nTesting vtk2sitk leaves the shared image's geometry alone")
+        img = sitk.GaussianSource(sitk.sitkInt16, [32, 24, 16])
+        img.SetSpacing([1.0, 2.0, 3.0])
+        change = vtk.vtkImageChangeInformation()
+        change.SetInputData(sitk2vtk(img))
+        change.SetOutputSpacing(0.5, 0.5, 0.5)
+        change.SetOutputOrigin(10.0, 20.0, 30.0)
+        change.Update()
+
+        back = vtk2sitk(change.GetOutput())
+        self.assertIsNot(back, img)
+        self.assertEqual(back.GetSpacing(), (0.5, 0.5, 0.5))
+        self.assertEqual(back.GetOrigin(), (10.0, 20.0, 30.0))
+        self.assertEqual(img.GetSpacing(), (1.0, 2.0, 3.0))
+        self.assertEqual(img.GetOrigin(), (0.0, 0.0, 0.0))
+        self.assertTrue(
+            np.array_equal(
+                sitk.GetArrayViewFromImage(back), sitk.GetArrayViewFromImage(img)
+            )
+        )
+
+    def test_reuseBuffer(self):
+        print("\nTesting vtk2sitk copies into a reused buffer")
+        if vtk2sitk_module._SetImageFromArray is None:
+            self.skipTest("no tested SimpleITK copy into an existing image")
+        img = sitk.GaussianSource(sitk.sitkInt16, [64, 48, 32])
+        shift = vtk.vtkImageShiftScale()
+        shift.SetInputData(sitk2vtk(img))
+        shift.SetShift(1.0)
+        shift.Update()
+        expected = sitk.GetArrayFromImage(img) + 1
+
+        first = vtk2sitk(shift.GetOutput())
+        self.assertTrue(np.array_equal(sitk.GetArrayViewFromImage(first), expected))
+
+        out = sitk.Image(first.GetSize(), first.GetPixelID())
+        address = bufferAddress(out)
+        second = vtk2sitk(shift.GetOutput(), out=out)
+        self.assertIs(second, out)
+        self.assertEqual(bufferAddress(second), address)
+        self.assertTrue(np.array_equal(sitk.GetArrayViewFromImage(second), expected))
+
+        # an image of another type is not reused
+        other = sitk.Image(first.GetSize(), sitk.sitkFloat32)
+        self.assertIsNot(vtk2sitk(shift.GetOutput(), out=other), other)
+
+    def test_setImageFromArray(self):
+        print("\nTesting the private SimpleITK copy is there when it is used")
+        # a SimpleITK update that drops it must fail here, not fall back
+        if sitk.Version.MajorVersion() == vtk2sitk_module.SET_IMAGE_MAJOR_VERSION:
+            self.assertTrue(callable(vtk2sitk_module._SetImageFromArray))
+        else:
+            self.assertIsNone(vtk2sitk_module._SetImageFromArray)
+
+    def test_vector(self):
+        print("\nTesting vtk2sitk on a vector image")
+        img = sitk.GaussianSource(sitk.sitkUInt8, [32, 24, 16])
+        rgb = sitk.Compose([img, img // 2, img // 4])
+        cast = vtk.vtkImageCast()
+        cast.SetInputData(sitk2vtk(rgb))
+        cast.SetOutputScalarTypeToFloat()
+        cast.Update()
+
+        vec = vtk2sitk(cast.GetOutput())
+        self.assertEqual(vec.GetNumberOfComponentsPerPixel(), 3)
+        self.assertEqual(vec.GetSize(), (32, 24, 16))
+        self.assertTrue(
+            np.array_equal(
+                sitk.GetArrayViewFromImage(vec),
+                sitk.GetArrayViewFromImage(rgb).astype(np.float32),
+            )
+        )
+        scalars = numpy_support.vtk_to_numpy(
+            cast.GetOutput().GetPointData().GetScalars()
+        )
+        self.assertEqual(scalars.shape, (32 * 24 * 16, 3))
+
 
 if __name__ == "__main__":
     unittest.main()
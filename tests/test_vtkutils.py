@@ -7,6 +7,7 @@ import SimpleITK as sitk
 import create_data
 import vtk
 from dicom2stl.utils import vtkutils
+from dicom2stl.utils.sitk2vtk import sitk2vtk
 
 
 class TestVTKUtils(unittest.TestCase):
@@ -98,6 +99,43 @@ class TestVTKUtils(unittest.TestCase):
         except BaseException:
             print("remove tetra.vtk failed")
 
+    def test_extractors(self):
+        print("Testing extractSurface extractors")
+        vol = sitk2vtk(create_data.make_tetra(48))
+        counts = {}
+        for extractor in vtkutils.EXTRACTORS:
+            # an isovalue between voxel values, so there are no degenerate
+            # triangles and every extractor gives the same triangles
+            mesh = vtkutils.extractSurface(vol, 100.5, extractor)
+            counts[extractor] = mesh.GetNumberOfPolys()
+            # at a voxel value, flying edges also makes degenerate triangles
+            mesh = vtkutils.cleanMesh(vtkutils.extractSurface(vol, 100.0, extractor))
+            counts[extractor + " cleaned"] = mesh.GetNumberOfPolys()
+        print(counts)
+        self.assertGreater(counts["contour"], 0)
+        for extractor in vtkutils.EXTRACTORS:
+            self.assertEqual(counts[extractor], counts["contour"])
+            self.assertEqual(
+                counts[extractor + " cleaned"], counts["contour cleaned"]
+            )
+
+        with self.assertRaises(ValueError):
+            vtkutils.extractSurface(vol, 100.0, "cubes")
+
+    def test_labelExtractors(self):
+        print("Testing extractSurface label extractors")
+        labels = sitk.BinaryThreshold(create_data.make_tetra(48), 100, 255, 255, 0)
+        vol = sitk2vtk(labels)
+        scalar = vtkutils.extractSurface(vol, 64.0).GetNumberOfPolys()
+        discrete = vtkutils.extractSurface(vol, 255.0, "discrete-flyingedges")
+        self.assertEqual(discrete.GetNumberOfPolys(), scalar)
+
+        nets = vtkutils.extractSurface(vol, 255.0, "surfacenets")
+        self.assertGreater(nets.GetNumberOfPolys(), 0)
+        # triangles, for the STL writer and the mesh reduction
+        self.assertEqual(nets.GetPolys().GetMaxCellSize(), 3)
+        self.assertIn("surfacenets", vtkutils.SMOOTH_EXTRACTORS)
+
 
 if __name__ == "__main__":
     unittest.main()
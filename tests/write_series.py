@@ -9,8 +9,11 @@ import numpy as np
 
 pixel_dtypes = {"int16": np.int16, "float64": np.float64}
 
+# Compressors GDCM can write, plus RLE which is added with pydicom
+compressors = ["JPEG", "JPEG2000", "RLE"]
 
-def writeSlices(series_tag_values, new_img, out_dir, writer, i):
+
+def writeSlices(series_tag_values, new_img, out_dir, writer, i, compressor=None):
     image_slice = new_img[:, :, i]
 
     # Tags shared by the series.
@@ -45,9 +48,19 @@ def writeSlices(series_tag_values, new_img, out_dir, writer, i):
 
     # Write to the output directory and add the extension dcm, to force writing
     # in DICOM format.
-    writer.SetFileName(os.path.join(out_dir, str(i) + ".dcm"))
+    file_name = os.path.join(out_dir, str(i) + ".dcm")
+    writer.SetFileName(file_name)
     writer.Execute(image_slice)
 
+    if compressor == "RLE":
+        # GDCMImageIO cannot write RLE, so compress the slice with pydicom
+        import pydicom
+        from pydicom.uid import RLELossless
+
+        ds = pydicom.dcmread(file_name)
+        ds.compress(RLELossless)
+        ds.save_as(file_name)
+
 
 # Write the 3D image as a series
 # IMPORTANT: There are many DICOM tags that need to be updated when you modify
@@ -61,8 +74,13 @@ def writeSlices(series_tag_values, new_img, out_dir, writer, i):
 #                (http://www.dclunie.com/dicom3tools.html).
 
 
-def write_series(new_img, data_directory, pixel_dtype=np.int16):
+def write_series(new_img, data_directory, pixel_dtype=np.int16, compressor=None):
     writer = sitk.ImageFileWriter()
+    if compressor in ("JPEG", "JPEG2000"):
+        # lossless JPEG (process 14) or lossless JPEG 2000
+        writer.SetImageIO("GDCMImageIO")
+        writer.SetUseCompression(True)
+        writer.SetCompressor(compressor)
     # Use the study/series/frame of reference information given in the
     # meta-data dictionary and not the automatically generated information
     # from the file IO
@@ -129,7 +147,7 @@ def write_series(new_img, data_directory, pixel_dtype=np.int16):
     list(
         map(
             lambda i: writeSlices(
-                series_tag_values, new_img, data_directory, writer, i
+                series_tag_values, new_img, data_directory, writer, i, compressor
             ),
             range(new_img.GetDepth()),
         )